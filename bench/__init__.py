@@ -0,0 +1 @@
+""" Crawler benchmark harness: local stand-in servers and a runner (python -m bench.run). """
@@ -0,0 +1,69 @@
+"""
+Synthetic corpora served by the stand-in servers.
+
+Every day of posts is generated from (seed, day) on first use, so any date
+range can be served without storing anything and two runs of the same
+benchmark see the same posts. Texts mix English stopwords (what the random
+crawlers search for) with hashtags drawn from a Zipf-like distribution
+(what the 100_posts crawlers and crawl_day search for), so page counts per
+query look like the real ones: a few heavy tags, a long tail.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import random
+from functools import lru_cache
+
+STOPWORDS = ["the", "and", "of", "to", "in", "is", "that", "for", "it", "on", "with", "as",
+             "this", "was", "are", "be", "at", "by", "not", "or", "from", "we", "have", "an"]
+WORDS = ["climate", "weather", "heat", "flood", "policy", "energy", "solar", "wind", "carbon",
+         "ocean", "storm", "report", "people", "city", "water", "future", "science", "today"]
+TAGS = ["climatechange", "climate", "climatecrisis", "globalwarming", "environment", "sustainability",
+        "energy", "renewableenergy", "cop29", "netzero", "fossilfuels", "biodiversity", "science",
+        "ocean", "heatwave", "flooding", "solar", "wildfires", "pollution", "climateaction",
+        "extremeweather", "drought", "greennewdeal", "ev", "carbon", "activism", "nature", "wind",
+        "agriculture", "water", "plastic", "recycling", "weather", "news", "politics", "earth",
+        "forest", "arctic", "coal", "methane"]
+LANGS = ["en"] * 8 + ["de", "fr"]
+
+
+class Corpus:
+    """ posts_per_day posts per UTC day, `authors` distinct accounts. """
+
+    def __init__(self, posts_per_day=500, authors=2000, seed=0):
+        self.posts_per_day = posts_per_day
+        self.authors = authors
+        self.seed = seed
+        # tag i drawn with weight 1 / (i + 1): climatechange is on about a quarter of the tagged posts
+        self._tag_weights = [1 / (i + 1) for i in range(len(TAGS))]
+
+    @staticmethod
+    def top_tags(k=100) -> list[str]:
+        return TAGS[:k]
+
+    @lru_cache(maxsize=64)
+    def day(self, day: dt.date) -> list[dict]:
+        """ Posts of one day, newest first, as neutral dicts both servers format. """
+        rng = random.Random(f"{self.seed}:{day.isoformat()}")
+        start = dt.datetime.combine(day, dt.time.min, tzinfo=dt.timezone.utc)
+        posts = []
+        for seq in range(self.posts_per_day):
+            created = start + dt.timedelta(microseconds=rng.randrange(86_400_000_000))
+            words = rng.choices(STOPWORDS, k=rng.randint(3, 8)) + rng.choices(WORDS, k=rng.randint(2, 6))
+            rng.shuffle(words)
+            tags = sorted(set(rng.choices(TAGS, weights=self._tag_weights, k=rng.randint(0, 3))))
+            author = rng.randrange(self.authors)
+            posts.append({
+                "seq": seq,
+                "created": created,
+                "text": " ".join(words + [f"#{t}" for t in tags]),
+                "tokens": frozenset(words) | frozenset(tags),
+                "tags": tags,
+                "lang": rng.choice(LANGS),
+                "author": author,
+                "reply_to": rng.randrange(self.authors) if rng.random() < 0.2 else None,
+                "mention": rng.randrange(self.authors) if rng.random() < 0.1 else None,
+            })
+        posts.sort(key=lambda p: p["created"], reverse=True)
+        return posts
@@ -0,0 +1,89 @@
+"""
+Client-side probe for bench/run.py.
+
+bench puts this directory on PYTHONPATH, so Python imports it at start-up
+in every crawler it runs; nothing in the crawlers changes. When
+BENCH_PROBE_OUT is set it records:
+
+- the time spent in time.sleep / asyncio.sleep (rate-limit waits, 429 and
+  5xx backoff), summed over threads and tasks; the background token
+  refresher of common.auth is not counted, it never blocks a request;
+- the latency of every HTTP request as sent by requests (HTTPAdapter.send)
+  or httpx (AsyncClient.send), i.e. without the time spent waiting for a
+  rate-limit token before it,
+
+and writes them as JSON to BENCH_PROBE_OUT at exit.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+OUT = os.environ.get("BENCH_PROBE_OUT")
+
+if OUT:
+    _lock = threading.Lock()
+    _probe = {"slept": 0.0, "latencies": []}
+
+    def _add_sleep(seconds):
+        if seconds and seconds > 0:
+            with _lock:
+                _probe["slept"] += seconds
+
+    _time_sleep = time.sleep
+
+    def _sleep(seconds):
+        _add_sleep(seconds)
+        _time_sleep(seconds)
+
+    time.sleep = _sleep
+
+    import asyncio
+
+    _asyncio_sleep = asyncio.sleep
+
+    async def _asleep(delay, result=None):
+        if sys._getframe(1).f_globals.get("__name__") != "common.auth":
+            _add_sleep(delay)
+        return await _asyncio_sleep(delay, result)
+
+    asyncio.sleep = _asleep
+
+    def _timed(send):
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return send(*args, **kwargs)
+            finally:
+                with _lock:
+                    _probe["latencies"].append(time.perf_counter() - t0)
+        return wrapper
+
+    def _atimed(send):
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await send(*args, **kwargs)
+            finally:
+                with _lock:
+                    _probe["latencies"].append(time.perf_counter() - t0)
+        return wrapper
+
+    try:
+        import requests.adapters
+        requests.adapters.HTTPAdapter.send = _timed(requests.adapters.HTTPAdapter.send)
+    except ImportError:
+        pass
+    try:
+        import httpx
+        httpx.AsyncClient.send = _atimed(httpx.AsyncClient.send)
+    except ImportError:
+        pass
+
+    @atexit.register
+    def _dump():
+        with _lock, open(OUT, "w", encoding="utf-8") as fh:
+            json.dump(_probe, fh)
@@ -0,0 +1,226 @@
+"""
+Crawler benchmark: the real download scripts against the local stand-ins.
+
+Every (target, scenario) pair runs the unmodified script in a subprocess,
+in a fresh temporary directory, with the base URLs pointed at stand-in
+servers (BLUESKY_HOST, MASTODON_INSTANCE), a short date range (CRAWL_START
+/ CRAWL_END) and the client probe (bench/probe) on PYTHONPATH. Reported
+per run:
+
+- posts/sec:      saved posts (lines of the crawler's JSONL logs) / wall time
+- req/post:       requests seen by the stand-ins per saved post
+- sleep s:        time the crawler spent in sleep(), summed over threads/tasks
+- p50 / p99 ms:   client-side request latency
+
+`--out` keeps the numbers as JSON; `--baseline` compares against such a
+file and exits with status 1 when posts/sec, req/post or p99 got worse by
+more than `--tolerance`.
+
+    python -m bench.run
+    python -m bench.run --targets mastodon-100 --scenarios clean ratelimit --out bench.json
+    python -m bench.run --baseline bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bench.corpus import STOPWORDS, Corpus
+from bench.servers import BlueskyStandIn, Faults, MastodonStandIn
+
+ROOT = Path(__file__).resolve().parents[1]
+PROBE_DIR = ROOT / "bench" / "probe"
+START = dt.date(2025, 3, 1)
+TIMEOUT = 900             # seconds per run
+
+TARGETS = {
+    "bluesky-100": {"script": "bluesky/code/100_posts/download_100.py", "platform": "bluesky"},
+    "bluesky-random": {"script": "bluesky/code/random/download_random.py", "platform": "bluesky"},
+    "bluesky-crawl-day": {"script": "bluesky/code/100_posts/crawl_day.py", "platform": "bluesky"},
+    "mastodon-100": {"script": "mastodon/code/100_posts/download_100.py", "platform": "mastodon",
+                     "collection": "100_posts"},
+    "mastodon-random": {"script": "mastodon/code/random/download_random.py", "platform": "mastodon",
+                        "collection": "random"},
+}
+
+SCENARIOS = {
+    "clean": {"latency": 0.005},
+    "slow": {"latency": 0.08, "jitter": 0.08},
+    "ratelimit": {"latency": 0.005, "rate_limit": 40, "window": 4},
+    "errors": {"latency": 0.005, "error_rate": 0.05},
+    # the crawlers refresh 300 s ahead of expiry: a 301 s token is stale after 1 s
+    "token-expiry": {"latency": 0.005, "token_ttl": 301},
+}
+
+# metric -> True when higher is better
+METRICS = {"posts_per_sec": True, "requests_per_post": False, "p99_ms": False}
+
+
+def count_saved(root: Path) -> int:
+    """ Posts written by a crawler: lines of its .jsonl / .jsonl.gz logs. """
+    n = 0
+    for path in root.rglob("*.jsonl*"):
+        if path.name.endswith(".jsonl"):
+            with path.open("rb") as fh:
+                n += sum(1 for line in fh if line.strip())
+        elif path.name.endswith(".jsonl.gz"):
+            with gzip.open(path, "rb") as fh:
+                n += sum(1 for line in fh if line.strip())
+    return n
+
+
+def _env(target, server_url, workdir: Path, days, top_words):
+    spec = TARGETS[target]
+    env = dict(os.environ)
+    last = START + dt.timedelta(days=days - 1)
+    env.update({
+        "CRAWL_START": START.isoformat(),
+        # the Bluesky scripts take an inclusive end, the Mastodon ones an exclusive one
+        "CRAWL_END": (last if spec["platform"] == "bluesky" else last + dt.timedelta(days=1)).isoformat(),
+        "BENCH_PROBE_OUT": str(workdir / "probe.json"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(PROBE_DIR), env.get("PYTHONPATH")])),
+        "PYTHONUNBUFFERED": "1",
+    })
+    if spec["platform"] == "bluesky":
+        env.update({"BLUESKY_HOST": server_url, "BLUESKY_USER": "bench", "BLUESKY_PASS": "bench"})
+        if target == "bluesky-random":
+            # the stopword queries come from nltk; a local copy of the corpus
+            # stopwords keeps the run offline (nltk.download fails quietly)
+            words = workdir / "nltk_data" / "corpora" / "stopwords" / "english"
+            words.parent.mkdir(parents=True, exist_ok=True)
+            words.write_text("\n".join(STOPWORDS) + "\n", encoding="utf-8")
+            env["NLTK_DATA"] = str(workdir / "nltk_data")
+        if target == "bluesky-crawl-day":
+            top = workdir / "bluesky" / "code" / "hashtag" / "100_posts" / "top100_hashtags.json"
+            top.parent.mkdir(parents=True, exist_ok=True)
+            top.write_text(json.dumps(Corpus.top_tags(top_words)), encoding="utf-8")
+    else:
+        env.update({
+            "MASTODON_INSTANCE": server_url, "MASTODON_TOKEN": "bench",
+            "MASTODON_OUT_DIR": str(workdir / "mastodon" / "dataset" / spec["collection"]),
+            "POST_STORE": str(workdir / "dataset" / "store" / spec["collection"]),
+        })
+    return env
+
+
+def run_one(target, scenario, days=3, posts_per_day=500, top_words=20, keep=False) -> dict:
+    spec = TARGETS[target]
+    faults = Faults(**SCENARIOS[scenario])
+    server_cls = BlueskyStandIn if spec["platform"] == "bluesky" else MastodonStandIn
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench-{target}-{scenario}-"))
+    with server_cls(Corpus(posts_per_day=posts_per_day), faults) as server:
+        env = _env(target, server.url, workdir, days, top_words)
+        t0 = time.perf_counter()
+        try:
+            proc = subprocess.run([sys.executable, str(ROOT / spec["script"])], cwd=workdir, env=env,
+                                  capture_output=True, text=True, timeout=TIMEOUT)
+            returncode, stderr = proc.returncode, proc.stderr
+        except subprocess.TimeoutExpired as exc:
+            returncode, stderr = None, f"timeout after {TIMEOUT} s\n{exc.stderr or ''}"
+        seconds = time.perf_counter() - t0
+        served = server.snapshot()
+
+    saved = count_saved(workdir)
+    probe = {"slept": 0.0, "latencies": []}
+    if (workdir / "probe.json").exists():
+        probe = json.loads((workdir / "probe.json").read_text(encoding="utf-8"))
+    lat = np.array(probe["latencies"]) * 1000
+    result = {
+        "target": target,
+        "scenario": scenario,
+        "ok": returncode == 0,
+        "seconds": round(seconds, 3),
+        "saved": saved,
+        "posts_per_sec": round(saved / seconds, 2) if seconds else 0.0,
+        "requests": served["total"],
+        "requests_per_post": round(served["total"] / saved, 3) if saved else None,
+        "status": served["status"],
+        "endpoints": served["requests"],
+        "sleep_seconds": round(probe["slept"], 3),
+        "p50_ms": round(float(np.percentile(lat, 50)), 2) if len(lat) else None,
+        "p99_ms": round(float(np.percentile(lat, 99)), 2) if len(lat) else None,
+        "faults": faults.as_dict(),
+    }
+    if returncode != 0:
+        result["error"] = (stderr or "").strip().splitlines()[-1:]
+    if keep:
+        result["workdir"] = str(workdir)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def compare(results, baseline, tolerance) -> list[str]:
+    """ Regressions of `results` against a previous run, as readable lines. """
+    old = {(r["target"], r["scenario"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        before = old.get((r["target"], r["scenario"]))
+        if before is None or not r["ok"] or not before["ok"]:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            a, b = before.get(metric), r.get(metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{r['target']} / {r['scenario']}: {metric} {a} -> {b} ({change:+.0%})")
+    return regressions
+
+
+def _fmt(value, spec=""):
+    return "-" if value is None else format(value, spec)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawler benchmark against local stand-in servers")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--days", type=int, default=3, help="days crawled per run")
+    parser.add_argument("--posts-per-day", type=int, default=500, help="size of the synthetic corpus")
+    parser.add_argument("--top-words", type=int, default=20, help="hashtags crawled by crawl_day")
+    parser.add_argument("--out", help="write the results here (.json)")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change counted as regression")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary crawl directories")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'target':18s} {'scenario':13s} {'ok':3s} {'saved':>6s} {'posts/s':>8s} {'req/post':>8s} "
+          f"{'sleep s':>8s} {'p50 ms':>7s} {'p99 ms':>7s}")
+    for target in args.targets:
+        for scenario in args.scenarios:
+            r = run_one(target, scenario, args.days, args.posts_per_day, args.top_words, args.keep)
+            results.append(r)
+            print(f"{target:18s} {scenario:13s} {'yes' if r['ok'] else 'NO':3s} {r['saved']:6d} "
+                  f"{r['posts_per_sec']:8.1f} {_fmt(r['requests_per_post'], '8.2f'):>8s} "
+                  f"{r['sleep_seconds']:8.2f} {_fmt(r['p50_ms'], '7.1f'):>7s} {_fmt(r['p99_ms'], '7.1f'):>7s}")
+            if not r["ok"]:
+                print(f"    {' '.join(r.get('error') or [])}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,659 @@
+"""
+Local stand-ins for the Bluesky XRPC and Mastodon APIs.
+
+Only what the crawlers call is served:
+
+- Bluesky:  com.atproto.server.createSession / refreshSession and
+            app.bsky.feed.searchPosts (q, lang, since, until, limit, cursor);
+- Mastodon: /api/v1/timelines/tag/:hashtag and /api/v1/timelines/public
+            (max_id, since_id, min_id, limit, Link header pagination), plus
+            /api/v1/instance and /api/v2/instance for Mastodon.py's version check,
+            and the /api/v1/streaming/ hashtag and public server-sent-events streams.
+
+`Faults` injects what the real servers do to a crawler: latency with
+jitter, 429s once a fixed-window quota is spent (with Retry-After and the
+platform's ratelimit headers), random 5xx, and short-lived access tokens
+(Bluesky answers 400 ExpiredToken, as bsky.social does). Each stand-in is
+a ThreadingHTTPServer speaking HTTP/1.1 keep-alive on a free local port,
+run in a daemon thread; `stats` counts requests by endpoint and status.
+
+`JetstreamStandIn` replays Jetstream messages (recorded with
+`python -m common.jetstream --record`, or made from a corpus by
+`corpus_events`) over a websocket, honouring `cursor` and
+`wantedCollections`, with optional forced disconnects.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import bisect
+import datetime as dt
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from bench.corpus import Corpus
+
+BSKY_PAGE_MAX = 100
+MASTODON_PAGE_MAX = 40
+MASTODON_LOOKBACK = 31      # days searched below max_id when no since_id is given
+
+
+class Faults:
+    """ What a stand-in does wrong, and how often. """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0, window=300,
+                 token_ttl=7200, seed=0):
+        self.latency = latency          # seconds added to every response
+        self.jitter = jitter            # + uniform(0, jitter) seconds
+        self.error_rate = error_rate    # share of requests answered with a 5xx
+        self.rate_limit = rate_limit    # requests per window, 0 = unlimited
+        self.window = window            # seconds
+        self.token_ttl = token_ttl      # lifetime of a Bluesky accessJwt, seconds
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _b64(obj) -> str:
+    raw = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def make_jwt(scope, sub, ttl) -> str:
+    now = int(time.time())
+    payload = {"scope": scope, "sub": sub, "iat": now, "exp": now + int(ttl)}
+    return f"{_b64({'alg': 'HS256', 'typ': 'at+jwt'})}.{_b64(payload)}.bench"
+
+
+def read_jwt(token):
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    when = dt.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return when if when.tzinfo else when.replace(tzinfo=dt.timezone.utc)
+
+
+def _iso(when) -> str:
+    return when.strftime("%Y-%m-%dT%H:%M:%S.") + f"{when.microsecond // 1000:03d}Z"
+
+
+class EventStream:
+    """ A text/event-stream response body: an iterator of raw chunks. """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep-alive, like the real servers
+    disable_nagle_algorithm = True    # headers and body go out as separate writes
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = None
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            raw = self.rfile.read(length)
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                body = None
+        status, payload, headers = self.server.app.handle(method, url.path, query, body, self.headers)
+        if isinstance(payload, EventStream):
+            self._stream(status, payload, headers)
+            return
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, status, events, headers):
+        """ Server-sent events until the generator ends or the client leaves. """
+        self.close_connection = True
+        self.send_response(status)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for chunk in events.chunks:
+                self.wfile.write(chunk.encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            events.chunks.close()
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+class StandIn:
+    """ Common part of both servers: faults, quota, stats, lifecycle. """
+
+    platform = ""
+
+    def __init__(self, corpus: Corpus | None = None, faults: Faults | None = None):
+        self.corpus = corpus or Corpus()
+        self.faults = faults or Faults()
+        self._rng = random.Random(self.faults.seed)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_used = 0
+        self.stats = {"requests": Counter(), "status": Counter(), "posts": 0}
+        self._httpd: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def start(self) -> str:
+        """ Serve on a free local port, returns the base URL. """
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.app = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -- faults ----------------------------------------------------------------
+
+    def _take(self):
+        """ (allowed, remaining, reset unix time) of the fixed quota window. """
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.faults.window:
+                self._window_start, self._window_used = now, 0
+            reset = self._window_start + self.faults.window
+            if self.faults.rate_limit and self._window_used >= self.faults.rate_limit:
+                return False, 0, reset
+            self._window_used += 1
+            remaining = max(self.faults.rate_limit - self._window_used, 0) if self.faults.rate_limit else 10_000
+            return True, remaining, reset
+
+    def _quota_headers(self, remaining, reset) -> dict:
+        raise NotImplementedError
+
+    def handle(self, method, path, query, body, headers):
+        endpoint = self.endpoint(path)
+        with self._lock:
+            self.stats["requests"][endpoint] += 1
+            delay = self.faults.latency + self._rng.uniform(0, self.faults.jitter)
+            fail = self._rng.random() < self.faults.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        allowed, remaining, reset = self._take()
+        extra = self._quota_headers(remaining, reset)
+        if not allowed:
+            extra["Retry-After"] = str(max(int(reset - time.time()) + 1, 1))
+            status, payload = 429, {"error": "RateLimitExceeded", "message": "Rate Limit Exceeded"}
+        elif fail:
+            status, payload = self._rng.choice([500, 502, 503]), {"error": "InternalServerError"}
+        else:
+            status, payload, more = self.route(method, path, query, body, headers)
+            extra.update(more)
+        with self._lock:
+            self.stats["status"][status] += 1
+        return status, payload, extra
+
+    def endpoint(self, path) -> str:
+        return path
+
+    def route(self, method, path, query, body, headers):
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": dict(self.stats["requests"]),
+                "status": {str(k): v for k, v in self.stats["status"].items()},
+                "posts": self.stats["posts"],
+                "total": sum(self.stats["requests"].values()),
+            }
+
+
+class BlueskyStandIn(StandIn):
+    """ bsky.social XRPC subset. """
+
+    platform = "bluesky"
+
+    def _quota_headers(self, remaining, reset):
+        limit = self.faults.rate_limit or 10_000
+        return {
+            "ratelimit-limit": str(limit),
+            "ratelimit-remaining": str(remaining),
+            "ratelimit-reset": str(int(reset)),
+            "ratelimit-policy": f"{limit};w={int(self.faults.window)}",
+        }
+
+    def endpoint(self, path):
+        return path.rsplit("/", 1)[-1]
+
+    def _session(self, did):
+        return {
+            "did": did,
+            "handle": did.split(":")[-1] + ".bench.test",
+            "accessJwt": make_jwt("com.atproto.access", did, self.faults.token_ttl),
+            "refreshJwt": make_jwt("com.atproto.refresh", did, 90 * 86400),
+        }
+
+    def route(self, method, path, query, body, headers):
+        name = self.endpoint(path)
+        if name == "com.atproto.server.createSession" and method == "POST":
+            identifier = (body or {}).get("identifier")
+            if not identifier or not (body or {}).get("password"):
+                return 401, {"error": "AuthenticationRequired"}, {}
+            return 200, self._session(f"did:plc:{identifier}"), {}
+
+        auth = headers.get("Authorization", "")
+        claims = read_jwt(auth[7:]) if auth.startswith("Bearer ") else None
+        if claims is None:
+            return 401, {"error": "AuthMissing", "message": "Authentication Required"}, {}
+        if claims["exp"] <= time.time():
+            return 400, {"error": "ExpiredToken", "message": "Token has expired"}, {}
+
+        if name == "com.atproto.server.refreshSession" and method == "POST":
+            if claims.get("scope") != "com.atproto.refresh":
+                return 400, {"error": "InvalidToken"}, {}
+            return 200, self._session(claims["sub"]), {}
+        if name == "app.bsky.feed.searchPosts" and method == "GET":
+            if claims.get("scope") != "com.atproto.access":
+                return 400, {"error": "InvalidToken"}, {}
+            return self._search(query)
+        return 501, {"error": "MethodNotImplemented"}, {}
+
+    def _search(self, query):
+        q = (query.get("q") or "").lower().lstrip("#")
+        lang = query.get("lang")
+        since = _parse_time(query.get("since")) or dt.datetime(2023, 1, 1, tzinfo=dt.timezone.utc)
+        until = _parse_time(query.get("until")) or dt.datetime.now(dt.timezone.utc)
+        limit = min(int(query.get("limit") or 25), BSKY_PAGE_MAX)
+        offset = int(query.get("cursor") or 0)
+        if (until - since).days > 31:
+            return 400, {"error": "InvalidRequest", "message": "window too large for the stand-in"}, {}
+
+        hits = []
+        day = until.date()
+        while day >= since.date():
+            for post in self.corpus.day(day):
+                if since <= post["created"] < until and q in post["tokens"] \
+                        and (not lang or post["lang"] == lang):
+                    hits.append(post)
+            day -= dt.timedelta(days=1)
+        page = hits[offset:offset + limit]
+        with self._lock:
+            self.stats["posts"] += len(page)
+        out = {"posts": [self._post_view(p) for p in page], "hitsTotal": len(hits)}
+        if offset + limit < len(hits):
+            out["cursor"] = str(offset + limit)
+        return 200, out, {}
+
+    def _post_view(self, post):
+        did = f"did:plc:bench{post['author']:06d}"
+        rkey = f"{int(post['created'].timestamp() * 1e6):x}{post['seq']:04x}"
+        created = _iso(post["created"])
+        text = post["text"]
+        facets = []
+        for tag in post["tags"]:
+            start = text.encode("utf-8").find(f"#{tag}".encode("utf-8"))
+            facets.append({
+                "index": {"byteStart": start, "byteEnd": start + len(tag) + 1},
+                "features": [{"$type": "app.bsky.richtext.facet#tag", "tag": tag}],
+            })
+        record = {"$type": "app.bsky.feed.post", "text": text, "createdAt": created,
+                  "langs": [post["lang"]], "facets": facets}
+        if post["reply_to"] is not None:
+            parent = f"at://did:plc:bench{post['reply_to']:06d}/app.bsky.feed.post/parent"
+            record["reply"] = {"parent": {"uri": parent, "cid": "bench"}, "root": {"uri": parent, "cid": "bench"}}
+        return {
+            "uri": f"at://{did}/app.bsky.feed.post/{rkey}",
+            "cid": f"bafy{rkey}",
+            "author": {"did": did, "handle": f"user{post['author']}.bench.test",
+                       "displayName": f"User {post['author']}", "createdAt": "2023-05-01T00:00:00.000Z"},
+            "record": record,
+            "replyCount": post["seq"] % 5, "repostCount": post["seq"] % 7,
+            "likeCount": post["seq"] % 11, "quoteCount": post["seq"] % 3,
+            "indexedAt": created,
+        }
+
+
+class MastodonStandIn(StandIn):
+    """ mastodon.social timeline subset, and its streaming API: the posts of
+    `feed_days` corpus days from `feed_start` are published live, oldest
+    first, at `feed_rate` statuses/sec from the first stream connection on.
+    A stream sees what is published while it is connected (a hashtag stream
+    only its tag); `disconnect_every` drops it after that many statuses. """
+
+    platform = "mastodon"
+
+    def __init__(self, corpus: Corpus | None = None, faults: Faults | None = None, feed_start=None,
+                 feed_days=1, feed_rate=2000.0, disconnect_every=None):
+        super().__init__(corpus, faults)
+        self.feed_start = feed_start or dt.datetime.now(dt.timezone.utc).date()
+        self.feed_days = feed_days
+        self.feed_rate = feed_rate
+        self.disconnect_every = disconnect_every
+        self.stream_stats = {"connections": 0, "sent": 0}
+        self._feed: list[dict] | None = None
+        self._feed_t0 = None
+
+    def _quota_headers(self, remaining, reset):
+        return {
+            "X-RateLimit-Limit": str(self.faults.rate_limit or 10_000),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": dt.datetime.fromtimestamp(reset, dt.timezone.utc).isoformat(),
+        }
+
+    def endpoint(self, path):
+        parts = path.rstrip("/").split("/")
+        return "/".join(parts[:5]) if parts[3:4] == ["timelines"] else path.rstrip("/")
+
+    def route(self, method, path, query, body, headers):
+        path = path.rstrip("/")
+        if path in ("/api/v1/instance", "/api/v2/instance"):
+            return 200, {"uri": "bench.test", "domain": "bench.test", "title": "bench", "version": "4.3.0",
+                         "api_versions": {"mastodon": 2}}, {}
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {"error": "The access token is invalid"}, {}
+        if path.startswith("/api/v1/streaming/"):
+            return 200, EventStream(self._stream_events(path, query)), {}
+        if path == "/api/v1/timelines/public":
+            return self._timeline(path, query, None)
+        if path.startswith("/api/v1/timelines/tag/"):
+            return self._timeline(path, query, path.rsplit("/", 1)[-1].lower())
+        return 404, {"error": "Record not found"}, {}
+
+    # -- streaming -------------------------------------------------------------
+
+    def feed(self) -> list[dict]:
+        """ Every post published on the streams, oldest first. """
+        with self._lock:
+            if self._feed is None:
+                self._feed = [post for i in range(self.feed_days)
+                              for post in reversed(self.corpus.day(self.feed_start + dt.timedelta(days=i)))]
+            return self._feed
+
+    def publish(self, delay=0.0):
+        """ Start the feed in `delay` seconds (by default the first stream
+        connection starts it), e.g. once every stream is connected. """
+        with self._lock:
+            self._feed_t0 = time.monotonic() + delay
+
+    def _published(self) -> int:
+        """ Number of feed posts published so far. """
+        with self._lock:
+            if self._feed_t0 is None:
+                self._feed_t0 = time.monotonic()
+            elapsed = max(time.monotonic() - self._feed_t0, 0)
+            return min(int(elapsed * self.feed_rate), len(self._feed))
+
+    def _stream_events(self, path, query):
+        feed = self.feed()
+        tag = query.get("tag", "").lower() if "/hashtag" in path else None
+        with self._lock:
+            self.stream_stats["connections"] += 1
+        i, sent, idle = self._published(), 0, 0.0
+        while self._httpd is not None:
+            end = self._published()
+            if end == i:
+                time.sleep(0.01)
+                idle += 0.01
+                if idle >= 1:
+                    yield ":thump\n"
+                    idle = 0.0
+                continue
+            idle = 0.0
+            for post in feed[i:end]:
+                if tag is not None and tag not in post["tags"]:
+                    continue
+                yield f"event: update\ndata: {json.dumps(self._status(post))}\n\n"
+                sent += 1
+                with self._lock:
+                    self.stream_stats["sent"] += 1
+                if self.disconnect_every and sent >= self.disconnect_every:
+                    return
+            i = end
+
+    @staticmethod
+    def status_id(post) -> int:
+        return (int(post["created"].timestamp() * 1000) << 16) + post["seq"]
+
+    def _timeline(self, path, query, tag):
+        limit = min(int(query.get("limit") or 20), MASTODON_PAGE_MAX)
+        max_id = int(query["max_id"]) if query.get("max_id") else None
+        min_id = int(query["min_id"]) if query.get("min_id") else None
+        since_id = int(query["since_id"]) if query.get("since_id") else None
+        low = min_id if min_id is not None else since_id
+        # a live feed: nothing past what the streams have published so far
+        cutoff = None
+        if self._feed_t0 is not None:
+            feed, published = self.feed(), self._published()
+            cutoff = self.status_id(feed[published - 1]) if published else self.status_id(feed[0]) - 1
+
+        top = dt.datetime.fromtimestamp((max_id >> 16) / 1000, dt.timezone.utc).date() if max_id \
+            else dt.datetime.now(dt.timezone.utc).date()
+        if cutoff is not None:
+            top = min(top, dt.datetime.fromtimestamp((cutoff >> 16) / 1000, dt.timezone.utc).date())
+        bottom = dt.datetime.fromtimestamp((low >> 16) / 1000, dt.timezone.utc).date() if low \
+            else top - dt.timedelta(days=MASTODON_LOOKBACK)
+        if min_id is not None:
+            # min_id pages upwards from the bottom of the range
+            day, step, end = bottom, dt.timedelta(days=1), top
+        else:
+            day, step, end = top, -dt.timedelta(days=1), bottom
+
+        page = []
+        while (day <= end if step.days > 0 else day >= end) and len(page) < limit:
+            posts = self.corpus.day(day)
+            for post in (reversed(posts) if step.days > 0 else posts):
+                sid = self.status_id(post)
+                if (max_id is not None and sid >= max_id) or (low is not None and sid <= low) \
+                        or (cutoff is not None and sid > cutoff):
+                    continue
+                if tag is not None and tag not in post["tags"]:
+                    continue
+                page.append(post)
+                if len(page) == limit:
+                    break
+            day += step
+        if min_id is not None:
+            page.reverse()
+        with self._lock:
+            self.stats["posts"] += len(page)
+
+        links = {}
+        if page:
+            nxt = urlencode({"max_id": self.status_id(page[-1]), "limit": limit})
+            prv = urlencode({"min_id": self.status_id(page[0]), "limit": limit})
+            links["Link"] = f'<{self.url}{path}?{nxt}>; rel="next", <{self.url}{path}?{prv}>; rel="prev"'
+        return 200, [self._status(p) for p in page], links
+
+    def _status(self, post):
+        sid = str(self.status_id(post))
+        acct_id = str(100000 + post["author"])
+        words = post["text"].split(" ")
+        content = " ".join(
+            f'<a href="https://bench.test/tags/{w[1:]}" class="mention hashtag" rel="tag">#<span>{w[1:]}</span></a>'
+            if w.startswith("#") else w for w in words)
+        account = {
+            "id": acct_id, "username": f"user{post['author']}", "acct": f"user{post['author']}",
+            "display_name": f"User {post['author']}", "locked": False, "bot": False, "group": False,
+            "discoverable": True, "created_at": "2023-05-01T00:00:00.000Z", "note": "",
+            "url": f"https://bench.test/@user{post['author']}", "avatar": "", "avatar_static": "",
+            "header": "", "header_static": "", "followers_count": post["author"] % 500,
+            "following_count": post["author"] % 300, "statuses_count": post["author"] % 1000,
+            "last_status_at": post["created"].date().isoformat(), "emojis": [], "fields": [],
+        }
+        mentions = []
+        if post["mention"] is not None:
+            mentions.append({"id": str(100000 + post["mention"]), "username": f"user{post['mention']}",
+                             "acct": f"user{post['mention']}",
+                             "url": f"https://bench.test/@user{post['mention']}"})
+        return {
+            "id": sid, "created_at": _iso(post["created"]),
+            "in_reply_to_id": None if post["reply_to"] is None else str(post["reply_to"]),
+            "in_reply_to_account_id": None if post["reply_to"] is None else str(100000 + post["reply_to"]),
+            "sensitive": False, "spoiler_text": "", "visibility": "public", "language": post["lang"],
+            "uri": f"https://bench.test/users/user{post['author']}/statuses/{sid}",
+            "url": f"https://bench.test/@user{post['author']}/{sid}",
+            "replies_count": post["seq"] % 5, "reblogs_count": post["seq"] % 7,
+            "favourites_count": post["seq"] % 11, "edited_at": None,
+            "content": f"<p>{content}</p>", "reblog": None, "application": None, "account": account,
+            "media_attachments": [], "mentions": mentions,
+            "tags": [{"name": t, "url": f"https://bench.test/tags/{t}"} for t in post["tags"]],
+            "emojis": [], "card": None, "poll": None,
+        }
+
+
+# -- Jetstream -----------------------------------------------------------------
+
+def corpus_events(corpus: Corpus, start: dt.date, days=1, seed=0) -> list[str]:
+    """ Jetstream messages of `days` corpus days, oldest first: one post create
+    per corpus post, plus the deletes and identity events a real stream mixes in. """
+    rng = random.Random(seed)
+    view = BlueskyStandIn._post_view
+    events = []
+    for i in range(days):
+        for post in reversed(corpus.day(start + dt.timedelta(days=i))):
+            item = view(None, post)
+            did, _, rkey = item["uri"][5:].partition("/app.bsky.feed.post/")
+            time_us = int(post["created"].timestamp() * 1e6)
+            events.append({"did": did, "time_us": time_us, "kind": "commit", "commit": {
+                "rev": rkey, "operation": "create", "collection": "app.bsky.feed.post",
+                "rkey": rkey, "record": item["record"], "cid": item["cid"]}})
+            if rng.random() < 0.05:
+                events.append({"did": did, "time_us": time_us + 1, "kind": "commit", "commit": {
+                    "rev": rkey + "d", "operation": "delete", "collection": "app.bsky.feed.post", "rkey": rkey}})
+            if rng.random() < 0.02:
+                events.append({"did": did, "time_us": time_us + 2, "kind": "identity",
+                               "identity": {"did": did, "handle": "user.bench.test", "seq": time_us,
+                                            "time": item["indexedAt"]}})
+    events.sort(key=lambda e: e["time_us"])
+    return [json.dumps(e, separators=(",", ":")) for e in events]
+
+
+class JetstreamStandIn:
+    """ Websocket server replaying recorded Jetstream messages (raw JSON
+    strings, oldest first) to every subscriber, from its `cursor` on, as fast
+    as the client reads or at `rate` messages/sec. `disconnect_every` drops
+    the connection after that many messages, as a real relay does now and then. """
+
+    def __init__(self, events: list[str], rate=None, disconnect_every=None):
+        self.events = events
+        self.times = [int(json.loads(e)["time_us"]) for e in events]
+        self.rate = rate
+        self.disconnect_every = disconnect_every
+        self.stats = {"connections": 0, "sent": 0, "cursors": []}
+        self._loop = None
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+        self._stop = None
+        self.port = None
+
+    async def _handler(self, connection):
+        query = parse_qs(urlsplit(connection.request.path).query)
+        cursor = int(query["cursor"][0]) if "cursor" in query else None
+        wanted = set(query.get("wantedCollections", []))
+        self.stats["connections"] += 1
+        self.stats["cursors"].append(cursor)
+        # no cursor: live tail, which for a replay means from the start
+        i = 0 if cursor is None else bisect.bisect_left(self.times, cursor)
+        sent = 0
+        for raw in self.events[i:]:
+            if wanted and '"kind":"commit"' in raw and not any(f'"collection":"{c}"' in raw for c in wanted):
+                continue
+            try:
+                await connection.send(raw)
+            except ConnectionClosed:
+                return
+            sent += 1
+            self.stats["sent"] += 1
+            if self.rate:
+                await asyncio.sleep(1 / self.rate)
+            if self.disconnect_every and sent >= self.disconnect_every:
+                await connection.close(1011, "bench disconnect")
+                return
+        await connection.close()
+
+    def _run(self):
+
+        async def main():
+            self._stop = asyncio.get_running_loop().create_future()
+            async with serve(self._handler, "127.0.0.1", 0, compression=None, max_size=None) as server:
+                self.port = server.sockets[0].getsockname()[1]
+                self._ready.set()
+                await self._stop
+
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(main())
+        self._loop.close()
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/subscribe"
+
+    def stop(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._stop.set_result, None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,246 @@
+"""
+Streaming ingestion benchmark: common.jetstream against JetstreamStandIn
+and common.mastodon_stream against MastodonStandIn's streaming API.
+
+Each consumer runs in-process against local stand-ins: first with a clean
+connection, then with forced disconnects, then stopped halfway and
+restarted from its persisted state. Jetstream replays corpus events (or a
+file recorded with `python -m common.jetstream --record`) as fast as they
+are read. Mastodon publishes the corpus live on two instances that
+federate the same statuses, followed on a hashtag and the public:remote
+stream each, so every status arrives up to four times. Reported per run:
+
+- events/sec:     messages handled / wall time
+- cpu s:          process CPU time (consumers and stand-ins share the process)
+- kept:           posts written, against the posts the filter should keep
+- lost / dup:     expected uris missing from / repeated in the output
+
+A run fails when a post is lost or written twice.
+
+    python -m bench.stream
+    python -m bench.stream --platforms bluesky --days 3 --posts-per-day 20000 --disconnect-every 5000
+    python -m bench.stream --platforms bluesky --events recorded.jsonl --tags top100_hashtags.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import gzip
+import json
+import shutil
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from bench.corpus import Corpus
+from bench.servers import Faults, JetstreamStandIn, MastodonStandIn, corpus_events
+from common.jetstream import POST_COLLECTION, JetstreamConsumer, PostFilter, to_post
+from common.mastodon_stream import MastodonStreamer, StatusFilter
+
+START = dt.date(2025, 3, 1)
+MASTODON_RATE = 500       # statuses/sec published by the Mastodon stand-ins (a busy federated timeline)
+
+
+def expected_uris(events, post_filter) -> set[str]:
+    """ uris of the post creates `post_filter` keeps, decoding every message. """
+    uris = set()
+    for raw in events:
+        event = json.loads(raw)
+        commit = event.get("commit") or {}
+        if event.get("kind") == "commit" and commit.get("operation") == "create" \
+                and commit.get("collection") == POST_COLLECTION and post_filter(commit["record"]):
+            uris.add(to_post(event)["uri"])
+    return uris
+
+
+def written_uris(out_dir: Path) -> Counter:
+    seen = Counter()
+    for path in sorted(out_dir.glob("*.jsonl.gz")):
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    seen[json.loads(line)["uri"]] += 1
+    return seen
+
+
+async def _consume_until(consumer, last_time_us, stop_after=None):
+    """ Run the consumer until it handled the last event (or `stop_after` messages). """
+    task = asyncio.create_task(consumer.run())
+    while not task.done():
+        await asyncio.sleep(0.05)
+        if consumer.cursor is not None and consumer.cursor >= last_time_us:
+            break
+        if stop_after is not None and consumer.events >= stop_after:
+            break
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def run_one(name, events, post_filter, disconnect_every=None, restart=False) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench-stream-{name}-"))
+    out_dir = workdir / "stream"
+    last = json.loads(events[-1])["time_us"]
+    with JetstreamStandIn(events, disconnect_every=disconnect_every) as server:
+        t0, c0 = time.perf_counter(), time.process_time()
+        handled = 0
+        consumer = JetstreamConsumer(out_dir, server.url, post_filter)
+        if restart:
+            # stopped halfway, then a new process resumes from the persisted state
+            asyncio.run(_consume_until(consumer, last, stop_after=len(events) // 2))
+            handled += consumer.events
+            consumer = JetstreamConsumer(out_dir, server.url, post_filter)
+        asyncio.run(_consume_until(consumer, last))
+        handled += consumer.events
+        seconds, cpu = time.perf_counter() - t0, time.process_time() - c0
+        served = dict(server.stats)
+
+    expected = expected_uris(events, post_filter)
+    seen = written_uris(out_dir)
+    result = {
+        "run": f"bluesky-{name}",
+        "events": len(events),
+        "handled": handled,
+        "connections": served["connections"],
+        "seconds": round(seconds, 3),
+        "cpu": round(cpu, 3),
+        "events_per_sec": round(handled / seconds, 1) if seconds else 0.0,
+        "expected": len(expected),
+        "kept": sum(seen.values()),
+        "lost": len(expected - set(seen)),
+        "dup": sum(n - 1 for n in seen.values() if n > 1),
+        "extra": len(set(seen) - expected),
+    }
+    result["ok"] = result["lost"] == 0 and result["dup"] == 0 and result["extra"] == 0
+    shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def _consume_for(streamer, seconds):
+    async def go():
+        async with streamer.engine:
+            await streamer.run(seconds)
+    asyncio.run(go())
+
+
+def run_mastodon(name, posts_per_day, days, post_filter, disconnect_every=None, restart=False) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench-stream-{name}-"))
+    out_dir, store_root = workdir / "stream", workdir / "store"
+    corpus = Corpus(posts_per_day=posts_per_day)
+    servers = [MastodonStandIn(corpus, Faults(), feed_start=START, feed_days=days, feed_rate=MASTODON_RATE,
+                               disconnect_every=disconnect_every) for _ in range(2)]
+    urls = [server.start() for server in servers]
+    feed = servers[0].feed()
+    for server in servers:
+        server.publish(delay=1)     # every stream connected before the first status
+    # the live feed lasts this long; the rest is slack for the last batch
+    seconds = len(feed) / MASTODON_RATE + 3
+    streams = ["hashtag:climatechange", "public:remote"]
+    t0, c0 = time.perf_counter(), time.process_time()
+    received = 0
+    try:
+        if restart:
+            streamer = MastodonStreamer(urls, streams, post_filter, out_dir, store_root, token="bench")
+            _consume_for(streamer, seconds / 2)
+            received += streamer.received
+            time.sleep(0.5)     # down for a while: the feed goes on without us
+        streamer = MastodonStreamer(urls, streams, post_filter, out_dir, store_root, token="bench")
+        _consume_for(streamer, seconds if not restart else seconds / 2 + 0.5)
+        received += streamer.received
+        seconds, cpu = time.perf_counter() - t0, time.process_time() - c0
+        connections = sum(server.stream_stats["connections"] for server in servers)
+    finally:
+        for server in servers:
+            server.stop()
+
+    expected = {servers[0]._status(p)["uri"] for p in feed if post_filter(servers[0]._status(p))}
+    seen = Counter()
+    for path in sorted(streamer.progress_dir.glob("*.jsonl")):
+        with path.open("r", encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    seen[json.loads(line)["uri"]] += 1
+    result = {
+        "run": f"mastodon-{name}",
+        "events": len(feed),
+        "handled": received,
+        "connections": connections,
+        "seconds": round(seconds, 3),
+        "cpu": round(cpu, 3),
+        "events_per_sec": round(received / seconds, 1) if seconds else 0.0,
+        "expected": len(expected),
+        "kept": sum(seen.values()),
+        "lost": len(expected - set(seen)),
+        "dup": sum(n - 1 for n in seen.values() if n > 1),
+        "extra": len(set(seen) - expected),
+    }
+    result["ok"] = result["lost"] == 0 and result["dup"] == 0 and result["extra"] == 0
+    shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def print_table(results):
+    cols = ["run", "events", "handled", "connections", "seconds", "cpu", "events_per_sec",
+            "expected", "kept", "lost", "dup", "extra", "ok"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in cols}
+    print("  ".join(c.ljust(widths[c]) for c in cols))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in cols))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Jetstream ingestion against a local stand-in")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--posts-per-day", type=int, default=20_000)
+    parser.add_argument("--events", help="recorded Jetstream messages (one JSON per line) instead of the corpus")
+    parser.add_argument("--tags", help="JSON list of hashtags to keep (default: top 20 corpus tags)")
+    parser.add_argument("--top-words", type=int, default=20)
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--disconnect-every", type=int, default=2_000)
+    parser.add_argument("--platforms", nargs="+", choices=["bluesky", "mastodon"], default=["bluesky", "mastodon"])
+    parser.add_argument("--mastodon-posts-per-day", type=int, default=4_000)
+    args = parser.parse_args(argv)
+
+    events = []
+    if "bluesky" not in args.platforms:
+        pass
+    elif args.events:
+        with open(args.events, "r", encoding="utf-8") as fh:
+            events = sorted((line.strip() for line in fh if line.strip()),
+                            key=lambda raw: json.loads(raw)["time_us"])
+    else:
+        events = corpus_events(Corpus(posts_per_day=args.posts_per_day), START, args.days)
+    if args.tags:
+        with open(args.tags, "r", encoding="utf-8") as fh:
+            tags = json.load(fh)
+    else:
+        tags = Corpus.top_tags(args.top_words)
+    post_filter = PostFilter(args.lang, tags)
+
+    results = []
+    if "bluesky" in args.platforms:
+        results += [
+            run_one("clean", events, post_filter),
+            run_one("disconnects", events, post_filter, disconnect_every=args.disconnect_every),
+            run_one("restart", events, post_filter, disconnect_every=args.disconnect_every, restart=True),
+        ]
+    if "mastodon" in args.platforms:
+        status_filter = StatusFilter(args.lang)
+        n, every = args.mastodon_posts_per_day, args.disconnect_every // 2
+        results += [
+            run_mastodon("clean", n, args.days, status_filter),
+            run_mastodon("disconnects", n, args.days, status_filter, disconnect_every=every),
+            run_mastodon("restart", n, args.days, status_filter, disconnect_every=every, restart=True),
+        ]
+    print_table(results)
+    if not all(r["ok"] for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
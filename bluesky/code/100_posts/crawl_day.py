@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+import json
+import os
+import sys
+import asyncio
+import httpx
+from pathlib import Path
+
+# repository root, for the shared `common` package
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from common import metrics
+from common.auth import HOST, TokenManager
+from common.engine import CrawlEngine
+from common.invindex import InvertedIndex
+from common.writer import GzipJsonlWriter
+
+# Config
+START          = os.getenv("CRAWL_START", "2025-03-09")   # overridden by bench/
+END            = os.getenv("CRAWL_END", "2025-03-09")
+
+OUT_DIR        = Path("./bluesky/dataset/100_posts")
+METRICS_DIR    = Path("./bluesky/dataset/.progress/crawl_day")   # metrics.json / metrics.prom
+BEST_100_FILE  = Path("./bluesky/code/hashtag/100_posts/top100_hashtags.json")
+SEED_INDEX     = os.getenv("SEED_INDEX")   # common.invindex directory: seed from it instead of BEST_100_FILE
+
+FILTERING_LANG = "en"
+LIMIT_PER_CALL = 100
+MAX_RETRIES    = 3
+TOKEN_MARGIN   = 300
+MAX_CONCURRENT = 32              # upper bound, the engine adapts below it
+URL_SEARCH     = f"{HOST}/xrpc/app.bsky.feed.searchPosts"   # HOST from BLUESKY_HOST
+
+
+def _iso(dt_: dt.datetime) -> str:
+    return dt_.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+async def crawl_day(engine: CrawlEngine, tm: TokenManager, day: dt.date, outfile: Path,
+                    hashtags: list[str]):
+    seen_uris = set()
+    gz_file = outfile.with_suffix(".jsonl.gz")
+    # batched gzip members through a bounded queue: a slow disk pauses the
+    # fetchers instead of buffering the whole day (offset 0: the day starts over)
+    writer = GzipJsonlWriter(gz_file, offsets={gz_file: 0})
+
+    async def fetch_word(word: str):
+        cursor = None
+        day_start = dt.datetime.combine(day, dt.time.min)
+        day_end   = dt.datetime.combine(day, dt.time.max)
+        while True:
+            params = {
+                "q": word,
+                "lang": FILTERING_LANG,
+                "since": _iso(day_start),
+                "until": _iso(day_end),
+                "limit": LIMIT_PER_CALL,
+            }
+            if cursor:
+                params["cursor"] = cursor
+
+            for attempt in range(MAX_RETRIES):
+                try:
+                    # one pooled client for every word and day, the engine
+                    # bounds how many of these run at once and waits for a
+                    # rate-limit token, so a 429 retry is already paced
+                    resp = await engine.get(URL_SEARCH, headers=await tm.aheaders(), params=params)
+                    if resp.status_code in (429, 403) and attempt < MAX_RETRIES - 1:
+                        metrics.RETRIES.inc(platform="bluesky", reason=resp.status_code)
+                        continue
+                    resp.raise_for_status()
+                    break
+                except httpx.HTTPStatusError as exc:
+                    code = exc.response.status_code
+                    if 500 <= code < 600 and attempt < MAX_RETRIES - 1:
+                        metrics.RETRIES.inc(platform="bluesky", reason="5xx")
+                        metrics.BACKOFF_SECONDS.inc(2 ** attempt, reason="5xx")
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    print(f"{code} {exc.response.reason_phrase}; give-up word {word}")
+                    return
+                except httpx.RequestError as exc:
+                    print(f"{exc}; give-up word {word}")
+                    return
+
+            data   = resp.json()
+            posts  = data.get("posts", [])
+            cursor = data.get("cursor")
+            metrics.WINDOWS.inc(platform="bluesky", result="full" if posts else "empty")
+
+            # single event loop, no await between check and add: no lock needed
+            for post in posts:
+                uri = post.get("uri")
+                if not uri or uri in seen_uris:
+                    metrics.DEDUP.inc(platform="bluesky", result="hit")
+                    continue
+                metrics.DEDUP.inc(platform="bluesky", result="miss")
+                seen_uris.add(uri)
+                await writer.put(post)
+
+            if cursor is None or not posts:
+                break
+
+    print(f"Crawling {day} over {len(hashtags)} most frequent hashtags")
+
+    async with writer:
+        await asyncio.gather(*(fetch_word(w) for w in hashtags))
+    print(f"Finished {day}: {len(seen_uris)} unique posts saved → {gz_file.name}")
+
+
+async def main_async():
+    user, pw = os.getenv("BLUESKY_USER"), os.getenv("BLUESKY_PASS")
+    if not user or not pw:
+        raise SystemExit("Missing BLUESKY_USER / BLUESKY_PASS in env")
+
+    if SEED_INDEX:
+        hashtags = InvertedIndex(SEED_INDEX).seed_hashtags(100, ["bluesky"], lang=FILTERING_LANG)
+        print(f"{len(hashtags)} seed hashtags from {SEED_INDEX}")
+    else:
+        with BEST_100_FILE.open(encoding="utf-8") as f:
+            hashtags = json.load(f)
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    first_day = dt.datetime.strptime(START, "%Y-%m-%d").date()
+    last_day  = dt.datetime.strptime(END, "%Y-%m-%d").date()
+
+    with metrics.Exporter(METRICS_DIR / "metrics.json", METRICS_DIR / "metrics.prom"):
+        async with CrawlEngine(max_connections=MAX_CONCURRENT) as engine, \
+                TokenManager(user, pw, engine, margin=TOKEN_MARGIN) as tm:
+            # tm refreshes in the background ahead of expiry, so fetch_word
+            # normally finds a fresh token or joins the refresh in flight
+            day = first_day
+            while day <= last_day:
+                outfile = OUT_DIR / f"bluesky-{day}.jsonl"
+                await crawl_day(engine, tm, day, outfile, hashtags)
+                day += dt.timedelta(days=1)
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -2,29 +2,43 @@
 
 from __future__ import annotations
 
-import base64
 import datetime as dt
-import json
 import os
 import time
 import random
+import sys
 from pathlib import Path
-from typing import List
 import requests
 
+# repository root, for the shared `common` package
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from common import metrics
+from common.auth import HOST, TokenManager
+from common.checkpoint import ProgressStore, append_post, write_json_array
+from common.engine import CrawlEngine
+from common.sampling import Reservoir, window_seed
+from common.store import PostStore
+
 out_dir = Path("./bluesky/dataset/100_posts")
-start = "2024-02-06"   # inclusive
-end = "2025-07-06"     # inclusive  
+store_root = Path("./dataset/store/100_posts")   # columnar store, see common/store.py
+json_arrays = False      # also render the old pretty-printed bluesky_YYYY-MM.json files
+# CRAWL_START / CRAWL_END: short runs against the bench/ stand-in servers
+start = os.getenv("CRAWL_START", "2024-02-06")   # inclusive
+end = os.getenv("CRAWL_END", "2025-07-06")       # inclusive
 filtering_word = "climatechange"
 filtering_lang = "en"
-num_hours = 10  
+num_hours = 10           # posts per day: random hours in "probe" mode, sample size in "batch"
 limit_per_call = 1
+sampling = "batch"       # "batch": page the whole day, reservoir-sample; "probe": 1 post per random hour
+page_size = 100          # batch mode page size (API max)
+seed = 42                # batch mode samples are reproducible per (seed, query, day)
 max_retries = 3
 token_margin = 300  # seconds before trying to refresh/create token
+search_url = f"{HOST}/xrpc/app.bsky.feed.searchPosts"   # HOST from BLUESKY_HOST
 
 
 # load environment
-def _load_dotenv(path):
+def _load_dotenv(path=".env"):
     try:
         with open(path, "r", encoding="utf-8") as f:
             for line in f:
@@ -48,84 +62,76 @@ def _months_between(start, end):
 def _iso(dt_):
     return dt_.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-# token expiry handling
-def _jwt_exp(jwt):
-    """ Decompose the JWT string to extract the specific expiration timestamp. """
-    try:
-        header, payload_b64, _sig = jwt.split(".")
-        payload_b64 += "=" * (-len(payload_b64) % 4)
-        payload = json.loads(base64.urlsafe_b64decode(payload_b64))
-        return float(payload["exp"])
-    except Exception:
-        return time.time() + 7200
-
-# token manager class
-class TokenManager:
-    def __init__(self, user, pw):
-        """ Normal init + call to create to obtain tokens. """
-        self.user, self.pw = user, pw
-        self.access= None
-        self.refresh = None
-        self.exp: float = 0.0
-        self._create()
-
-    @property
-    def headers(self):
-        """ If fewer than token_margin seconds remain, refresh. """
-        if time.time() > self.exp - token_margin:
-            self._refresh()
-        return {"Authorization": f"Bearer {self.access}"}
-
-    def _create(self):
-        """ Create session and compute expiry time. """
-        r = requests.post(
-            "https://bsky.social/xrpc/com.atproto.server.createSession",
-            json={"identifier": self.user, "password": self.pw},
-            timeout=15,
-        )
-        r.raise_for_status()
-        data = r.json()
-        self.access, self.refresh = data["accessJwt"], data["refreshJwt"]
-        self.exp = _jwt_exp(self.access)
-
-    def _refresh(self):
-        """ Refresh session and recompute expiry time. """
-        if not self.refresh:
-            self._create(); return
-        r = requests.post(
-            "https://bsky.social/xrpc/com.atproto.server.refreshSession",
-            headers={"Authorization": f"Bearer {self.refresh}"},
-            timeout=15,
-        )
-        if r.status_code == 401:
-            self._create(); return
-        r.raise_for_status()
-        data = r.json()
-        self.access = data["accessJwt"]
-        self.refresh = data.get("refreshJwt", self.refresh)
-        self.exp = _jwt_exp(self.access)
-
-# sleep - rate limit encountered
-def _rate_limit_sleep(resp):
-    """ If 429/403 due to rate limits, compute wait time before retrying.
-    Use Retry-After or ratelimit-reset headers. """
-
-    # from header get Retry-After — value in seconds
-    retry = resp.headers.get("Retry-After")
-    if retry and retry.isdigit():
-        # convert retry to integer
-        wait = int(retry)
-    else:
-        # ratelimit-reset is a unix timestamp indicating when the bucket refills
-        reset = resp.headers.get("ratelimit-reset")
-        if reset and reset.isdigit():
-            # if reset is in the future use that value, otherwise force zero
-            wait = max(0, int(reset) - int(time.time()))
-        else:
-            # fallback if headers are missing/invalid — default 5 seconds
-            wait = 5
-    print(f"rate-limit: sleep {wait}s")
-    time.sleep(wait)
+# searchPosts with retries
+def _search(engine, tm, params):
+    """ One searchPosts call with retries, returns the decoded page or None. """
+    for attempt in range(max_retries):
+        try:
+            r = engine.get_sync(
+                search_url,
+                headers=tm.headers,
+                params=params,
+                timeout=5,
+            )
+            r.raise_for_status()
+            data = r.json()
+            metrics.WINDOWS.inc(platform="bluesky", result="full" if data.get("posts") else "empty")
+            return data
+
+        # BACKOFF for server failures, API limits are handled by the engine
+        # automatic retry + exponential wait with fixed attempts
+
+        except requests.HTTPError as exc:
+            code = exc.response.status_code
+            if code in (429, 403) and attempt < max_retries - 1:
+                metrics.RETRIES.inc(platform="bluesky", reason=code)
+                # the shared limiter read the reset from this response
+                # and holds the retry until the bucket refills
+                continue
+            elif 500 <= code < 600 and attempt < max_retries - 1:
+                metrics.RETRIES.inc(platform="bluesky", reason="5xx")
+                metrics.BACKOFF_SECONDS.inc(2 ** attempt, reason="5xx")
+                time.sleep(2 ** attempt)
+                continue
+            print(f"{code} {exc.response.reason}; skipping")
+            return None
+        except requests.RequestException as exc:
+            print(f"{exc}; skipping")
+            return None
+    return None
+
+# batch mode: one day, full pages, uniform sample
+def _sample_day(engine, tm, store, day):
+    """ Page through every post of the day (limit=page_size) and return a
+    seeded uniform sample of num_hours posts not saved before, or None when a
+    page could not be fetched (the day has to be retried, not marked done).
+    No page cap: pages come newest first, a cut-off day would only sample its end. """
+    reservoir = Reservoir(num_hours, seed=window_seed(seed, "bluesky", filtering_word, day))
+    day_uris = set()
+    params = {
+        "q": filtering_word,
+        "lang": filtering_lang,
+        "since": _iso(dt.datetime.combine(day, dt.time.min)),
+        "until": _iso(dt.datetime.combine(day, dt.time.max)),
+        "limit": page_size,
+    }
+    while True:
+        page = _search(engine, tm, params)
+        if page is None:
+            # a failed page is not the end of the results: a sample without
+            # the older part of the day would be skewed toward the latest posts
+            return None
+        posts = page.get("posts") or []
+        for post in posts:
+            uri = post.get("uri")
+            if not uri or uri in day_uris or store.has_seen("bluesky", uri):
+                continue
+            day_uris.add(uri)
+            reservoir.offer(post)
+        cursor = page.get("cursor")
+        if not posts or not cursor:
+            return reservoir.result()
+        params["cursor"] = cursor
 
 def main() :
     _load_dotenv()
@@ -136,9 +142,17 @@ def main() :
     real_start = dt.date.fromisoformat(start)
     real_end   = dt.date.fromisoformat(end)
 
-    tm = TokenManager(user, pw)
+    engine = CrawlEngine()  # one pooled keep-alive session for the whole run
+    # reuses the cached session of a previous run instead of a new createSession
+    tm = TokenManager(user, pw, engine, margin=token_margin)
     out_dir.mkdir(parents=True, exist_ok=True)
-    seen_uris = set()
+    # progress + seen URIs live on disk: a restart skips finished days and
+    # resumes unfinished ones from the last committed hour window
+    progress_dir = out_dir.parent / ".progress" / out_dir.name
+    store = ProgressStore(progress_dir / "progress.sqlite")
+    # metrics.json / metrics.prom next to the progress store, see common/metrics.py
+    exporter = metrics.Exporter(progress_dir / "metrics.json", progress_dir / "metrics.prom").start()
+    posts_store = PostStore(store_root)
 
     for ym in _months_between(start, end):
         # handle months that are not fully covered
@@ -147,83 +161,75 @@ def main() :
                                          month=(month_first.month % 12) + 1)
         # real first day (not necessarily the 1st)
         first_day = real_start if (month_first.year == real_start.year and month_first.month == real_start.month) else month_first
-        last_day  = (real_end + dt.timedelta(days=1)) if (month_next.year == real_end.year and month_next.month == real_end.month) else month_next
-
+        last_day  = (real_end + dt.timedelta(days=1)) if (month_first.year == real_end.year and month_first.month == real_end.month) else month_next
 
         out_file = out_dir / f"bluesky_{ym}.json"
+        log_file = progress_dir / f"bluesky_{ym}.jsonl"
         print(f"Sampling posts for {ym}")
 
-        with out_file.open("w", encoding="utf-8") as fh:
-            # open list
-            fh.write("[\n")
-            first_elem = True
-
+        with store.open_log(log_file) as fh:
             day = first_day
             while day < last_day:
-                saved_today = 0
+                if store.is_done("bluesky", filtering_word, day):
+                    print(f"{day} already downloaded, skipping")
+                    day += dt.timedelta(days=1)
+                    continue
 
-                for _ in range(num_hours):  # number of hours
+                saved_today = 0
+                if sampling == "batch":
+                    # the sample is redrawn identically if the day is interrupted
+                    sample = _sample_day(engine, tm, store, day)
+                    if sample is None:
+                        print(f"{day}: a page failed, day left unfinished for the next run")
+                        day += dt.timedelta(days=1)
+                        continue
+                    for post in sample:
+                        if store.add_seen("bluesky", post["uri"]):
+                            append_post(fh, post)
+                            saved_today += 1
+                    store.checkpoint(fh, "bluesky", filtering_word, day, done=True, saved=saved_today)
+                    print(f"{saved_today} unique posts for day {day}")
+                    day += dt.timedelta(days=1)
+                    continue
+
+                first_window = int(store.cursor("bluesky", filtering_word, day) or 0)
+                for window in range(first_window, num_hours):  # number of hours
                     randdt = dt.datetime.combine(day, dt.time()) + dt.timedelta(
                         hours=random.randint(0, 23), minutes=random.randint(0, 59), seconds=random.randint(0, 59)
                     )
                     hour_end = randdt.replace(minute=59, second=59)
 
-                    for attempt in range(max_retries):
-                        try:
-                            r = requests.get(
-                                "https://bsky.social/xrpc/app.bsky.feed.searchPosts",
-                                headers=tm.headers,
-                                params={
-                                    "q": filtering_word,
-                                    "lang": filtering_lang,
-                                    "since": _iso(randdt),
-                                    "until": _iso(hour_end),
-                                    "limit": limit_per_call,
-                                },
-                                timeout=5,
-                            )
-                            r.raise_for_status(); break
-
-                        # BACKOFF for API limit errors or server failures
-                        # automatic retry + exponential wait with fixed attempts
-
-                        except requests.HTTPError as exc:
-                            code = exc.response.status_code
-                            if code in (429, 403):
-                                _rate_limit_sleep(exc.response)
-                                if attempt < max_retries - 1:
-                                    continue
-                            elif 500 <= code < 600 and attempt < max_retries - 1:
-                                time.sleep(2 ** attempt)
-                                continue
-                            print(f"{code} {exc.response.reason}; skipping"); r = None
-                            break
-                        except requests.RequestException as exc:
-                            print(f"{exc}; skipping"); r = None
-                            break
-
-                    if r is None:
-                        continue
+                    page = _search(engine, tm, {
+                        "q": filtering_word,
+                        "lang": filtering_lang,
+                        "since": _iso(randdt),
+                        "until": _iso(hour_end),
+                        "limit": limit_per_call,
+                    })
                     # post
-                    post = (r.json().get("posts") or [None])[0]
-                    if not post:
-                        continue
-
-                    # check duplicates
-                    uri = post.get("uri")
-                    if not uri or uri in seen_uris:
-                        continue
-                    if not first_elem:
-                        fh.write(",\n")
-                    json.dump(post, fh, ensure_ascii=False)
-                    first_elem, saved_today = False, saved_today + 1
-                    seen_uris.add(uri)
-
+                    post = ((page or {}).get("posts") or [None])[0]
+
+                    # check duplicates (against everything saved so far, on disk)
+                    saved = 0
+                    uri = post.get("uri") if post else None
+                    if uri and store.add_seen("bluesky", uri):
+                        append_post(fh, post)
+                        saved = 1
+                    saved_today += saved
+                    store.checkpoint(fh, "bluesky", filtering_word, day, cursor=str(window + 1), saved=saved)
+
+                store.checkpoint(fh, "bluesky", filtering_word, day, done=True)
                 print(f"{saved_today} unique posts for day {day}")
                 day += dt.timedelta(days=1)
-            fh.write("\n]\n")
 
-        print(f"Saved {out_file}\n")
+        # the notebooks read one store partition per month
+        n = posts_store.write_log("bluesky", ym, log_file)
+        if json_arrays:
+            write_json_array(log_file, out_file)
+        print(f"Saved {n} posts of {ym} to {store_root}\n")
+    store.close()
+    engine.close()
+    exporter.stop()
 
 if __name__ == "__main__":
     main()
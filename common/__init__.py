@@ -0,0 +1 @@
+""" Code shared by the Bluesky and Mastodon collectors and post-processing. """
@@ -0,0 +1,205 @@
+"""
+Bluesky session handling shared by the download scripts and `crawl_day`.
+
+`TokenManager` keeps one accessJwt / refreshJwt pair per account:
+
+- the pair is cached on disk (`SESSION_CACHE`, mode 600), so a restart reuses
+  the session with refreshSession instead of a new createSession, which
+  Bluesky limits to a few dozen calls per account and window;
+- `headers` is the blocking accessor for the synchronous scripts, a
+  threading lock lets exactly one thread refresh while the others wait;
+- `aheaders()` is the asyncio accessor: the first task past the expiry margin
+  starts the refresh, every other task awaits the same future, and the
+  event loop never blocks on the network;
+- `start()` schedules the refresh in the background `margin` seconds ahead
+  of expiry, so tasks normally never wait at all.
+
+Both paths go through the shared engine, so the session endpoints get the
+same pooled connections and rate-limit buckets as the crawl itself.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from common.engine import CrawlEngine
+
+HOST = os.getenv("BLUESKY_HOST", "https://bsky.social")     # bench/ points it at a local stand-in
+TOKEN_MARGIN = 300                                     # seconds before expiry to refresh
+SESSION_CACHE = Path("./.progress/bluesky_session.json")
+DEFAULT_TTL = 7200                                     # when a JWT carries no readable exp
+
+
+def jwt_exp(jwt) -> float:
+    """ Expiration timestamp from the payload of a JWT (not verified). """
+    try:
+        _header, payload_b64, _sig = jwt.split(".")
+        payload_b64 += "=" * (-len(payload_b64) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(payload_b64))
+        return float(payload["exp"])
+    except Exception:
+        return time.time() + DEFAULT_TTL
+
+
+class TokenManager:
+    """ Access token of one account, refreshed single-flight and cached on disk. """
+
+    def __init__(self, user, pw, engine: CrawlEngine | None = None, margin=TOKEN_MARGIN,
+                 cache_file=SESSION_CACHE, host=HOST):
+        self.user, self.pw = user, pw
+        self.engine = engine or CrawlEngine()
+        self.margin = margin
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.host = host.rstrip("/")
+        self.access: str | None = None
+        self.refresh: str | None = None
+        self.exp: float = 0.0
+        self.refreshes = 0                       # createSession + refreshSession calls made
+        self._lock = threading.Lock()
+        self._inflight: asyncio.Future | None = None
+        self._task: asyncio.Task | None = None
+        self._load()
+
+    # -- accessors ---------------------------------------------------------
+
+    def _fresh(self):
+        if self.engine.offline:
+            return True                          # replaying recorded responses: no session calls
+        return self.access is not None and time.time() < self.exp - self.margin
+
+    def _auth(self):
+        return {"Authorization": f"Bearer {self.access}"}
+
+    @property
+    def headers(self) -> dict[str, str]:
+        """ Blocking accessor, refreshes first if fewer than `margin` seconds remain. """
+        if not self._fresh():
+            with self._lock:
+                if not self._fresh():            # another thread may have refreshed meanwhile
+                    self._refresh_sync()
+        return self._auth()
+
+    async def aheaders(self) -> dict[str, str]:
+        """ Non-blocking accessor: concurrent callers share one refresh. """
+        if not self._fresh():
+            if self._inflight is None or self._inflight.done():
+                self._inflight = asyncio.ensure_future(self._refresh_async())
+            # shield: a cancelled caller must not cancel the refresh of the others
+            await asyncio.shield(self._inflight)
+        return self._auth()
+
+    # -- background refresh ------------------------------------------------
+
+    def start(self):
+        """ Refresh `margin` seconds ahead of every expiry until stop(). Needs a running loop. """
+        if not self.engine.offline and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._keep_fresh())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _keep_fresh(self):
+        while True:
+            await asyncio.sleep(max(self.exp - self.margin - time.time(), 0))
+            try:
+                await self.aheaders()
+            except Exception as exc:
+                # the next aheaders() retries on its own, no need to kill the crawl
+                print(f"Background token refresh failed: {exc}")
+                await asyncio.sleep(30)
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # -- session calls -----------------------------------------------------
+
+    def _url(self, method):
+        return f"{self.host}/xrpc/com.atproto.server.{method}"
+
+    def _refresh_sync(self):
+        """ refreshSession, falling back to createSession without a usable refresh token. """
+        session = self.engine.session
+        if self.refresh and jwt_exp(self.refresh) > time.time():
+            r = session.post(self._url("refreshSession"),
+                             headers={"Authorization": f"Bearer {self.refresh}"},
+                             timeout=15)
+            self.refreshes += 1
+            if r.status_code not in (400, 401):
+                r.raise_for_status()
+                return self._store(r.json())
+        r = session.post(self._url("createSession"),
+                         json={"identifier": self.user, "password": self.pw},
+                         timeout=15)
+        self.refreshes += 1
+        r.raise_for_status()
+        self._store(r.json())
+
+    async def _refresh_async(self):
+        """ Same as _refresh_sync on the async client. """
+        if self.refresh and jwt_exp(self.refresh) > time.time():
+            r = await self.engine.post(self._url("refreshSession"),
+                                       headers={"Authorization": f"Bearer {self.refresh}"})
+            self.refreshes += 1
+            if r.status_code not in (400, 401):
+                r.raise_for_status()
+                return self._store(r.json())
+        r = await self.engine.post(self._url("createSession"),
+                                   json={"identifier": self.user, "password": self.pw})
+        self.refreshes += 1
+        r.raise_for_status()
+        self._store(r.json())
+
+    # -- on-disk cache -----------------------------------------------------
+
+    def _store(self, data):
+        self.access = data["accessJwt"]
+        self.refresh = data.get("refreshJwt", self.refresh)
+        self.exp = jwt_exp(self.access)
+        self._save()
+
+    def _load(self):
+        """ Reuse a cached session of the same account, if any. """
+        if self.cache_file is None:
+            return
+        try:
+            sessions = json.loads(self.cache_file.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return
+        cached = sessions.get(self.user)
+        if not cached:
+            return
+        self.access = cached.get("accessJwt")
+        self.refresh = cached.get("refreshJwt")
+        self.exp = jwt_exp(self.access) if self.access else 0.0
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        try:
+            sessions = json.loads(self.cache_file.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            sessions = {}
+        sessions[self.user] = {"accessJwt": self.access, "refreshJwt": self.refresh}
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_suffix(".tmp")
+        # the file holds credentials: owner-only from the start, then an atomic rename
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(sessions, fh)
+        os.replace(tmp, self.cache_file)
@@ -0,0 +1,332 @@
+"""
+Parallel reprocessing of whole collections, for unattended batch runs.
+
+The post-processing notebooks walk the months of one platform serially in
+one kernel. Here every (collection, platform, month) partition of the
+columnar store is an independent task, fanned out over a
+ProcessPoolExecutor. A task reads only its partition and writes its
+partial results next to the build cache:
+
+- <month>.npz      hashtag counts of the English posts (common.hashtags)
+- <month>.ids.npy  64-bit hashes of the post ids, for the cross-month dedup
+- <month>.json     counts, English-filter stats, duplicates within the month
+
+under <work_dir>/<collection>/<platform>/months/.
+
+The parent then reduces, per (collection, platform), the partials into
+hashtag_counts.npz, hashtag_norm.json and top100_hashtags.json (through
+common.build, so unchanged inputs are not rewritten) and into one report
+with the per-month numbers and the duplicates across months. Months whose
+partition did not change since the last run are not recomputed (`--force`
+recomputes them). Tasks are submitted largest first, so a long month does
+not end up alone at the tail of the run.
+
+Paths come from a JSON config merged over `DEFAULT_CONFIG`; relative
+paths are resolved against `root`, itself relative to the config file.
+`--print-config` shows the resolved config, a starting point for a node.
+
+    python -m common.batch --workers 16
+    python -m common.batch --config batch.json --collections 100_posts --platforms bluesky
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from common.build import BuildCache, hashtag_products
+from common.hashtags import HashtagCounts
+from common.langid import SEED, LanguageIdentifier
+from common.store import PostStore
+
+PLATFORMS = ("bluesky", "mastodon")
+VERSION = 1               # bump when process_month changes its output
+
+DEFAULT_CONFIG = {
+    "root": ".",                              # the paths below are relative to it
+    "work_dir": ".progress/batch",            # build caches and per-month partials
+    "langid_cache": ".progress/langid.sqlite",
+    "lang": "en",
+    "detect": True,                           # identify posts without a declared language
+    "top": 100,
+    "workers": None,                          # None: one per CPU
+    "platforms": list(PLATFORMS),
+    "collections": {
+        # {platform} is replaced; hashtag_dir None keeps the products in work_dir
+        "100_posts": {"store": "dataset/store/100_posts",
+                      "hashtag_dir": "{platform}/code/hashtag/100_posts"},
+        "random": {"store": "dataset/store/random", "hashtag_dir": None},
+    },
+}
+
+
+def _write_json(obj, path):
+    path = Path(path)
+    tmp = path.with_name("." + path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as fh:
+        json.dump(obj, fh, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# -- config ------------------------------------------------------------------
+
+def _merge(base, override):
+    out = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(out.get(key), dict):
+            out[key] = _merge(out[key], value)
+        else:
+            out[key] = value
+    return out
+
+
+def load_config(path=None, overrides=None) -> dict:
+    """ DEFAULT_CONFIG, updated from the JSON file at `path` and then from
+    `overrides`, with every path made absolute. """
+    config = DEFAULT_CONFIG
+    base = Path.cwd()
+    if path is not None:
+        with open(path, "r", encoding="utf-8") as fh:
+            config = _merge(config, json.load(fh))
+        base = Path(path).resolve().parent
+    config = _merge(config, overrides or {})
+
+    root = (base / config["root"]).resolve()
+    config["root"] = str(root)
+    for key in ("work_dir", "langid_cache"):
+        if config[key]:
+            config[key] = str(root / config[key])
+    for collection in config["collections"].values():
+        collection["store"] = str(root / collection["store"])
+        if collection.get("hashtag_dir"):
+            collection["hashtag_dir"] = str(root / collection["hashtag_dir"])
+    return config
+
+
+# -- map: one month partition ------------------------------------------------
+
+_identifier: LanguageIdentifier | None = None
+
+
+def _init_worker(langid_cache, seed):
+    global _identifier
+    # detection stays in this process: the pool already uses every core
+    _identifier = LanguageIdentifier(workers=1, cache_path=langid_cache, seed=seed)
+
+
+def id_hashes(ids) -> np.ndarray:
+    """ 64-bit hashes of post ids, what the cross-month dedup compares. """
+    data = b"".join(hashlib.blake2b(str(i).encode("utf-8"), digest_size=8).digest() for i in ids)
+    return np.frombuffer(data, dtype="<u8")
+
+
+def process_month(task) -> dict:
+    """ Counts, English filter, hashtags and in-month duplicates of one
+    partition; writes the partials under task["out"] and returns the report row. """
+    t0 = time.perf_counter()
+    platform, month, lang = task["platform"], task["month"], task["lang"]
+    out = Path(task["out"])
+    out.parent.mkdir(parents=True, exist_ok=True)
+    table = PostStore(task["store"]).read(["id", "language", "text", "tags"], platform=platform, months=[month])
+    ids = table.column("id").to_pylist()
+    declared = table.column("language").to_pylist()
+
+    langs = list(declared)
+    undeclared = [i for i, value in enumerate(declared) if value is None]
+    if task["detect"] and undeclared and _identifier is not None:
+        texts = table.column("text").to_pylist()
+        # Mastodon content is HTML, Bluesky text is plain text
+        detected = _identifier.detect_many([texts[i] for i in undeclared], is_html=platform == "mastodon")
+        for i, value in zip(undeclared, detected):
+            langs[i] = value
+
+    counts = HashtagCounts()
+    english = 0
+    for post_tags, value in zip(table.column("tags").to_pylist(), langs):
+        if not lang or value == lang:
+            english += 1
+            counts.update(post_tags or [], month)
+    counts.save(out.with_suffix(".npz"))
+    hashes = id_hashes(ids)
+    np.save(out.with_suffix(".ids.npy"), hashes)
+
+    row = {
+        "platform": platform,
+        "month": month,
+        "posts": len(ids),
+        "duplicates_in_month": len(ids) - len(np.unique(hashes)),
+        "declared_lang": sum(1 for value in declared if value == lang),
+        "declared_other": sum(1 for value in declared if value is not None and value != lang),
+        "undeclared": len(undeclared),
+        "detected_lang": sum(1 for i in undeclared if langs[i] == lang),
+        "kept": english,
+        "hashtags": int(counts.total().sum()),
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+    # written last: the cache only trusts a month whose report exists
+    _write_json(row, out.with_suffix(".json"))
+    return row
+
+
+# -- reduce ------------------------------------------------------------------
+
+def cross_month_duplicates(hashes_by_month: dict[str, np.ndarray]) -> dict[str, int]:
+    """ Posts per month whose id was already seen in that month or an earlier one. """
+    months = sorted(hashes_by_month)
+    if not months:
+        return {}
+    hashes = np.concatenate([hashes_by_month[m] for m in months])
+    owner = np.repeat(np.arange(len(months)), [len(hashes_by_month[m]) for m in months])
+    first = np.zeros(len(hashes), dtype=bool)
+    first[np.unique(hashes, return_index=True)[1]] = True
+    repeats = np.bincount(owner[~first], minlength=len(months))
+    return {m: int(n) for m, n in zip(months, repeats)}
+
+
+def reduce_platform(cache, name, platform, rows, out_dir, hashtag_dir, top) -> dict:
+    """ Merge the month partials of one (collection, platform) into the
+    hashtag artifacts and the report. """
+    months = sorted(rows)
+    partials = [out_dir / f"{m}.npz" for m in months]
+
+    def build(path):
+        counts = HashtagCounts()
+        for part in partials:
+            counts.merge(HashtagCounts.load(part))
+        counts.save(path)
+
+    hashtag_dir = Path(hashtag_dir or out_dir)
+    products = {}
+    if partials:
+        cache.artifact(f"{platform}/hashtag_counts", hashtag_dir / "hashtag_counts.npz",
+                       build, inputs=partials)
+        products = {k: str(v) for k, v in hashtag_products(cache, platform, hashtag_dir, top).items()}
+
+    repeats = cross_month_duplicates({m: np.load(out_dir / f"{m}.ids.npy") for m in months})
+    report_rows = [dict(rows[m], duplicates=repeats[m]) for m in months]
+    totals = {key: sum(r[key] for r in report_rows)
+              for key in ("posts", "duplicates", "declared_lang", "declared_other", "undeclared",
+                          "detected_lang", "kept", "hashtags", "seconds")}
+    report = {"collection": name, "platform": platform, "months": report_rows, "total": totals,
+              "products": products}
+    _write_json(report, out_dir.parent / "report.json")
+    return report
+
+
+# -- driver ------------------------------------------------------------------
+
+def plan(config, collections=None, platforms=None):
+    """ (collection, platform, month, store) of every partition to process. """
+    for name, collection in config["collections"].items():
+        if collections and name not in collections:
+            continue
+        store = PostStore(collection["store"])
+        for platform in platforms or config["platforms"]:
+            for month in store.months(platform):
+                yield name, platform, month, store
+
+
+def run(config, collections=None, platforms=None, force=False) -> list[dict]:
+    """ Map every month partition on the pool, then reduce per (collection,
+    platform). Returns the reports. """
+    work_dir = Path(config["work_dir"])
+    lang = config["lang"] or None
+    params = {"lang": lang, "detect": config["detect"], "langid_seed": SEED, "version": VERSION}
+    caches: dict[str, BuildCache] = {}
+    rows: dict[tuple[str, str], dict[str, dict]] = {}
+    tasks = []
+    for name, platform, month, store in plan(config, collections, platforms):
+        cache = caches.setdefault(name, BuildCache(work_dir / name))
+        rows.setdefault((name, platform), {})
+        out = cache.root / platform / "months" / month
+        month_file = store.month_file(platform, month)
+        key = cache.key([month_file], params)
+        artifact = f"{platform}/months/{month}"
+        if not force and cache.fresh(artifact, key, out.with_suffix(".json")) \
+                and out.with_suffix(".npz").exists() and out.with_suffix(".ids.npy").exists():
+            with out.with_suffix(".json").open("r", encoding="utf-8") as fh:
+                rows[(name, platform)][month] = json.load(fh)
+            cache.reused.append(artifact)
+            continue
+        tasks.append({"collection": name, "platform": platform, "month": month, "store": str(store.root),
+                      "out": str(out), "lang": lang, "detect": config["detect"],
+                      "key": key, "artifact": artifact, "size": month_file.stat().st_size})
+
+    workers = config["workers"] or os.cpu_count() or 1
+    reused = sum(len(c.reused) for c in caches.values())
+    print(f"{len(tasks)} month partitions to process on {workers} workers, {reused} up to date")
+    t0, busy = time.perf_counter(), 0.0
+    if tasks:
+        langid_cache = config["langid_cache"] if config["detect"] else None
+        with ProcessPoolExecutor(min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(langid_cache, SEED)) as pool:
+            futures = {pool.submit(process_month, task): task
+                       for task in sorted(tasks, key=lambda t: t["size"], reverse=True)}
+            for done, future in enumerate(as_completed(futures), 1):
+                task = futures[future]
+                row = future.result()
+                rows[(task["collection"], task["platform"])][task["month"]] = row
+                busy += row["seconds"]
+                caches[task["collection"]].record(task["artifact"], task["key"], Path(task["out"]).with_suffix(".json"))
+                print(f"[{done}/{len(tasks)}] {task['collection']} {task['platform']} {task['month']}: "
+                      f"{row['posts']} posts, {row['kept']} kept, {row['hashtags']} hashtags ({row['seconds']:.1f} s)")
+    wall = time.perf_counter() - t0
+
+    reports = []
+    for (name, platform), month_rows in rows.items():
+        collection = config["collections"][name]
+        hashtag_dir = collection.get("hashtag_dir")
+        if hashtag_dir:
+            hashtag_dir = hashtag_dir.format(platform=platform)
+        cache = caches[name]
+        reports.append(reduce_platform(cache, name, platform, month_rows, cache.root / platform / "months",
+                                       hashtag_dir, config["top"]))
+    if tasks and wall:
+        print(f"map: {wall:.1f} s wall, {busy:.1f} s of work, {busy / wall:.1f}x parallel speed-up")
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel per-month reprocessing of the post store")
+    parser.add_argument("--config", help="JSON file merged over DEFAULT_CONFIG")
+    parser.add_argument("--collections", nargs="+", help="only these collections (default: all in the config)")
+    parser.add_argument("--platforms", nargs="+", choices=PLATFORMS)
+    parser.add_argument("--workers", type=int, help="processes (default: config, else one per CPU)")
+    parser.add_argument("--lang", help="language to keep ('' keeps all)")
+    parser.add_argument("--no-detect", action="store_true",
+                        help="treat undeclared-language posts as other languages instead of identifying them")
+    parser.add_argument("--force", action="store_true", help="recompute months that did not change")
+    parser.add_argument("--print-config", action="store_true", help="print the resolved config and exit")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.workers is not None:
+        overrides["workers"] = args.workers
+    if args.lang is not None:
+        overrides["lang"] = args.lang
+    if args.no_detect:
+        overrides["detect"] = False
+    config = load_config(args.config, overrides)
+    if args.print_config:
+        print(json.dumps(config, indent=2))
+        return
+
+    for report in run(config, args.collections, args.platforms, args.force):
+        t = report["total"]
+        print(f"{report['collection']} {report['platform']}: {len(report['months'])} months, "
+              f"{t['posts']} posts, {t['duplicates']} duplicates, {t['kept']} kept "
+              f"({t['declared_lang']} declared, {t['detected_lang']} detected), {t['hashtags']} hashtags")
+        for product in report["products"].values():
+            print(f"    {product}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Content-hash keyed cache for derived artifacts.
+
+The hashtag chain of the notebooks (month posts -> counts ->
+hashtag_norm.json -> top100_hashtags.json -> top100_cumulata.png) used to
+be recomputed from scratch on every run. `BuildCache` records, for every
+artifact, a key made of the content hashes of its input files and of its
+parameters; `artifact()` only calls the build function when that key
+changed (or the output file is gone). Inputs are never modified, so the
+month partitions and raw downloads stay as downloaded.
+
+File hashes are memoized on (size, mtime) in the manifest, so an
+unchanged month costs one stat(). Hashtags are counted per month into
+partial count tables (one .npz per month partition) and the partials are
+merged: adding a month to an 18-month corpus counts one month and merges
+18 small vectors.
+
+    python -m common.build hashtags ./dataset/store/100_posts bluesky bluesky/code/hashtag/100_posts
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from common.hashtags import HashtagCounts
+
+BUILD_CACHE = Path("./.progress/build")
+HASH_CHUNK = 1 << 20
+VERSION = 1               # bump when a build function changes its output
+
+
+def _hash_bytes(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_file(path) -> str:
+    """ Content hash of a file (blake2b, 128 bits), read in chunks. """
+    h = hashlib.blake2b(digest_size=16)
+    with Path(path).open("rb") as fh:
+        while chunk := fh.read(HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _params_key(params) -> str:
+    return _hash_bytes(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+
+
+class BuildCache:
+    """ Manifest of built artifacts: name -> key of the inputs it was built from. """
+
+    def __init__(self, root=BUILD_CACHE):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.json"
+        self.manifest = {"files": {}, "artifacts": {}}
+        if self.manifest_path.exists():
+            with self.manifest_path.open("r", encoding="utf-8") as fh:
+                self.manifest = json.load(fh)
+        self.built: list[str] = []
+        self.reused: list[str] = []
+
+    def file_hash(self, path) -> str:
+        """ Content hash of a file, re-read only when its size or mtime changed. """
+        path = Path(path)
+        st = path.stat()
+        stamp = [st.st_size, st.st_mtime_ns]
+        memo = self.manifest["files"].get(str(path))
+        if memo is not None and memo["stamp"] == stamp:
+            return memo["hash"]
+        digest = hash_file(path)
+        self.manifest["files"][str(path)] = {"stamp": stamp, "hash": digest}
+        return digest
+
+    def key(self, inputs=(), params=None) -> str:
+        """ One key for a set of input files (order-insensitive) and parameters. """
+        hashes = sorted(self.file_hash(p) for p in inputs)
+        return _params_key({"inputs": hashes, "params": params, "version": VERSION})
+
+    def fresh(self, name, key, path) -> bool:
+        entry = self.manifest["artifacts"].get(name)
+        return entry is not None and entry["key"] == key and Path(path).exists()
+
+    def artifact(self, name, path, build, inputs=(), params=None) -> Path:
+        """ `build(path)` writes the artifact at `path`, unless the one already
+        there was built from the same inputs and parameters. """
+        path = Path(path)
+        key = self.key(inputs, params)
+        if self.fresh(name, key, path):
+            self.reused.append(name)
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        build(path)
+        self.record(name, key, path)
+        return path
+
+    def record(self, name, key, path):
+        """ Register an artifact built elsewhere (e.g. in a worker process, see
+        common.batch) from inputs with this key. """
+        self.manifest["artifacts"][name] = {"key": key, "path": str(path)}
+        self.built.append(name)
+        self.save()
+
+    def save(self):
+        tmp = self.manifest_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump(self.manifest, fh, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+
+def _dump_json(obj, path):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as fh:
+        json.dump(obj, fh, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# -- hashtag chain -------------------------------------------------------------
+
+def month_partials(cache, store, platform, filters=None, params=None) -> dict[str, Path]:
+    """ One HashtagCounts .npz per month partition, rebuilt only for the
+    months whose partition changed. `params` must describe `filters` (e.g.
+    {"lang": "en"}); it defaults to the filters themselves, which is only
+    right for filters that do not change with the other months. """
+    params = {"filters": filters if params is None else params, "platform": platform}
+    # one shared cache serves every collection (100_posts, random, ...)
+    collection = Path(store.root).name
+    partials = {}
+    for month in store.months(platform):
+
+        def build(path, month=month):
+            counts = HashtagCounts()
+            table = store.read(["tags"], filters=filters, platform=platform, months=[month])
+            for post_tags in table.column("tags").to_pylist():
+                counts.update(post_tags, month)
+            counts.save(path)
+
+        partials[month] = cache.artifact(
+            f"{collection}/{platform}/partials/{month}",
+            cache.root / collection / platform / "partials" / f"{month}.npz",
+            build, inputs=[store.month_file(platform, month)], params=params,
+        )
+    return partials
+
+
+def hashtag_counts(cache, store, platform, out_dir, filters=None, params=None) -> HashtagCounts:
+    """ Whole-corpus counts (out_dir/hashtag_counts.npz) merged from the partials. """
+    partials = month_partials(cache, store, platform, filters, params)
+
+    def build(path):
+        counts = HashtagCounts()
+        for part in partials.values():
+            counts.merge(HashtagCounts.load(part))
+        counts.save(path)
+
+    path = cache.artifact(f"{Path(store.root).name}/{platform}/hashtag_counts",
+                          Path(out_dir) / "hashtag_counts.npz", build, inputs=list(partials.values()))
+    return HashtagCounts.load(path)
+
+
+def hashtag_products(cache, platform, out_dir, top=100) -> dict[str, Path]:
+    """ hashtag_norm.json and top100_hashtags.json from hashtag_counts.npz. """
+    out_dir = Path(out_dir)
+    counts_file = out_dir / "hashtag_counts.npz"
+    norm = cache.artifact(
+        f"{platform}/hashtag_norm", out_dir / "hashtag_norm.json",
+        lambda path: _dump_json(HashtagCounts.load(counts_file).counter(), path),
+        inputs=[counts_file],
+    )
+    top_list = cache.artifact(
+        f"{platform}/top{top}_hashtags", out_dir / f"top{top}_hashtags.json",
+        lambda path: _dump_json([tag for tag, _ in HashtagCounts.load(counts_file).top(top)], path),
+        inputs=[counts_file], params={"top": top},
+    )
+    return {"hashtag_norm": norm, "top": top_list}
+
+
+def cumulative_plot(cache, platform, day_counts, top_file, out_png, title=None) -> Path:
+    """ top100_cumulata.png: cumulative share, in a crawled day, of the top list. """
+
+    def build(path):
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        with open(top_file, "r", encoding="utf-8") as fh:
+            tags = json.load(fh)
+        share = HashtagCounts.load(day_counts).cumulative_share(tags)
+        plt.figure(figsize=(12, 6))
+        plt.plot(tags, share, marker="o", color="blue", linewidth=2)
+        plt.xticks(rotation=90)
+        plt.xlabel("Hashtag")
+        plt.ylabel("Cumulata %")
+        plt.title(title or f"Cumulative distribution {platform.capitalize()}")
+        plt.tight_layout()
+        plt.grid(True)
+        plt.savefig(path)
+        plt.close()
+
+    return cache.artifact(f"{platform}/{Path(out_png).name}", out_png, build,
+                          inputs=[day_counts, top_file], params={"title": title})
+
+
+def main(argv=None):
+    from common.store import PostStore
+
+    parser = argparse.ArgumentParser(description="Incremental rebuild of the hashtag artifacts")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    tags = sub.add_parser("hashtags", help="counts, hashtag_norm.json, top-k list (and cumulative plot)")
+    tags.add_argument("root", help="collection root, e.g. ./dataset/store/100_posts")
+    tags.add_argument("platform", choices=["bluesky", "mastodon"])
+    tags.add_argument("out_dir", help="where hashtag_counts.npz and the json files go")
+    tags.add_argument("--lang", default="en", help="declared language to keep ('' keeps all)")
+    tags.add_argument("--top", type=int, default=100)
+    tags.add_argument("--day-counts", help="counts .npz of a crawled day, for the cumulative plot")
+    tags.add_argument("--cache", default=str(BUILD_CACHE))
+    args = parser.parse_args(argv)
+
+    cache = BuildCache(args.cache)
+    store = PostStore(args.root)
+    filters = [("language", "=", args.lang)] if args.lang else None
+    counts = hashtag_counts(cache, store, args.platform, args.out_dir, filters)
+    products = hashtag_products(cache, args.platform, args.out_dir, args.top)
+    if args.day_counts:
+        cumulative_plot(cache, args.platform, args.day_counts, products["top"],
+                        Path(args.out_dir) / f"top{args.top}_cumulata.png")
+    print(f"{int(counts.total().sum())} hashtags, {len(counts.vocab)} unique")
+    print(f"built {len(cache.built)}: {', '.join(cache.built) or '-'}")
+    print(f"up to date {len(cache.reused)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Crash-safe progress store for the download scripts.
+
+One SQLite file records:
+
+- units: finished (platform, query, day) units and the last cursor of
+  unfinished ones, so a restart skips finished days;
+- files: the committed byte offset of every append-only output log;
+- seen:  every saved URI / status id, for deduplication across the whole
+  run without keeping them all in memory.
+
+Posts are appended to a JSONL log and committed together with their seen
+keys: `checkpoint()` fsyncs the log and then commits the offset, the seen
+inserts and the unit state in one transaction. After a crash the log is
+truncated back to the committed offset and SQLite rolls back the seen keys
+of the same lost page, so the two never disagree. Finished months are
+rendered into the JSON arrays the notebooks read with `write_json_array`,
+which can also draw the per-month random sample on the way.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from common import metrics
+from common.sampling import sample_lines
+
+CACHE_SIZE = 100_000   # recently seen keys kept in memory in front of SQLite
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    platform TEXT NOT NULL,
+    query    TEXT NOT NULL,
+    day      TEXT NOT NULL,
+    done     INTEGER NOT NULL DEFAULT 0,
+    cursor   TEXT,
+    saved    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (platform, query, day)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path   TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seen (
+    platform TEXT NOT NULL,
+    key      TEXT NOT NULL,
+    PRIMARY KEY (platform, key)
+) WITHOUT ROWID;
+"""
+
+
+class ProgressStore:
+    """ Durable (platform, query, day) progress + bounded-memory dedup. """
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+        self.cache_size = cache_size
+        self._recent: OrderedDict[tuple[str, str], None] = OrderedDict()
+        # one connection shared by worker threads (e.g. days fetched in parallel)
+        self._lock = threading.RLock()
+
+    # -- units -------------------------------------------------------------
+
+    def is_done(self, platform, query, day) -> bool:
+        with self._lock:
+            row = self.db.execute(
+                "SELECT done FROM units WHERE platform=? AND query=? AND day=?",
+                (platform, query, str(day)),
+            ).fetchone()
+        return bool(row and row[0])
+
+    def cursor(self, platform, query, day) -> str | None:
+        """ Last committed cursor of an unfinished unit. """
+        with self._lock:
+            row = self.db.execute(
+                "SELECT cursor FROM units WHERE platform=? AND query=? AND day=? AND done=0",
+                (platform, query, str(day)),
+            ).fetchone()
+        return row[0] if row else None
+
+    # -- dedup -------------------------------------------------------------
+
+    def add_seen(self, platform, key) -> bool:
+        """ Record a key, True if it was not seen before. The insert becomes
+        durable with the next checkpoint(). """
+        k = (platform, str(key))
+        with self._lock:
+            if k in self._recent:
+                self._recent.move_to_end(k)
+                metrics.DEDUP.inc(platform=platform, result="hit")
+                return False
+            cur = self.db.execute("INSERT OR IGNORE INTO seen (platform, key) VALUES (?, ?)", k)
+            self._recent[k] = None
+            if len(self._recent) > self.cache_size:
+                self._recent.popitem(last=False)
+            new = cur.rowcount == 1
+        metrics.DEDUP.inc(platform=platform, result="miss" if new else "hit")
+        return new
+
+    def has_seen(self, platform, key) -> bool:
+        """ Membership test without recording the key. Not counted in
+        metrics.DEDUP: the add_seen() that follows for a kept key is. """
+        k = (platform, str(key))
+        with self._lock:
+            return k in self._recent or \
+                self.db.execute("SELECT 1 FROM seen WHERE platform=? AND key=?", k).fetchone() is not None
+
+    def seen_count(self, platform) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM seen WHERE platform=?", (platform,)).fetchone()[0]
+
+    # -- output logs -------------------------------------------------------
+
+    def open_log(self, path):
+        """ Open an append-only JSONL log, cut back to the last committed offset. """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            row = self.db.execute("SELECT offset FROM files WHERE path=?", (str(path),)).fetchone()
+        fh = path.open("a+b")
+        fh.truncate(row[0] if row else 0)
+        fh.seek(0, os.SEEK_END)
+        return fh
+
+    def checkpoint(self, fh, platform, query, day, cursor=None, done=False, saved=0):
+        """ Make everything written to `fh` and every add_seen() so far durable,
+        together with the state of the (platform, query, day) unit. """
+        fh.flush()
+        os.fsync(fh.fileno())
+        with self._lock:
+            self.db.execute(
+                "INSERT INTO files (path, offset) VALUES (?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET offset=excluded.offset",
+                (fh.name, fh.tell()),
+            )
+            self.db.execute(
+                "INSERT INTO units (platform, query, day, done, cursor, saved) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(platform, query, day) DO UPDATE SET "
+                "done=excluded.done, cursor=excluded.cursor, saved=units.saved + excluded.saved",
+                (platform, query, str(day), int(done), cursor, saved),
+            )
+            self.db.commit()
+
+    def close(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def append_post(fh, post):
+    """ One JSON document per line, same serialization as the scripts used. """
+    data = (json.dumps(post, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    fh.write(data)
+    metrics.POSTS_WRITTEN.inc(sink="log")
+    metrics.BYTES_WRITTEN.inc(len(data), sink="log")
+
+
+def write_json_array(log_path, out_file, k=None, seed=None):
+    """ Render a JSONL log as the pretty `[ ... ]` array the notebooks load,
+    optionally as a seeded uniform sample of k posts (streamed, see
+    common.sampling). Written to a temporary file and renamed, so a crash
+    never leaves a half-written month behind. """
+    out_file = Path(out_file)
+    tmp = out_file.with_suffix(out_file.suffix + ".tmp")
+    if k is None:
+        src = open(log_path, "r", encoding="utf-8")
+    else:
+        src = sample_lines(log_path, k, seed)
+    try:
+        with tmp.open("w", encoding="utf-8") as fh:
+            fh.write("[\n")
+            first_elem = True
+            for line in src:
+                if not line.strip():
+                    continue
+                if not first_elem:
+                    fh.write(",\n")
+                fh.write(line.rstrip("\n"))
+                first_elem = False
+            fh.write("\n]\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+    finally:
+        if k is None:
+            src.close()
+    os.replace(tmp, out_file)
@@ -0,0 +1,282 @@
+"""
+Shared HTTP engine for the crawlers.
+
+One long-lived, pooled client per process instead of a new connection per
+request: keep-alive, HTTP/2 when the `h2` package is installed, and a
+concurrency limit that follows server latency (AIMD) instead of a fixed
+semaphore. The async client is used by `crawl_day`, the pooled
+`requests.Session` by the synchronous download scripts (and can be handed
+to `Mastodon(session=...)`). Every request of both clients first takes a
+token from the shared header-driven limiter in `common.ratelimit`, and is
+counted by status code and timed in `common.metrics`. With HTTP_CACHE set,
+GETs of both clients are answered from the `common.httpcache` record/replay
+cache first; a hit takes no token and no adaptive slot.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from common import httpcache, metrics, ratelimit
+
+try:
+    import h2  # noqa: F401  (only needed for http2=True)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+MAX_CONNECTIONS = 32      # upper bound of open sockets per client
+MAX_KEEPALIVE = 16        # idle sockets kept open for reuse
+KEEPALIVE_EXPIRY = 60     # seconds an idle socket is kept
+TIMEOUT = 25              # seconds per request
+
+
+class AdaptiveLimiter:
+    """ Concurrency limit that grows while latency stays close to the best
+    smoothed latency seen so far and halves when latency degrades or the server pushes back
+    (429 / 5xx). Additive increase of 1/limit per good response means about
+    +1 slot per round trip of the whole window. """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, tolerance=1.5, smoothing=0.2):
+        self.limit = float(initial)
+        self.minimum, self.maximum = minimum, maximum
+        self.tolerance = tolerance      # avg/base latency ratio considered congestion
+        self.smoothing = smoothing      # EWMA weight of the newest sample
+        self.in_flight = 0
+        self.avg_latency: float | None = None    # short term EWMA
+        self.base_latency: float | None = None   # lowest short term EWMA, drifting up
+        self._last_decrease = 0.0
+        self._cond: asyncio.Condition | None = None
+
+    async def acquire(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency, ok=True):
+        self.record(latency, ok)
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record(self, latency, ok=True):
+        """ Update the latency statistics and move the limit. """
+        if self.avg_latency is None:
+            self.avg_latency = self.base_latency = latency
+        else:
+            self.avg_latency += self.smoothing * (latency - self.avg_latency)
+            # slow upward drift lets the baseline follow a server that got slower for good
+            self.base_latency = min(self.base_latency * 1.001, self.avg_latency)
+
+        congested = self.avg_latency > self.base_latency * self.tolerance
+        if not ok or congested:
+            # at most one decrease per round trip, otherwise a burst of slow
+            # responses from the same window collapses the limit to the minimum
+            now = time.monotonic()
+            if now - self._last_decrease > self.avg_latency:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+def _record(url, status, seconds):
+    host, endpoint = metrics.endpoint(url)
+    metrics.HTTP_REQUESTS.inc(host=host, endpoint=endpoint, status=status)
+    metrics.HTTP_SECONDS.observe(seconds, host=host, endpoint=endpoint)
+
+
+def _requests_response(hit: httpcache.CachedResponse) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = hit.status
+    resp.headers = CaseInsensitiveDict(hit.headers)
+    resp._content = hit.body
+    resp.url = hit.url
+    resp.encoding = "utf-8"
+    resp.reason = "OK"
+    return resp
+
+
+def _httpx_response(method, url, params, hit: httpcache.CachedResponse) -> httpx.Response:
+    return httpx.Response(hit.status, headers=hit.headers, content=hit.body,
+                          request=httpx.Request(method, url, params=params))
+
+
+class _LimitedSession(requests.Session):
+    """ requests.Session that takes a rate-limit token before every request
+    and feeds the response headers back into the limiter. GETs are answered
+    from the response cache when one is given. """
+
+    def __init__(self, rate_limiter, cache: httpcache.ResponseCache | None = None):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+
+    def request(self, method, url, *args, **kwargs):
+        cached = self.cache is not None and self.cache.handles(method)
+        if cached:
+            # requests.Session.request(method, url, params, ...)
+            params = args[0] if args else kwargs.get("params")
+            hit = self.cache.lookup(method, url, params)
+            if hit is not None:
+                return _requests_response(hit)
+        self.rate_limiter.acquire(url)
+        t0 = time.perf_counter()
+        try:
+            resp = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            _record(url, "error", time.perf_counter() - t0)
+            self.rate_limiter.release(url)
+            raise
+        _record(url, resp.status_code, time.perf_counter() - t0)
+        self.rate_limiter.update(url, resp.headers, resp.status_code)
+        if cached:
+            self.cache.store(method, url, params, resp.status_code, resp.headers, resp.content)
+        return resp
+
+
+def _pooled_session(max_connections, max_keepalive, rate_limiter, cache=None):
+    """ Limited session with a connection pool sized like the async client. """
+    session = _LimitedSession(rate_limiter, cache)
+    adapter = HTTPAdapter(pool_connections=max_keepalive, pool_maxsize=max_connections)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class CrawlEngine:
+    """ Pooled sync + async HTTP clients shared by every task of a run. """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_keepalive=MAX_KEEPALIVE,
+                 timeout=TIMEOUT, http2=True, limiter: AdaptiveLimiter | None = None,
+                 rate_limiter: ratelimit.RateLimiter = ratelimit.limiter,
+                 cache: httpcache.ResponseCache | None = None):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.limiter = limiter or AdaptiveLimiter(maximum=max_connections)
+        self.rate_limiter = rate_limiter
+        self.cache = cache if cache is not None else httpcache.from_env()
+        self._client: httpx.AsyncClient | None = None
+        self._session: requests.Session | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """ Async client, created on first use inside the running loop. """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._client
+
+    @property
+    def offline(self) -> bool:
+        """ Replaying a recorded cache: nothing may reach the network. """
+        return self.cache is not None and self.cache.mode == httpcache.REPLAY
+
+    @property
+    def session(self) -> requests.Session:
+        """ Pooled session for the synchronous scripts. """
+        if self._session is None:
+            self._session = _pooled_session(self.max_connections, self.max_keepalive,
+                                            self.rate_limiter, self.cache)
+        return self._session
+
+    async def request(self, method, url, *, headers=None, params=None, json=None) -> httpx.Response:
+        """ One request through the shared client, holding a rate-limit token and
+        one adaptive slot. The response is returned as-is, status handling
+        (retries after a 429 simply call again) is up to the caller. """
+        cached = self.cache is not None and self.cache.handles(method)
+        if cached:
+            hit = self.cache.lookup(method, url, params)
+            if hit is not None:
+                return _httpx_response(method, url, params, hit)
+        await self.rate_limiter.aacquire(url)
+        await self.limiter.acquire()
+        t0, ok, resp = time.monotonic(), False, None
+        try:
+            resp = await self.client.request(method, url, headers=headers, params=params, json=json)
+            ok = resp.status_code != 429 and resp.status_code < 500
+            if cached:
+                self.cache.store(method, url, params, resp.status_code, resp.headers, resp.content)
+            return resp
+        finally:
+            latency = time.monotonic() - t0
+            await self.limiter.release(latency, ok)
+            _record(url, "error" if resp is None else resp.status_code, latency)
+            if resp is None:
+                self.rate_limiter.release(url)
+            else:
+                self.rate_limiter.update(url, resp.headers, resp.status_code)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, *, headers=None, params=None, read_timeout=None):
+        """ Long-lived streaming response (server-sent events), read with
+        `aiter_lines()`. The rate-limit token covers the connect only and no
+        adaptive slot is held, so an open stream does not throttle the other
+        requests; `read_timeout` is the silence after which it counts as dead. """
+        await self.rate_limiter.aacquire(url)
+        t0, resp = time.monotonic(), None
+        timeout = httpx.Timeout(self.timeout, read=read_timeout)
+        try:
+            async with self.client.stream(method, url, headers=headers, params=params, timeout=timeout) as resp:
+                _record(url, resp.status_code, time.monotonic() - t0)
+                self.rate_limiter.update(url, resp.headers, resp.status_code)
+                yield resp
+        except httpx.HTTPError:
+            if resp is None:
+                _record(url, "error", time.monotonic() - t0)
+                self.rate_limiter.release(url)
+            raise
+
+    async def get(self, url, *, headers=None, params=None) -> httpx.Response:
+        return await self.request("GET", url, headers=headers, params=params)
+
+    async def post(self, url, *, headers=None, json=None) -> httpx.Response:
+        return await self.request("POST", url, headers=headers, json=json)
+
+    def get_sync(self, url, *, headers=None, params=None, timeout=None) -> requests.Response:
+        """ GET through the pooled requests session. """
+        return self.session.get(url, headers=headers, params=params,
+                                timeout=timeout or self.timeout)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.close()
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.flush()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,276 @@
+"""
+Hashtag counting on interned ids.
+
+Tags are normalized once (`normalize_tag`: Unicode NFKC + casefold, leading
+'#' dropped, so "#ClimateChange", "climatechange" and "ＣｌｉｍａｔｅＣｈａｎｇｅ"
+are one tag) and interned to dense integer ids by `TagVocab`.
+`HashtagCounts` keeps one numpy count vector per month over that
+vocabulary: months can be added one at a time, merged from another run
+(`merge`, ids are remapped) or saved to a single .npz, and every statistic
+the notebooks need comes from the vectors:
+
+- top(k): heap selection over the non-zero counts, no full sort;
+- counter(): the same Counter as hashtag_norm.json, if a file is wanted;
+- cumulative_share(tags): the curve of top100_cumulata.png.
+
+For streams that are too large for an exact vocabulary, `SpaceSaving`
+(deterministic heavy hitters, error bounded by N/k) and `CountMinSketch`
+(fixed memory, over-estimates only) answer top-k with the same
+`update(tags, month)` / `top(k)` interface.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+SKETCH_WIDTH = 1 << 16
+SKETCH_DEPTH = 4
+
+
+def normalize_tag(tag) -> str:
+    return unicodedata.normalize("NFKC", tag).casefold().lstrip("#")
+
+
+class TagVocab:
+    """ Normalized tag <-> dense integer id. """
+
+    def __init__(self, tags=()):
+        self.ids: dict[str, int] = {}
+        self.tags: list[str] = []
+        for tag in tags:
+            self.intern(tag, normalized=True)
+
+    def intern(self, tag, normalized=False) -> int:
+        if not normalized:
+            tag = normalize_tag(tag)
+        i = self.ids.get(tag)
+        if i is None:
+            i = self.ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return i
+
+    def get(self, tag):
+        return self.ids.get(normalize_tag(tag))
+
+    def remap(self, other: TagVocab) -> np.ndarray:
+        """ ids of `other` -> ids in this vocabulary (new tags are interned). """
+        return np.fromiter((self.intern(t, normalized=True) for t in other.tags),
+                           dtype=np.int64, count=len(other.tags))
+
+    def __getitem__(self, i) -> str:
+        return self.tags[i]
+
+    def __len__(self):
+        return len(self.tags)
+
+
+class HashtagCounts:
+    """ Exact per-month count vectors over one TagVocab. """
+
+    def __init__(self, vocab: TagVocab | None = None):
+        self.vocab = vocab or TagVocab()
+        self.months: dict[str, np.ndarray] = {}
+
+    def _vec(self, month) -> np.ndarray:
+        """ Count vector of a month, grown (doubling) to cover the vocabulary. """
+        vec = self.months.get(month)
+        size = len(self.vocab)
+        if vec is None or len(vec) < size:
+            grown = np.zeros(max(size, 2 * (len(vec) if vec is not None else 0), 64), dtype=np.int64)
+            if vec is not None:
+                grown[:len(vec)] = vec
+            vec = self.months[month] = grown
+        return vec
+
+    def update(self, tags, month=None):
+        """ Count the tags of one post (or any batch) in `month`. """
+        ids = [self.vocab.intern(t) for t in tags]
+        if ids:
+            np.add.at(self._vec(month), ids, 1)
+
+    def add_batch(self, batch):
+        """ Count the hashtags of a common.posts.PostBatch, per creation month
+        (UTC), with one bincount per month. """
+        ids = batch.tag_ids if batch.tags is self.vocab else self.vocab.remap(batch.tags)[batch.tag_ids]
+        if not len(ids):
+            return self
+        months = batch.months()[batch.tag_posts()]
+        for month in np.unique(months):
+            vec = self._vec(str(month))
+            vec += np.bincount(ids[months == month], minlength=len(vec))
+        return self
+
+    def merge(self, other: HashtagCounts):
+        """ Add the counts of another table, e.g. a new day or a parallel run. """
+        mapping = self.vocab.remap(other.vocab)
+        for month, vec in other.months.items():
+            n = min(len(vec), len(mapping))
+            np.add.at(self._vec(month), mapping[:n], vec[:n])
+        return self
+
+    def total(self, months=None) -> np.ndarray:
+        """ Counts summed over `months` (all by default), one entry per tag id. """
+        size = len(self.vocab)
+        out = np.zeros(size, dtype=np.int64)
+        for month in (self.months if months is None else months):
+            vec = self.months.get(month)
+            if vec is not None:
+                n = min(len(vec), size)
+                out[:n] += vec[:n]
+        return out
+
+    def top(self, k, months=None) -> list[tuple[str, int]]:
+        """ k most frequent tags, ties in first-seen order (as sorted() on a Counter). """
+        vec = self.total(months)
+        nonzero = np.flatnonzero(vec)
+        best = heapq.nlargest(k, nonzero.tolist(), key=vec.__getitem__)
+        return [(self.vocab[i], int(vec[i])) for i in best]
+
+    def counter(self, months=None) -> Counter:
+        vec = self.total(months)
+        return Counter({self.vocab[i]: int(vec[i]) for i in np.flatnonzero(vec)})
+
+    def count(self, tag, months=None) -> int:
+        i = self.vocab.get(tag)
+        return 0 if i is None else int(self.total(months)[i])
+
+    def cumulative_share(self, tags, months=None) -> np.ndarray:
+        """ Cumulative % of the counts of `tags`, in the given order (top100_cumulata). """
+        vec = self.total(months)
+        counts = np.array([vec[i] if (i := self.vocab.get(t)) is not None else 0 for t in tags], dtype=np.float64)
+        total = counts.sum()
+        return np.cumsum(counts) / total * 100 if total else np.zeros(len(counts))
+
+    def save(self, path):
+        """ One .npz: the vocabulary and a months x tags matrix. """
+        names = sorted(self.months, key=lambda m: "" if m is None else m)
+        size = len(self.vocab)
+        matrix = np.zeros((len(names), size), dtype=np.int64)
+        for row, month in enumerate(names):
+            vec = self.months[month]
+            n = min(len(vec), size)
+            matrix[row, :n] = vec[:n]
+        np.savez_compressed(path, tags=json.dumps(self.vocab.tags), months=json.dumps(names), counts=matrix)
+
+    @classmethod
+    def load(cls, path) -> HashtagCounts:
+        with np.load(path) as data:
+            table = cls(TagVocab(json.loads(str(data["tags"]))))
+            for month, row in zip(json.loads(str(data["months"])), data["counts"]):
+                table.months[month] = row.copy()
+        return table
+
+
+class SpaceSaving:
+    """ Top-k heavy hitters in O(capacity) memory (Metwally et al.): every
+    count is over-estimated by at most N / capacity. """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self._heap: list[tuple[int, str]] = []   # (count, tag), stale entries skipped lazily
+        self.n = 0
+
+    def _min(self):
+        while True:
+            count, tag = self._heap[0]
+            if self.counts.get(tag) == count:
+                return count, tag
+            heapq.heappop(self._heap)
+
+    def add(self, tag, n=1):
+        self.n += n
+        if tag in self.counts:
+            self.counts[tag] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[tag] = n
+            self.errors[tag] = 0
+        else:
+            low, evicted = self._min()
+            heapq.heappop(self._heap)
+            del self.counts[evicted], self.errors[evicted]
+            self.counts[tag] = low + n
+            self.errors[tag] = low
+        heapq.heappush(self._heap, (self.counts[tag], tag))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, t) for t, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def update(self, tags, month=None):
+        for tag in tags:
+            self.add(normalize_tag(tag))
+
+    def top(self, k) -> list[tuple[str, int]]:
+        return heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])
+
+    def counter(self) -> Counter:
+        return Counter(self.counts)
+
+
+class CountMinSketch:
+    """ Fixed-size frequency sketch, plus the k current heaviest tags (a dict
+    and a lazy min-heap, like SpaceSaving) so that top-k can be answered. """
+
+    def __init__(self, k=100, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, seed=0):
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.salt = str(seed).encode("utf-8")
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._rows = np.arange(depth)
+        self.heavy: dict[str, int] = {}
+        self._heap: list[tuple[int, str]] = []   # (estimate, tag), stale entries skipped lazily
+        self.n = 0
+
+    def _cols(self, tag):
+        # double hashing: depth columns from one 128-bit digest
+        digest = hashlib.blake2b(tag.encode("utf-8"), digest_size=16, key=self.salt).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return np.array([(h1 + i * h2) % self.width for i in range(self.depth)])
+
+    def _min(self):
+        while True:
+            est, tag = self._heap[0]
+            if self.heavy.get(tag) == est:
+                return est, tag
+            heapq.heappop(self._heap)
+
+    def add(self, tag, n=1):
+        tag = normalize_tag(tag)
+        self.n += n
+        cols = self._cols(tag)
+        self.table[self._rows, cols] += n
+        est = int(self.table[self._rows, cols].min())
+        if tag not in self.heavy and len(self.heavy) >= self.k:
+            low, evicted = self._min()
+            if est <= low:
+                return
+            heapq.heappop(self._heap)
+            del self.heavy[evicted]
+        self.heavy[tag] = est
+        heapq.heappush(self._heap, (est, tag))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(c, t) for t, c in self.heavy.items()]
+            heapq.heapify(self._heap)
+
+    def estimate(self, tag) -> int:
+        cols = self._cols(normalize_tag(tag))
+        return int(self.table[self._rows, cols].min())
+
+    def update(self, tags, month=None):
+        for tag in tags:
+            self.add(tag)
+
+    def top(self, k=None) -> list[tuple[str, int]]:
+        return heapq.nlargest(k or self.k, self.heavy.items(), key=lambda item: item[1])
+
+    def counter(self) -> Counter:
+        return Counter(self.heavy)
@@ -0,0 +1,384 @@
+"""
+Record / replay cache of HTTP responses for the collectors.
+
+Re-running a downloader after a parser change or a crash used to repeat
+every searchPosts and timeline_* call, even though a window that closed long
+ago returns the same posts every time. With a `ResponseCache` on the shared
+engine (HTTP_CACHE=<dir>), every successful GET is kept on disk:
+
+- the key is the blake2b digest of the method, the URL and the normalized
+  query parameters (merged with the URL's own query, sorted, values as
+  strings). Headers, and so tokens, are never part of it;
+- bodies are gzip-compressed and stored under their own content hash
+  (blobs/ab/<hash>.gz), so identical pages such as empty windows are kept
+  once. An SQLite index holds the status, headers, store time, expiry and
+  last use of every entry;
+- only windows with a closed end are answered from the cache: a Bluesky
+  `until` or a Mastodon `max_id` (snowflake) older than SETTLE is cached for
+  good, a more recent one for RECENT_TTL. Requests without an end, and any
+  with `min_id` / `since_id` (polling for what is new, e.g. the stream
+  backfill), always go to the network; they are stored already expired, as
+  replay fixtures only;
+- the size is bounded: past `max_bytes` of blobs, the least recently used
+  entries are dropped.
+
+Modes (HTTP_CACHE_MODE):
+- "record" (the default): answer from the cache, fetch and store the misses;
+- "replay": never touch the network. A miss raises ReplayMiss and expiry
+  is ignored, so a recorded cache is a deterministic fixture for tests and
+  benchmarks;
+- "refresh": always fetch, and overwrite what was stored.
+
+Cache hits take no rate-limit token, so reprocessing past months costs no
+API quota. Streams (common.engine.CrawlEngine.stream) are not cached.
+
+    HTTP_CACHE=./.progress/http python bluesky/code/100_posts/download_100.py
+    python -m common.httpcache stats ./.progress/http
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from common import metrics
+
+CACHE_DIR = os.getenv("HTTP_CACHE")                  # unset: no cache
+MODE = os.getenv("HTTP_CACHE_MODE", "record")
+MAX_BYTES = int(float(os.getenv("HTTP_CACHE_MAX_MB") or 2048) * 1024 * 1024)
+SETTLE = 2 * 86400        # a window that ended this long ago no longer changes
+RECENT_TTL = 15 * 60      # seconds a recently closed window is reused
+LOW_WATER = 0.9           # eviction stops at this fraction of max_bytes
+TOUCH_BATCH = 256         # last-use updates written to the index at once
+COMPRESS_LEVEL = 6
+
+RECORD, REPLAY, REFRESH = "record", "replay", "refresh"
+
+# hop-by-hop and encoding headers describe the original transfer, not the
+# stored (decoded) body; rate-limit headers would feed stale budgets back
+_DROP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length",
+                 "set-cookie", "date", "age"}
+_DROP_PREFIXES = ("x-ratelimit", "ratelimit")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key     TEXT PRIMARY KEY,
+    request TEXT NOT NULL,
+    status  INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body    TEXT NOT NULL,
+    stored  REAL NOT NULL,
+    expires REAL,
+    used    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class ReplayMiss(LookupError):
+    """ A request that the replayed cache does not hold. """
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    headers: dict
+    body: bytes
+    url: str
+
+
+def _pairs(params) -> list[tuple[str, str]]:
+    if params is None:
+        return []
+    items = params.items() if hasattr(params, "items") else params
+    out = []
+    for key, value in items:
+        if value is None:
+            continue
+        for v in value if isinstance(value, (list, tuple)) else [value]:
+            if isinstance(v, bool):
+                v = str(v).lower()
+            out.append((str(key), str(v)))
+    return out
+
+
+def canonical_request(method, url, params=None) -> tuple[str, list[tuple[str, str]]]:
+    """ ("GET https://host/path?a=1&b=2", sorted params): what a cache key hashes. """
+    parts = urlsplit(str(url))
+    pairs = sorted(parse_qsl(parts.query, keep_blank_values=True) + _pairs(params))
+    base = f"{parts.scheme}://{parts.netloc.lower()}{parts.path}"
+    return f"{method.upper()} {base}?{urlencode(pairs)}", pairs
+
+
+def window_end(pairs) -> float | None:
+    """ End (epoch seconds) of the time window a request covers: Bluesky
+    `until`, or the time of a Mastodon `max_id` snowflake. None if open. """
+    params = dict(pairs)
+    if params.get("until"):
+        try:
+            when = dt.datetime.fromisoformat(params["until"].replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=dt.timezone.utc)
+        return when.timestamp()
+    if params.get("max_id", "").isdigit():
+        # snowflake: milliseconds since the epoch in the high bits
+        return (int(params["max_id"]) >> 16) / 1000
+    return None
+
+
+def closed_window(pairs) -> bool:
+    """ Whether a request covers a window with a fixed end, which the record
+    mode may answer from the cache. """
+    params = dict(pairs)
+    if params.get("min_id") or params.get("since_id"):
+        return False
+    return window_end(pairs) is not None
+
+
+def _stored_headers(headers) -> dict:
+    return {k: v for k, v in dict(headers).items()
+            if k.lower() not in _DROP_HEADERS and not k.lower().startswith(_DROP_PREFIXES)}
+
+
+class ResponseCache:
+    """ Content-addressed, size-bounded store of GET responses in `root`. """
+
+    def __init__(self, root, mode=MODE, max_bytes=MAX_BYTES, settle=SETTLE, recent_ttl=RECENT_TTL):
+        if mode not in (RECORD, REPLAY, REFRESH):
+            raise ValueError(f"unknown HTTP cache mode {mode!r}")
+        self.root = Path(root)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.settle = settle
+        self.recent_ttl = recent_ttl
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.root / "index.sqlite", check_same_thread=False, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # the cache can always be refetched: no fsync per stored page
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+        self._lock = threading.RLock()
+        self._touched: dict[str, float] = {}
+        self._bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        self.hits = self.misses = self.stored = self.evicted = 0
+
+    def handles(self, method) -> bool:
+        """ Whether a request goes through the cache (replay: all of them). """
+        return self.mode == REPLAY or method.upper() == "GET"
+
+    def _blob(self, digest) -> Path:
+        return self.root / "blobs" / digest[:2] / f"{digest}.gz"
+
+    def expiry(self, pairs, now=None) -> float | None:
+        """ None (never) for a window closed more than `settle` ago, `now` (a
+        replay fixture only) for a request without a closed window. """
+        now = time.time() if now is None else now
+        if not closed_window(pairs):
+            return now
+        if window_end(pairs) < now - self.settle:
+            return None
+        return now + self.recent_ttl
+
+    # -- lookups -----------------------------------------------------------------
+
+    def lookup(self, method, url, params=None) -> CachedResponse | None:
+        """ The stored response, or None when it has to be fetched. In replay
+        mode a miss raises ReplayMiss instead. """
+        request, pairs = canonical_request(method, url, params)
+        key = hashlib.blake2b(request.encode("utf-8"), digest_size=16).hexdigest()
+        host, endpoint = metrics.endpoint(url)
+        if self.mode == REFRESH:
+            return None
+        if self.mode == RECORD and not closed_window(pairs):
+            metrics.HTTP_CACHE.inc(host=host, endpoint=endpoint, result="bypass")
+            return None
+        with self._lock:
+            row = self.db.execute("SELECT status, headers, body, expires FROM entries WHERE key=?",
+                                  (key,)).fetchone()
+        result = "miss"
+        if row is not None and self.mode != REPLAY and row[3] is not None and row[3] < time.time():
+            result, row = "expired", None
+        if row is not None:
+            try:
+                with gzip.open(self._blob(row[2]), "rb") as fh:
+                    body = fh.read()
+            except (FileNotFoundError, OSError, EOFError):
+                row = None          # evicted by another process meanwhile, or a torn file
+        if row is None:
+            metrics.HTTP_CACHE.inc(host=host, endpoint=endpoint, result=result)
+            self.misses += 1
+            if self.mode == REPLAY:
+                raise ReplayMiss(f"not in the HTTP cache {self.root}: {request}")
+            return None
+        metrics.HTTP_CACHE.inc(host=host, endpoint=endpoint, result="hit")
+        self.hits += 1
+        self._touch(key)
+        return CachedResponse(row[0], json.loads(row[1]), body, str(url))
+
+    def _touch(self, key):
+        with self._lock:
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH:
+                self._flush_touched()
+
+    def _flush_touched(self):
+        if self._touched:
+            self.db.executemany("UPDATE entries SET used=? WHERE key=?",
+                                [(t, k) for k, t in self._touched.items()])
+            self.db.commit()
+            self._touched.clear()
+
+    # -- storing -----------------------------------------------------------------
+
+    def store(self, method, url, params, status, headers, body) -> bool:
+        """ Keep a response (200 to a GET only). Returns whether it was stored. """
+        if method.upper() != "GET" or status != 200 or self.mode == REPLAY:
+            return False
+        request, pairs = canonical_request(method, url, params)
+        key = hashlib.blake2b(request.encode("utf-8"), digest_size=16).hexdigest()
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        now = time.time()
+        with self._lock:
+            known = self.db.execute("SELECT size FROM blobs WHERE hash=?", (digest,)).fetchone()
+            if known is None or not self._blob(digest).exists():
+                path = self._blob(digest)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name("." + path.name + f".{os.getpid()}.tmp")
+                with open(tmp, "wb") as fh:
+                    fh.write(gzip.compress(body, COMPRESS_LEVEL))
+                os.replace(tmp, path)
+                size = path.stat().st_size
+                self.db.execute("INSERT OR REPLACE INTO blobs (hash, size) VALUES (?, ?)", (digest, size))
+                if known is None:
+                    self._bytes += size
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, request, status, headers, body, stored, expires, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, request, status, json.dumps(_stored_headers(headers)), digest, now,
+                 self.expiry(pairs, now), now),
+            )
+            self.db.commit()
+            self.stored += 1
+            if self._bytes > self.max_bytes:
+                self.evict()
+        return True
+
+    # -- maintenance -------------------------------------------------------------
+
+    def evict(self, target=None) -> int:
+        """ Drop least recently used entries until the blobs fit in `target`
+        bytes (LOW_WATER * max_bytes by default), then unreferenced blobs. """
+        target = int(self.max_bytes * LOW_WATER) if target is None else target
+        dropped = 0
+        with self._lock:
+            self._flush_touched()
+            while self._bytes > target:
+                keys = [k for (k,) in self.db.execute("SELECT key FROM entries ORDER BY used LIMIT 256")]
+                if not keys:
+                    break
+                self.db.executemany("DELETE FROM entries WHERE key=?", [(k,) for k in keys])
+                dropped += len(keys)
+                self._collect()
+            self.db.commit()
+        self.evicted += dropped
+        return dropped
+
+    def prune(self) -> int:
+        """ Drop expired entries and the blobs only they used. """
+        with self._lock:
+            self._flush_touched()
+            n = self.db.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?",
+                                (time.time(),)).rowcount
+            self._collect()
+            self.db.commit()
+        return n
+
+    def _collect(self):
+        orphans = self.db.execute(
+            "SELECT hash, size FROM blobs WHERE hash NOT IN (SELECT body FROM entries)").fetchall()
+        for digest, size in orphans:
+            self._blob(digest).unlink(missing_ok=True)
+            self._bytes -= size
+        self.db.executemany("DELETE FROM blobs WHERE hash=?", [(d,) for d, _ in orphans])
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._flush_touched()
+            entries, permanent = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(expires IS NULL), 0) FROM entries").fetchone()
+            blobs = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            expired = self.db.execute("SELECT COUNT(*) FROM entries WHERE expires < ?", (time.time(),)).fetchone()[0]
+            by_endpoint: dict[str, int] = {}
+            for (request,) in self.db.execute("SELECT request FROM entries"):
+                url = request.split(" ", 1)[1]
+                name = " ".join(metrics.endpoint(url))
+                by_endpoint[name] = by_endpoint.get(name, 0) + 1
+        return {"entries": entries, "permanent": permanent, "expired": expired, "blobs": blobs[0],
+                "bytes": blobs[1], "max_bytes": self.max_bytes, "endpoints": by_endpoint}
+
+    def flush(self):
+        """ Write the pending last-use times to the index. """
+        with self._lock:
+            self._flush_touched()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self.db.close()
+
+
+_shared: dict[tuple[str, str], ResponseCache] = {}
+_shared_lock = threading.Lock()
+
+
+def from_env() -> ResponseCache | None:
+    """ The process-wide cache of HTTP_CACHE / HTTP_CACHE_MODE, None when unset. """
+    if not CACHE_DIR:
+        return None
+    with _shared_lock:
+        key = (str(Path(CACHE_DIR).resolve()), MODE)
+        if key not in _shared:
+            _shared[key] = ResponseCache(CACHE_DIR, MODE)
+        return _shared[key]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or trim an HTTP response cache")
+    parser.add_argument("cmd", choices=["stats", "prune", "evict"])
+    parser.add_argument("root", help="cache directory (HTTP_CACHE)")
+    parser.add_argument("--max-mb", type=float, help="evict: size to trim to")
+    args = parser.parse_args(argv)
+
+    cache = ResponseCache(args.root, RECORD)
+    if args.cmd == "prune":
+        print(f"dropped {cache.prune()} expired entries")
+    elif args.cmd == "evict":
+        target = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+        print(f"dropped {cache.evict(target)} least recently used entries")
+    stats = cache.stats()
+    print(f"{stats['entries']} entries ({stats['permanent']} closed windows, {stats['expired']} expired), "
+          f"{stats['blobs']} bodies, {stats['bytes'] / 1e6:.1f} MB of {stats['max_bytes'] / 1e6:.0f} MB")
+    for name, n in sorted(stats["endpoints"].items(), key=lambda item: -item[1]):
+        print(f"  {n:8d}  {name}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
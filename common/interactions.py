@@ -0,0 +1,462 @@
+"""
+User interaction graph: who replies to, mentions, reposts and quotes whom.
+
+Every downloaded post already names its author and the accounts it points
+to:
+
+- Mastodon: `account.id` -> `in_reply_to_account_id` (reply),
+  `mentions[].id` (mention), `reblog.account.id` (repost),
+  `quote.quoted_status.account.id` (quote);
+- Bluesky:  `author.did` -> did of `record.reply.parent` (reply) and of
+  `record.reply.root` when it is another account (thread), mention facets
+  (mention), `reason.by` of a repost in a feed (repost), the record of an
+  `app.bsky.embed.record` / `recordWithMedia` embed (quote).
+
+`EdgeWriter` streams posts into a directed edge list (src, dst, kind, ts)
+kept as flat binary columns on disk, with account keys interned to int
+ids. Ingested inputs are recorded by content hash, so building again from
+the same files adds nothing, and a crash only loses the uncommitted input.
+`EdgeWriter.close()` adds CSR indexes by source and by destination
+(bincount offsets + a stable argsort of the keys), after which `EdgeStore`
+memory-maps the columns and answers neighbourhood, degree and k-hop queries
+touching only the index slices involved, so tens of millions of edges never
+have to fit in RAM as Python objects.
+
+    python -m common.interactions build ./dataset/interactions/random mastodon/dataset/random/*.json
+    python -m common.interactions stats ./dataset/interactions/random
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from common.build import hash_file
+from common.store import detect_platform
+
+REPLY, MENTION, REPOST, QUOTE, THREAD = range(5)
+KINDS = ("reply", "mention", "repost", "quote", "thread")
+
+NODE_DTYPE = np.int32
+COLUMNS = {"src": NODE_DTYPE, "dst": NODE_DTYPE, "kind": np.uint8, "ts": np.int64}
+FLUSH_EVERY = 1 << 16      # edges buffered before appending to the columns
+
+BSKY_MENTION = "app.bsky.richtext.facet#mention"
+BSKY_REPOST = "app.bsky.feed.defs#reasonRepost"
+
+
+def _epoch(value) -> int:
+    """ Seconds since the epoch, 0 when unknown. """
+    if not value:
+        return 0
+    if isinstance(value, dt.datetime):
+        when = value
+    else:
+        try:
+            when = dt.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return 0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=dt.timezone.utc)
+    return int(when.timestamp())
+
+
+def _did(uri):
+    """ at://did:plc:xyz/app.bsky.feed.post/rkey -> did:plc:xyz """
+    if not uri or not uri.startswith("at://"):
+        return None
+    return uri[5:].split("/", 1)[0]
+
+
+# -- extraction ----------------------------------------------------------------
+
+def mastodon_edges(status):
+    """ (src, dst, kind, ts, src_handle, dst_handle) of one status, keys prefixed "mastodon:". """
+    account = status.get("account") or {}
+    if account.get("id") is None:
+        return
+    src = f"mastodon:{account['id']}"
+    ts = _epoch(status.get("created_at"))
+    handle = account.get("acct")
+    if status.get("in_reply_to_account_id"):
+        yield src, f"mastodon:{status['in_reply_to_account_id']}", REPLY, ts, handle, None
+    for mention in status.get("mentions") or []:
+        if mention.get("id") is not None:
+            yield src, f"mastodon:{mention['id']}", MENTION, ts, handle, mention.get("acct")
+    reblog = status.get("reblog") or {}
+    if (reblog.get("account") or {}).get("id") is not None:
+        yield src, f"mastodon:{reblog['account']['id']}", REPOST, ts, handle, reblog["account"].get("acct")
+    quoted = (status.get("quote") or {}).get("quoted_status") or {}
+    if (quoted.get("account") or {}).get("id") is not None:
+        yield src, f"mastodon:{quoted['account']['id']}", QUOTE, ts, handle, quoted["account"].get("acct")
+
+
+def bluesky_edges(post):
+    """ (src, dst, kind, ts, src_handle, dst_handle) of one post view, keys are dids. """
+    author = post.get("author") or {}
+    record = post.get("record") or {}
+    if not author.get("did"):
+        return
+    src, handle = author["did"], author.get("handle")
+    ts = _epoch(record.get("createdAt") or post.get("indexedAt"))
+
+    reply = record.get("reply") or {}
+    parent = _did((reply.get("parent") or {}).get("uri"))
+    root = _did((reply.get("root") or {}).get("uri"))
+    if parent:
+        yield src, parent, REPLY, ts, handle, None
+    if root and root != parent:
+        yield src, root, THREAD, ts, handle, None
+
+    for facet in record.get("facets") or []:
+        for feature in facet.get("features", []):
+            if feature.get("$type") == BSKY_MENTION and feature.get("did"):
+                yield src, feature["did"], MENTION, ts, handle, None
+
+    embed = record.get("embed") or {}
+    quoted = None
+    if embed.get("$type") == "app.bsky.embed.record":
+        quoted = (embed.get("record") or {}).get("uri")
+    elif embed.get("$type") == "app.bsky.embed.recordWithMedia":
+        quoted = ((embed.get("record") or {}).get("record") or {}).get("uri")
+    if _did(quoted):
+        yield src, _did(quoted), QUOTE, ts, handle, None
+
+    # feed views (not searchPosts) carry the reposter of a post
+    reason = post.get("reason") or {}
+    if reason.get("$type") == BSKY_REPOST and (reason.get("by") or {}).get("did"):
+        by = reason["by"]
+        yield by["did"], src, REPOST, _epoch(reason.get("indexedAt")) or ts, by.get("handle"), handle
+
+
+def post_edges(post):
+    if detect_platform(post) == "bluesky":
+        return bluesky_edges(post)
+    return mastodon_edges(post)
+
+
+# -- writing -------------------------------------------------------------------
+
+class EdgeWriter:
+    """ Append edges to the column files of `root`; close() builds the indexes.
+
+    state.json holds the number of committed edges and the content hashes of
+    the inputs ingested so far. On open the columns are cut back to the
+    committed count, so the edges of an input interrupted by a crash are
+    dropped and the input is read again. Node lines are appended to nodes.tsv
+    before the edges that use them (a later line for a known key only adds
+    its handle); close() rewrites it with one line per id. """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.keys: list[str] = []
+        self.ids: dict[str, int] = {}
+        self.handles: dict[int, str] = {}
+        self._dirty: list[int] = []              # ids whose node line is not written yet
+        nodes = self.root / "nodes.tsv"
+        if nodes.exists():
+            # keep appending to an existing store: same ids for the same accounts
+            with nodes.open("r", encoding="utf-8") as fh:
+                for line in fh:
+                    key, _, handle = line.rstrip("\n").partition("\t")
+                    self._node(key, handle or None)
+            self._dirty.clear()
+        self.state_path = self.root / "state.json"
+        if self.state_path.exists():
+            with self.state_path.open("r", encoding="utf-8") as fh:
+                self.state = json.load(fh)
+        else:
+            # a store written before state.json: whatever all columns hold
+            sizes = [(self.root / f"{name}.bin").stat().st_size // np.dtype(dtype).itemsize
+                     if (self.root / f"{name}.bin").exists() else 0 for name, dtype in COLUMNS.items()]
+            self.state = {"edges": min(sizes), "inputs": {}}
+        self.edges = self.state["edges"]
+        self._files = {name: (self.root / f"{name}.bin").open("ab") for name in COLUMNS}
+        for name, dtype in COLUMNS.items():
+            self._files[name].truncate(self.edges * np.dtype(dtype).itemsize)
+        self._nodes = nodes.open("a", encoding="utf-8")
+        self._buf: dict[str, list] = {name: [] for name in COLUMNS}
+        self.added = 0
+
+    def _node(self, key, handle=None) -> int:
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            self._dirty.append(i)
+        if handle and i not in self.handles:
+            self.handles[i] = handle
+            self._dirty.append(i)
+        return i
+
+    def ingested(self, digest) -> bool:
+        """ Whether an input with this content hash is already in the store. """
+        return digest in self.state["inputs"]
+
+    def add(self, src, dst, kind, ts=0, src_handle=None, dst_handle=None):
+        self._buf["src"].append(self._node(src, src_handle))
+        self._buf["dst"].append(self._node(dst, dst_handle))
+        self._buf["kind"].append(kind)
+        self._buf["ts"].append(ts)
+        self.added += 1
+        if len(self._buf["src"]) >= FLUSH_EVERY:
+            self.flush()
+
+    def add_post(self, post):
+        for edge in post_edges(post):
+            self.add(*edge)
+
+    def add_batch(self, batch):
+        """ The interactions of a common.posts.PostBatch, its account ids
+        mapped to this store's ids in one pass. """
+        mapping = np.fromiter((self._node(key, batch.handles.get(i)) for i, key in enumerate(batch.accounts.keys)),
+                              dtype=NODE_DTYPE, count=len(batch.accounts))
+        self._buf["src"].extend(mapping[batch.edge_src].tolist())
+        self._buf["dst"].extend(mapping[batch.edge_dst].tolist())
+        self._buf["kind"].extend(batch.edge_kind.tolist())
+        self._buf["ts"].extend((batch.created[batch.edge_post] // 1_000_000).tolist())
+        self.added += len(batch.edge_post)
+        if len(self._buf["src"]) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        # node lines first: an edge on disk always has a named node
+        for i in dict.fromkeys(self._dirty):
+            self._nodes.write(f"{self.keys[i]}\t{self.handles.get(i, '')}\n")
+        self._dirty.clear()
+        self._nodes.flush()
+        for name, dtype in COLUMNS.items():
+            np.asarray(self._buf[name], dtype=dtype).tofile(self._files[name])
+            self._buf[name].clear()
+
+    def commit(self, digest=None, source=None):
+        """ Make the edges added so far durable, and record the input they
+        came from (its content hash) as ingested. """
+        n = len(self._buf["src"])
+        self.flush()
+        for fh in (self._nodes, *self._files.values()):
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.edges += n
+        if digest is not None:
+            self.state["inputs"][digest] = str(source)
+        self.state["edges"] = self.edges
+        tmp = self.state_path.with_name("." + self.state_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump(self.state, fh, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def close(self):
+        self.commit()
+        for fh in (self._nodes, *self._files.values()):
+            fh.close()
+        nodes = self.root / "nodes.tsv"
+        tmp = nodes.with_name("." + nodes.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            for i, key in enumerate(self.keys):
+                fh.write(f"{key}\t{self.handles.get(i, '')}\n")
+        os.replace(tmp, nodes)
+        build_index(self.root, len(self.keys))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+            return
+        # an interrupted input is not committed: the next open cuts it back
+        for fh in (self._nodes, *self._files.values()):
+            fh.close()
+
+
+def _csr(keys, n):
+    """ (indptr, order): edges order[indptr[v]:indptr[v+1]] have key v. """
+    counts = np.bincount(keys, minlength=n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    order = np.argsort(keys, kind="stable").astype(np.int64)
+    return indptr, order
+
+
+def build_index(root, n_nodes):
+    """ CSR indexes by source and by destination, as .npy next to the columns. """
+    root = Path(root)
+    for name, column in (("out", "src"), ("in", "dst")):
+        keys = np.memmap(root / f"{column}.bin", dtype=COLUMNS[column], mode="r") \
+            if (root / f"{column}.bin").stat().st_size else np.zeros(0, dtype=COLUMNS[column])
+        indptr, order = _csr(keys, n_nodes)
+        np.save(root / f"{name}_indptr.npy", indptr)
+        np.save(root / f"{name}_order.npy", order)
+    with (root / "meta.json").open("w", encoding="utf-8") as fh:
+        json.dump({"nodes": n_nodes, "edges": int(len(keys)), "kinds": list(KINDS)}, fh)
+
+
+# -- reading -------------------------------------------------------------------
+
+def _ranges(indptr, nodes):
+    """ Concatenated positions indptr[v]..indptr[v+1] for all v in nodes, vectorized. """
+    starts, ends = indptr[nodes], indptr[nodes + 1]
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(total, dtype=np.int64) + offsets
+
+
+class EdgeStore:
+    """ Read-only, memory-mapped view of a built edge store. """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        with (self.root / "meta.json").open("r", encoding="utf-8") as fh:
+            self.meta = json.load(fh)
+        self.n_nodes = self.meta["nodes"]
+        self.n_edges = self.meta["edges"]
+        for name, dtype in COLUMNS.items():
+            path = self.root / f"{name}.bin"
+            col = np.memmap(path, dtype=dtype, mode="r") if self.n_edges else np.zeros(0, dtype=dtype)
+            setattr(self, name, col)
+        self.out_indptr = np.load(self.root / "out_indptr.npy", mmap_mode="r")
+        self.out_order = np.load(self.root / "out_order.npy", mmap_mode="r")
+        self.in_indptr = np.load(self.root / "in_indptr.npy", mmap_mode="r")
+        self.in_order = np.load(self.root / "in_order.npy", mmap_mode="r")
+        self._keys: list[str] | None = None
+        self._ids: dict[str, int] | None = None
+        self._handles: dict[int, str] | None = None
+
+    def _load_nodes(self):
+        self._keys, self._handles = [], {}
+        with (self.root / "nodes.tsv").open("r", encoding="utf-8") as fh:
+            for i, line in enumerate(fh):
+                key, _, handle = line.rstrip("\n").partition("\t")
+                self._keys.append(key)
+                if handle:
+                    self._handles[i] = handle
+        self._ids = {k: i for i, k in enumerate(self._keys)}
+
+    def node(self, key) -> int:
+        if self._ids is None:
+            self._load_nodes()
+        return self._ids[key]
+
+    def key(self, i) -> str:
+        if self._keys is None:
+            self._load_nodes()
+        return self._keys[i]
+
+    def label(self, i) -> str:
+        """ Handle when known, else the key. """
+        if self._keys is None:
+            self._load_nodes()
+        return self._handles.get(i) or self._keys[i]
+
+    def _edges(self, indptr, order, nodes, kind):
+        nodes = np.atleast_1d(np.asarray(nodes, dtype=np.int64))
+        edges = np.asarray(order[_ranges(np.asarray(indptr), nodes)])
+        if kind is not None:
+            edges = edges[np.isin(self.kind[edges], np.atleast_1d(kind))]
+        return edges
+
+    def out_edges(self, nodes, kind=None) -> np.ndarray:
+        """ Edge positions leaving `nodes` (one id or an array). """
+        return self._edges(self.out_indptr, self.out_order, nodes, kind)
+
+    def in_edges(self, nodes, kind=None) -> np.ndarray:
+        return self._edges(self.in_indptr, self.in_order, nodes, kind)
+
+    def out_neighbors(self, node, kind=None) -> np.ndarray:
+        return np.unique(self.dst[self.out_edges(node, kind)])
+
+    def in_neighbors(self, node, kind=None) -> np.ndarray:
+        return np.unique(self.src[self.in_edges(node, kind)])
+
+    def in_degree(self, kind=None) -> np.ndarray:
+        """ Edges received by every node (all kinds, or only `kind`). """
+        if kind is None:
+            return np.diff(np.asarray(self.in_indptr))
+        mask = np.isin(self.kind, np.atleast_1d(kind))
+        return np.bincount(self.dst[mask], minlength=self.n_nodes)
+
+    def out_degree(self, kind=None) -> np.ndarray:
+        if kind is None:
+            return np.diff(np.asarray(self.out_indptr))
+        mask = np.isin(self.kind, np.atleast_1d(kind))
+        return np.bincount(self.src[mask], minlength=self.n_nodes)
+
+    def k_hop(self, node, k=2, direction="out", kind=None) -> dict[int, np.ndarray]:
+        """ {distance: nodes first reached at that distance}, breadth-first,
+        one vectorized frontier expansion per hop. """
+        seen = np.zeros(self.n_nodes, dtype=bool)
+        frontier = np.atleast_1d(np.asarray(node, dtype=np.int64))
+        seen[frontier] = True
+        rings = {0: frontier}
+        for hop in range(1, k + 1):
+            if direction == "out":
+                nxt = self.dst[self.out_edges(frontier, kind)]
+            elif direction == "in":
+                nxt = self.src[self.in_edges(frontier, kind)]
+            else:
+                nxt = np.concatenate([self.dst[self.out_edges(frontier, kind)],
+                                      self.src[self.in_edges(frontier, kind)]])
+            nxt = np.unique(nxt)
+            nxt = nxt[~seen[nxt]]
+            if len(nxt) == 0:
+                break
+            seen[nxt] = True
+            rings[hop] = nxt
+            frontier = nxt
+        return rings
+
+    def kind_counts(self) -> dict[str, int]:
+        counts = np.bincount(self.kind, minlength=len(KINDS))
+        return {name: int(counts[i]) for i, name in enumerate(KINDS)}
+
+
+def main(argv=None):
+    from common.pipeline import read_posts
+
+    parser = argparse.ArgumentParser(description="Interaction edge store")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    build = sub.add_parser("build", help="extract edges from downloaded posts (appends, inputs already "
+                                         "ingested are skipped)")
+    build.add_argument("root")
+    build.add_argument("files", nargs="+", help=".json arrays or .jsonl(.gz) files")
+    stats = sub.add_parser("stats", help="edge counts and most interacted-with accounts")
+    stats.add_argument("root")
+    stats.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        with EdgeWriter(args.root) as writer:
+            for f in args.files:
+                digest = hash_file(f)
+                if writer.ingested(digest):
+                    print(f"{f}: already in the store, skipped")
+                    continue
+                before = writer.added
+                for post in read_posts(f):
+                    writer.add_post(post)
+                writer.commit(digest, f)
+                print(f"{f}: {writer.added - before} edges")
+        print(f"{len(writer.keys)} accounts -> {args.root}")
+        return
+
+    store = EdgeStore(args.root)
+    print(f"{store.n_nodes} accounts, {store.n_edges} edges: {store.kind_counts()}")
+    indeg = store.in_degree()
+    for i in np.argsort(-indeg, kind="stable")[:args.top]:
+        if indeg[i] == 0:
+            break
+        print(f"  {store.label(int(i)):40s} in-degree {int(indeg[i])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+"""
+On-disk inverted index over a PostStore collection.
+
+Questions like "how many posts mention #cop29 in 2024-11?" or "which
+top-100 hashtags co-occur with climatechange?" used to mean re-reading
+every monthly file. `build_index` turns each (platform, month) partition
+of the store into one segment directory:
+
+    <index>/<platform>/<month>/
+        terms.bin, term_offsets.npy     sorted UTF-8 terms
+        postings.bin, posting_offsets.npy
+        created.npy                     creation time (us) of every doc
+        ids.bin, id_offsets.npy         post id of every doc
+        doc_tags.npy, doc_tag_offsets.npy   hashtag terms of every doc
+
+Docs are numbered in creation order, so a time range inside a month is a
+range of doc numbers. Terms are normalized hashtags ("#climatechange",
+common.hashtags.normalize_tag), text tokens (common.minhash.normalize_text)
+and the declared language ("lang:en"). A posting list is the ascending
+doc numbers of a term, delta-encoded and packed as varints (7 bits per
+byte); encoding and decoding are vectorized over whole segments. Segments
+are memory-mapped, so a query reads only the terms and postings it touches.
+
+Segments are built through common.build.BuildCache keyed on the month
+partition's content hash: when a downloader rewrites a month with new days,
+only that month is indexed again.
+
+Queries: words are ANDed, `OR` between them, `-word` excludes, parentheses
+group, e.g. `#cop29 (lang:en OR lang:de) -#bot`. `seeds` writes the top
+hashtags of the index as the crawl_day seed list.
+
+    python -m common.invindex build ./dataset/store/100_posts
+    python -m common.invindex query ./dataset/store/100_posts "#cop29" --since 2024-11-01 --until 2024-12-01
+    python -m common.invindex cooccur ./dataset/store/100_posts "#climatechange" --top 20
+    python -m common.invindex seeds ./dataset/store/100_posts --platforms bluesky --lang en \\
+        --out ./bluesky/code/hashtag/100_posts/top100_hashtags.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import datetime as dt
+import heapq
+import json
+import os
+import re
+import shutil
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from common.build import BuildCache
+from common.hashtags import normalize_tag
+from common.minhash import normalize_text
+
+MAX_TOKEN = 40            # longer tokens (hashes, base64...) are not indexed
+MIN_TOKEN = 2
+VERSION = 1               # bump when the segment layout or the tokenizer changes
+
+_QUERY_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+# -- varint postings -----------------------------------------------------------
+
+def encode_varints(values) -> np.ndarray:
+    """ Unsigned integers as LEB128 varints (7 bits per byte, high bit set on
+    all but the last byte of a value). """
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35, 42, 49, 56, 63):
+        nbytes += values >= (np.uint64(1) << np.uint64(shift))
+    owner = np.repeat(np.arange(len(values)), nbytes)
+    pos = np.arange(len(owner)) - np.repeat(np.cumsum(nbytes) - nbytes, nbytes)
+    out = ((values[owner] >> (pos * 7).astype(np.uint64)) & np.uint64(0x7F)).astype(np.uint8)
+    out[pos < nbytes[owner] - 1] |= 0x80
+    return out
+
+
+def decode_varints(data) -> np.ndarray:
+    data = np.asarray(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    last = (data & 0x80) == 0
+    ends = np.flatnonzero(last)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    pos = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (pos * 7).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def encode_postings(lists) -> tuple[np.ndarray, np.ndarray]:
+    """ (blob, offsets): ascending doc lists, delta + varint coded back to back;
+    list i is blob[offsets[i]:offsets[i + 1]]. """
+    lens = np.array([len(x) for x in lists], dtype=np.int64)
+    if not lens.sum():
+        return np.zeros(0, dtype=np.uint8), np.zeros(len(lists) + 1, dtype=np.int64)
+    docs = np.concatenate([np.asarray(x, dtype=np.int64) for x in lists if len(x)])
+    deltas = np.diff(docs, prepend=0)
+    firsts = np.cumsum(lens) - lens
+    deltas[firsts[lens > 0]] = docs[firsts[lens > 0]]     # every list starts from doc 0
+    blob = encode_varints(deltas)
+    value_bytes = np.ones(len(deltas), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        value_bytes += deltas >= (1 << shift)
+    ends = np.concatenate([[0], np.cumsum(value_bytes)])
+    offsets = ends[np.concatenate([[0], np.cumsum(lens)])]
+    return blob, offsets
+
+
+def decode_postings(blob) -> np.ndarray:
+    return np.cumsum(decode_varints(blob)).astype(np.int64)
+
+
+# -- building ------------------------------------------------------------------
+
+def _blob(strings) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def post_terms(text, tags, language, is_html) -> tuple[set[str], set[str]]:
+    """ (all terms, hashtag terms) of one post. """
+    hashtags = {"#" + normalize_tag(t) for t in tags or [] if t}
+    terms = {w for w in normalize_text(text or "", is_html=is_html).split()
+             if MIN_TOKEN <= len(w) <= MAX_TOKEN}
+    terms |= hashtags
+    if language:
+        terms.add("lang:" + language.lower())
+    return terms, hashtags
+
+
+def build_segment(store, platform, month, path):
+    """ Index one month partition of `store` into the directory `path`. """
+    table = store.read(["id", "created_at", "text", "tags", "language"], platform=platform, months=[month])
+    created = np.array([0 if t is None else int(t.timestamp() * 1_000_000)
+                        for t in table.column("created_at").to_pylist()], dtype=np.int64)
+    order = np.argsort(created, kind="stable")
+    ids = table.column("id").to_pylist()
+    texts = table.column("text").to_pylist()
+    tags = table.column("tags").to_pylist()
+    langs = table.column("language").to_pylist()
+
+    postings: dict[str, list[int]] = {}
+    doc_tags: list[list[str]] = []
+    for doc, row in enumerate(order):
+        terms, hashtags = post_terms(texts[row], tags[row], langs[row], is_html=platform == "mastodon")
+        for term in terms:
+            postings.setdefault(term, []).append(doc)
+        doc_tags.append(sorted(hashtags))
+    # byte order, so that lookups can compare encoded terms
+    vocab = sorted(postings, key=lambda t: t.encode("utf-8"))
+    term_number = {t: i for i, t in enumerate(vocab)}
+    blob, offsets = encode_postings([postings[t] for t in vocab])
+    tag_numbers = np.array([term_number[t] for doc in doc_tags for t in doc], dtype=np.int32)
+    tag_offsets = np.concatenate([[0], np.cumsum([len(d) for d in doc_tags])]).astype(np.int64)
+    term_bytes, term_offsets = _blob(vocab)
+    id_bytes, id_offsets = _blob([str(ids[row]) for row in order])
+
+    path = Path(path)
+    tmp = path.with_name("." + path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    term_bytes.tofile(tmp / "terms.bin")
+    np.save(tmp / "term_offsets.npy", term_offsets)
+    blob.tofile(tmp / "postings.bin")
+    np.save(tmp / "posting_offsets.npy", offsets)
+    np.save(tmp / "created.npy", created[order])
+    id_bytes.tofile(tmp / "ids.bin")
+    np.save(tmp / "id_offsets.npy", id_offsets)
+    np.save(tmp / "doc_tags.npy", tag_numbers)
+    np.save(tmp / "doc_tag_offsets.npy", tag_offsets)
+    # swap the directories: readers see the old segment or the new one
+    old = path.with_name("." + path.name + ".old")
+    if path.exists():
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def build_index(store, index_root, platforms=("bluesky", "mastodon"), cache=None) -> BuildCache:
+    """ Segment every month partition of the store whose content changed. """
+    index_root = Path(index_root)
+    cache = cache or BuildCache(index_root / ".build")
+    for platform in platforms:
+        for month in store.months(platform):
+            cache.artifact(
+                f"{platform}/{month}", index_root / platform / month,
+                lambda path, platform=platform, month=month: build_segment(store, platform, month, path),
+                inputs=[store.month_file(platform, month)], params={"version": VERSION},
+            )
+    return cache
+
+
+# -- reading -------------------------------------------------------------------
+
+class _Strings:
+    """ Sequence view of a UTF-8 blob + offsets, items as bytes (for bisect). """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i) -> bytes:
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+
+class Segment:
+    """ One memory-mapped (platform, month) segment. """
+
+    def __init__(self, path, platform, month):
+        path = Path(path)
+        self.platform = platform
+        self.month = month
+        self.terms = _Strings(np.fromfile(path / "terms.bin", dtype=np.uint8),
+                              np.load(path / "term_offsets.npy", mmap_mode="r"))
+        self.postings = np.memmap(path / "postings.bin", dtype=np.uint8, mode="r") \
+            if (path / "postings.bin").stat().st_size else np.zeros(0, dtype=np.uint8)
+        self.posting_offsets = np.load(path / "posting_offsets.npy", mmap_mode="r")
+        self.created = np.load(path / "created.npy", mmap_mode="r")
+        self.ids = _Strings(np.fromfile(path / "ids.bin", dtype=np.uint8),
+                            np.load(path / "id_offsets.npy", mmap_mode="r"))
+        self.doc_tags = np.load(path / "doc_tags.npy", mmap_mode="r")
+        self.doc_tag_offsets = np.load(path / "doc_tag_offsets.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.created)
+
+    def term_number(self, term) -> int | None:
+        key = term.encode("utf-8")
+        i = bisect.bisect_left(self.terms, key)
+        return i if i < len(self.terms) and self.terms[i] == key else None
+
+    def docs(self, term) -> np.ndarray:
+        """ Ascending doc numbers of a term. """
+        i = self.term_number(term)
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+        return decode_postings(self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]])
+
+    def df(self, i) -> int:
+        """ Number of docs of term number i, without decoding the list. """
+        chunk = self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]]
+        return int(np.count_nonzero((np.asarray(chunk) & 0x80) == 0))
+
+    def time_range(self, since_us=None, until_us=None) -> tuple[int, int]:
+        lo = 0 if since_us is None else int(np.searchsorted(self.created, since_us, side="left"))
+        hi = len(self) if until_us is None else int(np.searchsorted(self.created, until_us, side="left"))
+        return lo, hi
+
+    def hashtag_counts(self, docs) -> Counter:
+        """ term -> number of `docs` carrying that hashtag. """
+        docs = np.asarray(docs, dtype=np.int64)
+        if not len(docs):
+            return Counter()
+        starts, ends = self.doc_tag_offsets[docs], self.doc_tag_offsets[docs + 1]
+        lens = ends - starts
+        if not lens.sum():
+            return Counter()
+        idx = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+        numbers, counts = np.unique(np.asarray(self.doc_tags)[idx], return_counts=True)
+        return Counter({self.terms[int(n)].decode("utf-8"): int(c) for n, c in zip(numbers, counts)})
+
+    def all_hashtag_counts(self, lo=0, hi=None) -> Counter:
+        hi = len(self) if hi is None else hi
+        return self.hashtag_counts(np.arange(lo, hi))
+
+
+def _month_of(us) -> str:
+    return dt.datetime.fromtimestamp(us / 1e6, tz=dt.timezone.utc).strftime("%Y-%m")
+
+
+def _us(value) -> int | None:
+    """ A date / datetime / ISO string as UTC microseconds. """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = dt.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, dt.date) and not isinstance(value, dt.datetime):
+        value = dt.datetime.combine(value, dt.time.min)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt.timezone.utc)
+    return int(value.timestamp() * 1_000_000)
+
+
+def parse_query(query):
+    """ Query string -> nested ("and" | "or", [...]) / ("not", x) / ("term", t). """
+    tokens = _QUERY_TOKEN.findall(query)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def expr():
+        nonlocal pos
+        parts = [conj()]
+        while peek() == "OR":
+            pos += 1
+            parts.append(conj())
+        return parts[0] if len(parts) == 1 else ("or", parts)
+
+    def conj():
+        parts = []
+        while peek() not in (None, ")", "OR"):
+            parts.append(unary())
+        if not parts:
+            raise ValueError(f"empty clause in query {query!r}")
+        return parts[0] if len(parts) == 1 else ("and", parts)
+
+    def unary():
+        nonlocal pos
+        token = tokens[pos]
+        pos += 1
+        if token == "(":
+            inner = expr()
+            if peek() != ")":
+                raise ValueError(f"unbalanced parentheses in query {query!r}")
+            pos += 1
+            return inner
+        if token.startswith("-") and len(token) > 1:
+            tokens.insert(pos, token[1:])
+            return ("not", unary())
+        return ("term", normalize_term(token))
+
+    tree = expr()
+    if pos != len(tokens):
+        raise ValueError(f"unexpected {tokens[pos]!r} in query {query!r}")
+    return tree
+
+
+def normalize_term(token) -> str:
+    """ A query word as indexed: hashtags and lang: kept apart, words like the text. """
+    if token.startswith("#"):
+        return "#" + normalize_tag(token)
+    if token.lower().startswith("lang:"):
+        return token.lower()
+    words = normalize_text(token, is_html=False).split()
+    return words[0] if words else token.casefold()
+
+
+def _evaluate(segment, tree, universe) -> np.ndarray:
+    op = tree[0]
+    if op == "term":
+        return segment.docs(tree[1])
+    if op == "not":
+        return np.setdiff1d(universe, _evaluate(segment, tree[1], universe), assume_unique=True)
+    if op == "or":
+        out = np.zeros(0, dtype=np.int64)
+        for part in tree[1]:
+            out = np.union1d(out, _evaluate(segment, part, universe))
+        return out
+    # and: positive parts intersected first, the exclusions removed after
+    positive = [p for p in tree[1] if p[0] != "not"]
+    negative = [p[1] for p in tree[1] if p[0] == "not"]
+    out = universe
+    for part in sorted(positive, key=lambda p: p[0] != "term"):
+        out = np.intersect1d(out, _evaluate(segment, part, universe), assume_unique=True)
+        if not len(out):
+            return out
+    for part in negative:
+        out = np.setdiff1d(out, _evaluate(segment, part, universe), assume_unique=True)
+    return out
+
+
+class InvertedIndex:
+    """ Boolean / time-range queries over the segments under `root`. """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._segments: dict[tuple[str, str], Segment] = {}
+
+    def partitions(self, platforms=None, since=None, until=None) -> list[tuple[str, str]]:
+        """ (platform, month) segments overlapping [since, until). """
+        lo = None if since is None else _month_of(_us(since))
+        hi = None if until is None else _month_of(_us(until) - 1)
+        out = []
+        for pdir in sorted(p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".")) \
+                if self.root.exists() else []:
+            if platforms is not None and pdir.name not in platforms:
+                continue
+            for mdir in sorted(m for m in pdir.iterdir() if m.is_dir() and not m.name.startswith(".")):
+                if (lo is None or mdir.name >= lo) and (hi is None or mdir.name <= hi):
+                    out.append((pdir.name, mdir.name))
+        return out
+
+    def segment(self, platform, month) -> Segment:
+        key = (platform, month)
+        if key not in self._segments:
+            self._segments[key] = Segment(self.root / platform / month, platform, month)
+        return self._segments[key]
+
+    def search(self, query, platforms=None, since=None, until=None) -> dict[tuple[str, str], np.ndarray]:
+        """ (platform, month) -> matching doc numbers, for the partitions in range. """
+        tree = parse_query(query) if isinstance(query, str) else query
+        since_us, until_us = _us(since), _us(until)
+        out = {}
+        for platform, month in self.partitions(platforms, since, until):
+            seg = self.segment(platform, month)
+            lo, hi = seg.time_range(since_us, until_us)
+            if lo >= hi:
+                continue
+            docs = _evaluate(seg, tree, np.arange(lo, hi, dtype=np.int64))
+            docs = docs[(docs >= lo) & (docs < hi)]
+            if len(docs):
+                out[(platform, month)] = docs
+        return out
+
+    def count(self, query, platforms=None, since=None, until=None) -> dict[tuple[str, str], int]:
+        return {k: len(v) for k, v in self.search(query, platforms, since, until).items()}
+
+    def ids(self, query, platforms=None, since=None, until=None) -> list[str]:
+        """ Post ids of the matches, partitions in order, oldest first. """
+        return [self.segment(*key).ids[int(d)].decode("utf-8")
+                for key, docs in self.search(query, platforms, since, until).items() for d in docs]
+
+    def cooccurring(self, query, platforms=None, since=None, until=None, top=20) -> list[tuple[str, int]]:
+        """ Hashtags most often found on the posts matching `query`. """
+        counts: Counter = Counter()
+        for key, docs in self.search(query, platforms, since, until).items():
+            counts.update(self.segment(*key).hashtag_counts(docs))
+        tree = parse_query(query)
+        if tree[0] == "term":
+            counts.pop(tree[1], None)
+        return heapq.nlargest(top, counts.items(), key=lambda item: (item[1], item[0]))
+
+    def top_hashtags(self, top=100, platforms=None, since=None, until=None, lang=None) -> list[tuple[str, int]]:
+        """ Most frequent hashtags (posts carrying them), optionally on posts
+        declared in `lang`. """
+        if lang:
+            counts: Counter = Counter()
+            for key, docs in self.search(f"lang:{lang}", platforms, since, until).items():
+                counts.update(self.segment(*key).hashtag_counts(docs))
+        else:
+            counts = Counter()
+            since_us, until_us = _us(since), _us(until)
+            for platform, month in self.partitions(platforms, since, until):
+                seg = self.segment(platform, month)
+                counts.update(seg.all_hashtag_counts(*seg.time_range(since_us, until_us)))
+        return heapq.nlargest(top, counts.items(), key=lambda item: (item[1], item[0]))
+
+    def seed_hashtags(self, top=100, platforms=None, since=None, until=None, lang=None) -> list[str]:
+        """ The crawl_day seed list (BEST_100_HASHTAGS): top hashtags, no '#'. """
+        return [tag[1:] for tag, _ in self.top_hashtags(top, platforms, since, until, lang)]
+
+
+def default_index_root(store_root) -> Path:
+    return Path(store_root) / "index"
+
+
+def main(argv=None):
+    from common.store import PostStore
+
+    parser = argparse.ArgumentParser(description="Inverted index over a PostStore collection")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    common_args = argparse.ArgumentParser(add_help=False)
+    common_args.add_argument("root", help="collection root, e.g. ./dataset/store/100_posts")
+    common_args.add_argument("--index", help="index directory (default: <root>/index)")
+    common_args.add_argument("--platforms", nargs="+")
+    range_args = argparse.ArgumentParser(add_help=False)
+    range_args.add_argument("--since", help="ISO date or time, inclusive")
+    range_args.add_argument("--until", help="ISO date or time, exclusive")
+
+    sub.add_parser("build", parents=[common_args], help="index the months that changed")
+    query = sub.add_parser("query", parents=[common_args, range_args], help="count (or list) matching posts")
+    query.add_argument("query", help='e.g. "#cop29 lang:en -#bot"')
+    query.add_argument("--ids", action="store_true", help="print the matching post ids")
+    cooc = sub.add_parser("cooccur", parents=[common_args, range_args], help="hashtags found with a query")
+    cooc.add_argument("query")
+    cooc.add_argument("--top", type=int, default=20)
+    seeds = sub.add_parser("seeds", parents=[common_args, range_args], help="top hashtags as a crawl seed list")
+    seeds.add_argument("--top", type=int, default=100)
+    seeds.add_argument("--lang", default="en", help="count posts declared in this language ('' for all)")
+    seeds.add_argument("--out", help="write the JSON list here (e.g. top100_hashtags.json)")
+    args = parser.parse_args(argv)
+
+    index_root = Path(args.index or default_index_root(args.root))
+    if args.cmd == "build":
+        cache = build_index(PostStore(args.root), index_root, args.platforms or ("bluesky", "mastodon"))
+        print(f"indexed {len(cache.built)}: {', '.join(cache.built) or '-'}")
+        print(f"up to date {len(cache.reused)}")
+        return
+
+    index = InvertedIndex(index_root)
+    t0 = time.perf_counter()
+    if args.cmd == "query":
+        if args.ids:
+            for post_id in index.ids(args.query, args.platforms, args.since, args.until):
+                print(post_id)
+        else:
+            counts = index.count(args.query, args.platforms, args.since, args.until)
+            for (platform, month), n in counts.items():
+                print(f"{platform} {month}: {n}")
+            print(f"total: {sum(counts.values())}")
+    elif args.cmd == "cooccur":
+        for tag, n in index.cooccurring(args.query, args.platforms, args.since, args.until, args.top):
+            print(f"{n:8d}  {tag}")
+    else:
+        tags = index.seed_hashtags(args.top, args.platforms, args.since, args.until, args.lang or None)
+        if args.out:
+            Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+            with open(args.out, "w", encoding="utf-8") as fh:
+                json.dump(tags, fh, ensure_ascii=False, indent=2)
+            print(f"{len(tags)} hashtags -> {args.out}")
+        else:
+            print(json.dumps(tags, ensure_ascii=False))
+    print(f"({(time.perf_counter() - t0) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
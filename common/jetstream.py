@@ -0,0 +1,288 @@
+"""
+Streaming collection of Bluesky posts from Jetstream.
+
+searchPosts polling samples random hour windows and pages a cursor per
+hashtag under the search rate limit. Jetstream instead pushes every commit
+of the network as one JSON message over a websocket:
+
+    {"did": "did:plc:...", "time_us": 1725911162329308, "kind": "commit",
+     "commit": {"operation": "create", "collection": "app.bsky.feed.post",
+                "rkey": "...", "cid": "...", "record": {...}}}
+
+`JetstreamConsumer` subscribes to app.bsky.feed.post only and keeps the
+creates that pass `PostFilter` (declared language, hashtags of the top-100
+list). Most messages are rejected on the raw string before any JSON is
+decoded. The kept posts are reshaped like searchPosts PostViews (uri,
+cid, author.did, record, indexedAt), so common.store and common.pipeline
+read them unchanged. They go through the bounded GzipJsonlWriter that
+crawl_day uses, one file per UTC day.
+
+The cursor (time_us of the last event handled) is persisted together with
+the file offsets, only after the posts before it are on disk. A reconnect
+or restart resumes a few seconds before it and skips what was already
+handled, so posts are neither lost nor written twice; a file is cut back
+to its last persisted offset on restart.
+
+    python -m common.jetstream --out ./bluesky/dataset/stream \\
+        --tags ./bluesky/code/hashtag/100_posts/top100_hashtags.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import os
+import re
+from pathlib import Path
+from urllib.parse import urlencode
+
+import websockets
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+
+from common import metrics
+from common.hashtags import normalize_tag
+from common.writer import GzipJsonlWriter
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+JETSTREAM_URL = os.getenv("JETSTREAM_URL", "wss://jetstream2.us-east.bsky.network/subscribe")
+POST_COLLECTION = "app.bsky.feed.post"
+OUT_DIR = Path("./bluesky/dataset/stream")
+TOP_FILE = Path("./bluesky/code/hashtag/100_posts/top100_hashtags.json")
+REWIND_US = 5_000_000     # resume this far before the cursor, the server may not have it exactly
+MARK_EVERY = 5_000        # events between cursor marks when nothing is kept
+RECONNECT_MIN = 1         # seconds, doubled up to RECONNECT_MAX while the server is unreachable
+RECONNECT_MAX = 60
+CLOSE_TIMEOUT = 2         # seconds to wait for the closing handshake on shutdown
+KEEP_OFFSETS = 7          # file offsets kept in the state (older days are complete)
+
+_HASHTAG = re.compile(r"(?<![\w#])#(\w+)")
+_TIME_US = re.compile(r'"time_us":(\d+)')
+
+def record_tags(record) -> list[str]:
+    """ Hashtags of a post record: tag facets, the `tags` field, and #words of
+    the text for clients that write no facets. """
+    tags = [
+        feature["tag"]
+        for facet in record.get("facets") or []
+        for feature in facet.get("features", [])
+        if feature.get("$type") == "app.bsky.richtext.facet#tag" and "tag" in feature
+    ]
+    tags.extend(record.get("tags") or [])
+    text = record.get("text") or ""
+    if "#" in text:
+        tags.extend(_HASHTAG.findall(text))
+    return tags
+
+
+class PostFilter:
+    """ Declared language ("en" also matches "en-US") and hashtag set a post
+    must match; None disables a criterion. """
+
+    def __init__(self, lang="en", tags=None):
+        self.lang = lang or None
+        self.tags = {normalize_tag(t) for t in tags} if tags else None
+
+    def prefilter(self, raw) -> bool:
+        """ Cheap test on the undecoded message: False only when it cannot match. """
+        if '"create"' not in raw:
+            return False
+        if self.lang is not None and f'"{self.lang}' not in raw:
+            return False
+        return self.tags is None or "#" in raw or '"tag' in raw
+
+    def __call__(self, record) -> bool:
+        if self.lang is not None and not any(
+                lang == self.lang or lang.startswith(self.lang + "-") for lang in record.get("langs") or []):
+            return False
+        if self.tags is None:
+            return True
+        return any(normalize_tag(t) in self.tags for t in record_tags(record))
+
+
+def _iso_us(time_us) -> str:
+    when = dt.datetime.fromtimestamp(time_us / 1e6, tz=dt.timezone.utc)
+    return when.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def to_post(event) -> dict:
+    """ A post create as the PostView subset the rest of the code reads. """
+    commit = event["commit"]
+    did = event["did"]
+    return {
+        "uri": f"at://{did}/{commit['collection']}/{commit['rkey']}",
+        "cid": commit.get("cid"),
+        "author": {"did": did},
+        "record": commit["record"],
+        "indexedAt": _iso_us(event["time_us"]),
+    }
+
+
+class JetstreamConsumer:
+    """ Jetstream -> filter -> daily gzip JSONL files, resumable. """
+
+    def __init__(self, out_dir=OUT_DIR, url=JETSTREAM_URL, post_filter: PostFilter | None = None,
+                 state_path=None, record_path=None):
+        self.out_dir = Path(out_dir)
+        self.url = url
+        self.filter = post_filter or PostFilter()
+        progress_dir = self.out_dir.parent / ".progress" / self.out_dir.name
+        self.state_path = Path(state_path or progress_dir / "jetstream.json")
+        self.state = {"cursor": None, "files": {}}
+        if self.state_path.exists():
+            with self.state_path.open("r", encoding="utf-8") as fh:
+                self.state = json.load(fh)
+        self.cursor = self.state["cursor"]       # last event handled, ahead of the persisted one
+        self.record_path = record_path
+        self.events = 0
+        self.kept = 0
+
+    # -- state -------------------------------------------------------------
+
+    def _on_flush(self, mark, offsets):
+        if mark is not None:
+            self.state["cursor"] = mark
+        files = dict(self.state["files"], **offsets)
+        self.state["files"] = {k: files[k] for k in sorted(files)[-KEEP_OFFSETS:]}
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_name("." + self.state_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump(self.state, fh)
+        os.replace(tmp, self.state_path)
+
+    def path_for(self, post) -> Path:
+        return self.out_dir / f"bluesky-{post['indexedAt'][:10]}.jsonl.gz"
+
+    def subscribe_url(self) -> str:
+        params = {"wantedCollections": POST_COLLECTION}
+        if self.cursor is not None:
+            params["cursor"] = max(self.cursor - REWIND_US, 0)
+        return f"{self.url}?{urlencode(params)}"
+
+    # -- consuming ---------------------------------------------------------
+
+    async def _handle(self, raw, writer, recorder):
+        """ Filter one message into the writer and advance the cursor. """
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        if recorder is not None:
+            recorder.write(raw + "\n")
+        self.events += 1
+        # read without decoding the message: most are dropped by the prefilter
+        found = _TIME_US.search(raw)
+        time_us = int(found.group(1)) if found else None
+        if time_us is not None and self.cursor is not None and time_us <= self.cursor:
+            metrics.STREAM_EVENTS.inc(platform="bluesky", result="replayed")
+            return
+        if not self.filter.prefilter(raw):
+            metrics.STREAM_EVENTS.inc(platform="bluesky", result="filtered")
+        else:
+            event = _loads(raw)
+            commit = event.get("commit") or {}
+            if event.get("kind") != "commit" or commit.get("operation") != "create" \
+                    or commit.get("collection") != POST_COLLECTION:
+                metrics.STREAM_EVENTS.inc(platform="bluesky", result="other")
+            elif self.filter(commit.get("record") or {}):
+                metrics.STREAM_EVENTS.inc(platform="bluesky", result="kept")
+                self.kept += 1
+                await writer.put(to_post(event), mark=time_us)
+            else:
+                metrics.STREAM_EVENTS.inc(platform="bluesky", result="filtered")
+        if time_us is not None:
+            self.cursor = time_us
+            if self.events % MARK_EVERY == 0:
+                await writer.mark(time_us)
+
+    async def run(self, max_events=None, seconds=None):
+        """ Consume until cancelled, or until `max_events` messages / `seconds`. """
+        recorder = None
+        if self.record_path is not None:
+            Path(self.record_path).parent.mkdir(parents=True, exist_ok=True)
+            recorder = open(self.record_path, "a", encoding="utf-8")
+        writer = GzipJsonlWriter(self.path_for, offsets=self.state["files"], on_flush=self._on_flush,
+                                 sink="jetstream")
+        try:
+            async with writer:
+                try:
+                    await self._consume(writer, recorder, max_events, seconds)
+                finally:
+                    # persisted by the writer's last flush, with everything before it
+                    if self.cursor is not None:
+                        await writer.mark(self.cursor)
+        finally:
+            if recorder is not None:
+                recorder.close()
+
+    async def _consume(self, writer, recorder, max_events, seconds):
+        loop = asyncio.get_running_loop()
+        deadline = None if seconds is None else loop.time() + seconds
+        delay = RECONNECT_MIN
+        while True:
+            before = self.cursor
+            try:
+                async with websockets.connect(self.subscribe_url(), max_size=None, compression=None,
+                                              close_timeout=CLOSE_TIMEOUT) as ws:
+                    print(f"Connected to {self.url}, cursor {self.cursor}")
+                    async for raw in ws:
+                        await self._handle(raw, writer, recorder)
+                        if (max_events is not None and self.events >= max_events) or \
+                                (deadline is not None and loop.time() >= deadline):
+                            return
+                reason = "server closed the stream"
+            except (ConnectionClosed, InvalidHandshake, OSError, asyncio.TimeoutError) as exc:
+                reason = f"{type(exc).__name__}: {exc}"
+            if deadline is not None and loop.time() >= deadline:
+                return
+            metrics.RETRIES.inc(platform="bluesky", reason="disconnect")
+            if self.cursor != before:
+                # a stream that was flowing (past the replayed rewind window)
+                # is resumed at once; the backoff is for a server that keeps failing
+                print(f"{reason}; reconnecting from cursor {self.cursor}")
+                delay = RECONNECT_MIN
+                continue
+            metrics.BACKOFF_SECONDS.inc(delay, reason="reconnect")
+            print(f"{reason}; reconnecting in {delay} s from cursor {self.cursor}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream Bluesky posts from Jetstream")
+    parser.add_argument("--url", default=JETSTREAM_URL, help="Jetstream subscribe endpoint (env JETSTREAM_URL)")
+    parser.add_argument("--out", default=str(OUT_DIR), help="directory of the daily .jsonl.gz files")
+    parser.add_argument("--lang", default="en", help="declared language to keep ('' keeps all)")
+    parser.add_argument("--tags", default=str(TOP_FILE),
+                        help="JSON list of hashtags to keep (top100_hashtags.json, '' keeps all)")
+    parser.add_argument("--state", help="cursor file (default: <out>/../.progress/<name>/jetstream.json)")
+    parser.add_argument("--record", help="also append every raw message here, for bench replays")
+    parser.add_argument("--max-events", type=int, help="stop after this many messages")
+    parser.add_argument("--seconds", type=float, help="stop after this many seconds")
+    parser.add_argument("--metrics", help="write metrics.json / metrics.prom into this directory")
+    args = parser.parse_args(argv)
+
+    tags = None
+    if args.tags:
+        with open(args.tags, "r", encoding="utf-8") as fh:
+            tags = json.load(fh)
+    consumer = JetstreamConsumer(args.out, args.url, PostFilter(args.lang, tags), args.state, args.record)
+    exporter = None
+    if args.metrics:
+        exporter = metrics.Exporter(Path(args.metrics) / "metrics.json", Path(args.metrics) / "metrics.prom").start()
+    try:
+        asyncio.run(consumer.run(args.max_events, args.seconds))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if exporter is not None:
+            exporter.stop()
+    print(f"{consumer.events} events, {consumer.kept} posts kept, cursor {consumer.state['cursor']}")
+
+
+if __name__ == "__main__":
+    main()
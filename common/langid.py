@@ -0,0 +1,208 @@
+"""
+Batched, deterministic language identification for posts without a
+declared language.
+
+The notebooks parsed every Mastodon status into a BeautifulSoup tree and
+called `langdetect.detect` on it, one post at a time and with a different
+answer on every run for short texts. `LanguageIdentifier` instead:
+
+- strips HTML with a few regular expressions (tags, entities, links,
+  mentions), no DOM is built;
+- seeds langdetect (`DetectorFactory.seed`) in this process and in every
+  worker, so the same text always gets the same language;
+- memoizes by a hash of the stripped text, in memory and optionally in a
+  SQLite file, so reposted text and re-runs skip detection;
+- sends large batches to a ProcessPoolExecutor in chunks.
+
+`stats()` reports the throughput in posts/sec, cache hits included.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import html
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
+
+SEED = 0
+WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 256          # texts per task sent to a worker
+MIN_PARALLEL = 512        # smaller batches are detected in-process
+CACHE_SIZE = 200_000      # memoized texts kept in memory
+LANG_CACHE = Path("./.progress/langid.sqlite")
+
+_BREAK = re.compile(r"<\s*(?:br|/p|/li|/div|/h\d)\b[^>]*>", re.IGNORECASE)
+_TAG = re.compile(r"<[^>]*>")
+_URL = re.compile(r"(?:https?://|www\.)\S+")
+_MENTION = re.compile(r"(?<!\w)@[\w.@-]+")
+_SPACE = re.compile(r"\s+")
+
+_MISSING = object()
+
+
+def strip_html(text) -> str:
+    """ Visible text of a Mastodon `content` (also fine on plain Bluesky text),
+    without links and @mentions, which carry no language. """
+    if not text:
+        return ""
+    if "<" in text:
+        text = _TAG.sub("", _BREAK.sub(" ", text))
+    if "&" in text:
+        text = html.unescape(text)
+    return strip_links(text)
+
+
+def strip_links(text) -> str:
+    """ Plain text without links and @mentions. """
+    if not text:
+        return ""
+    text = _MENTION.sub(" ", _URL.sub(" ", text))
+    return _SPACE.sub(" ", text).strip()
+
+
+def text_key(text) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _init_worker(seed):
+    DetectorFactory.seed = seed
+
+
+def _detect_one(text):
+    if not text:
+        return None
+    try:
+        return detect(text)
+    except LangDetectException:
+        # no alphabetic features (emoji only, numbers...)
+        return None
+
+
+def _detect_chunk(texts):
+    return [_detect_one(t) for t in texts]
+
+
+class LanguageIdentifier:
+    """ text -> ISO 639-1 code (or None), batched, seeded and memoized. """
+
+    def __init__(self, workers=WORKERS, cache_path=None, seed=SEED,
+                 chunk_size=CHUNK_SIZE, min_parallel=MIN_PARALLEL, cache_size=CACHE_SIZE):
+        self.workers = workers
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.cache_size = cache_size
+        DetectorFactory.seed = seed
+        self._memo: OrderedDict[str, str | None] = OrderedDict()
+        self._pool: ProcessPoolExecutor | None = None
+        self.db = None
+        if cache_path is not None:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            # WAL + a long busy timeout: the worker processes of common.batch
+            # share one cache file
+            self.db = sqlite3.connect(cache_path, timeout=60)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS langs (key TEXT PRIMARY KEY, lang TEXT) WITHOUT ROWID")
+            self.db.commit()
+        self.texts = 0            # texts asked for
+        self.detected = 0         # texts that actually went through langdetect
+        self.seconds = 0.0
+
+    # -- memo --------------------------------------------------------------
+
+    def _remember(self, key, lang):
+        self._memo[key] = lang
+        self._memo.move_to_end(key)
+        if len(self._memo) > self.cache_size:
+            self._memo.popitem(last=False)
+
+    def _lookup(self, keys):
+        """ {key: lang} for the keys found in memory or in the SQLite cache. """
+        found = {}
+        missing = []
+        for key in keys:
+            lang = self._memo.get(key, _MISSING)
+            if lang is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = lang
+        if self.db is not None and missing:
+            for i in range(0, len(missing), 500):
+                part = missing[i:i + 500]
+                rows = self.db.execute(
+                    f"SELECT key, lang FROM langs WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, lang in rows:
+                    found[key] = lang
+                    self._remember(key, lang)
+        return found
+
+    # -- detection ---------------------------------------------------------
+
+    def _run(self, texts):
+        if self.workers > 1 and len(texts) >= self.min_parallel:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.seed,))
+            chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+            return [lang for part in self._pool.map(_detect_chunk, chunks) for lang in part]
+        return _detect_chunk(texts)
+
+    def detect_many(self, texts, is_html=True) -> list:
+        """ Languages of `texts`, in order. """
+        t0 = time.perf_counter()
+        clean = [strip_html(t) if is_html else (t or "").strip() for t in texts]
+        keys = [text_key(t) for t in clean]
+        known = self._lookup(set(keys))
+
+        todo: dict[str, str] = {}
+        for key, text in zip(keys, clean):
+            if key not in known and key not in todo:
+                todo[key] = text
+        if todo:
+            langs = self._run(list(todo.values()))
+            new = dict(zip(todo.keys(), langs))
+            for key, lang in new.items():
+                self._remember(key, lang)
+            known.update(new)
+            if self.db is not None:
+                self.db.executemany("INSERT OR IGNORE INTO langs (key, lang) VALUES (?, ?)", new.items())
+                self.db.commit()
+
+        self.texts += len(texts)
+        self.detected += len(todo)
+        self.seconds += time.perf_counter() - t0
+        return [known[key] for key in keys]
+
+    def detect(self, text, is_html=True):
+        return self.detect_many([text], is_html)[0]
+
+    def stats(self) -> dict:
+        return {
+            "texts": self.texts,
+            "detected": self.detected,
+            "cache_hits": self.texts - self.detected,
+            "seconds": round(self.seconds, 3),
+            "posts_per_sec": round(self.texts / self.seconds, 1) if self.seconds else 0.0,
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
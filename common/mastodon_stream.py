@@ -0,0 +1,381 @@
+"""
+Live collection of Mastodon statuses from the streaming API.
+
+The download scripts rebuild history by paging `timeline_hashtag` /
+`timeline_public` one request at a time. For current data one long-lived
+server-sent-events connection per (instance, stream) does the same job:
+
+    GET /api/v1/streaming/hashtag?tag=climatechange
+    GET /api/v1/streaming/public/remote
+
+    event: update
+    data: {"id": "...", "uri": "...", "language": "en", ...}
+
+`MastodonStreamer` follows several instances at once from one asyncio
+loop. A status federated to more than one instance arrives once per
+instance (with a different local id), so statuses are deduplicated by
+`uri` in the ProgressStore before anything is kept, and the declared
+language (and optionally a hashtag set) is checked inline.
+
+Kept statuses are buffered and appended in batches to the monthly JSONL
+logs the download scripts write (`<progress_dir>/<YYYY-MM>.jsonl`), with
+one `checkpoint()` per batch. A month is rendered into the PostStore (and
+the `{month}.json` array if asked) when the stream moves past it and on
+shutdown.
+
+A dropped stream is reopened with jittered exponential backoff. The
+statuses published while it was down are fetched over REST (`min_id`
+paging from the last id seen on that stream, persisted with the batch)
+before the reopened stream is read, so a reconnect leaves no gap.
+
+    python -m common.mastodon_stream --instances https://mastodon.social https://fosstodon.org \\
+        --streams hashtag:climatechange public:remote
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+
+from common import metrics
+from common.checkpoint import ProgressStore, append_post, write_json_array
+from common.engine import CrawlEngine
+from common.hashtags import normalize_tag
+from common.store import PostStore
+
+OUT_DIR = Path("./mastodon/dataset/stream")
+STORE_ROOT = Path("./dataset/store/stream")
+STREAMS = ["hashtag:climatechange", "public:remote"]
+BATCH_SIZE = 200          # statuses per checkpoint
+INTERVAL = 5.0            # seconds before a partial batch is written anyway
+READ_TIMEOUT = 90         # seconds of silence (Mastodon sends a heartbeat every ~10 s) before reconnecting
+BACKOFF_BASE = 1          # seconds; the wait is uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**failures))
+BACKOFF_MAX = 120
+PAGE_SIZE = 40
+
+# stream name -> (streaming path, REST timeline of the same statuses, its params)
+_STREAMS = {
+    "public": ("/api/v1/streaming/public", "/api/v1/timelines/public", {}),
+    "public:local": ("/api/v1/streaming/public/local", "/api/v1/timelines/public", {"local": "true"}),
+    "public:remote": ("/api/v1/streaming/public/remote", "/api/v1/timelines/public", {"remote": "true"}),
+    "hashtag": ("/api/v1/streaming/hashtag", "/api/v1/timelines/tag/{tag}", {}),
+    "hashtag:local": ("/api/v1/streaming/hashtag/local", "/api/v1/timelines/tag/{tag}", {"local": "true"}),
+}
+
+
+def parse_stream(spec):
+    """ 'hashtag:climatechange' / 'hashtag:local:climatechange' / 'public:remote'
+    -> (stream, tag or None). """
+    if spec.startswith("hashtag:"):
+        rest = spec[len("hashtag:"):]
+        stream, tag = ("hashtag:local", rest[len("local:"):]) if rest.startswith("local:") else ("hashtag", rest)
+        if not tag:
+            raise ValueError(f"{spec}: hashtag stream without a tag")
+        return stream, tag.lstrip("#")
+    if spec not in _STREAMS:
+        raise ValueError(f"unknown stream {spec!r}, expected one of {', '.join(_STREAMS)} or hashtag:<tag>")
+    return spec, None
+
+
+async def sse_events(lines):
+    """ (event, data) of a server-sent-events body, from its decoded lines.
+    Comment lines (heartbeats) are skipped. """
+    event, data = None, []
+    async for line in lines:
+        if not line:
+            if data:
+                yield event or "message", "\n".join(data)
+            event, data = None, []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+
+
+class StatusFilter:
+    """ Declared language ("en" also matches "en-GB") and hashtag set a status
+    must match; None disables a criterion. """
+
+    def __init__(self, lang="en", tags=None):
+        self.lang = lang or None
+        self.tags = {normalize_tag(t) for t in tags} if tags else None
+
+    def __call__(self, status) -> bool:
+        if self.lang is not None:
+            lang = status.get("language") or ""
+            if lang != self.lang and not lang.startswith(self.lang + "-"):
+                return False
+        if self.tags is None:
+            return True
+        return any(normalize_tag(t.get("name", "")) in self.tags for t in status.get("tags") or [])
+
+
+class Source:
+    """ One (instance, stream) connection and its resume point. """
+
+    def __init__(self, instance, spec):
+        self.instance = instance.rstrip("/")
+        self.spec = spec
+        self.stream, self.tag = parse_stream(spec)
+        self.key = f"{urlsplit(self.instance).netloc}/{spec}"
+        self.last_id: str | None = None       # newest status id received on this stream
+        self.failures = 0
+
+    def stream_url(self, base=None):
+        return (base or self.instance) + _STREAMS[self.stream][0]
+
+    def stream_params(self):
+        return {"tag": self.tag} if self.tag else None
+
+    def timeline(self):
+        _, path, params = _STREAMS[self.stream]
+        return self.instance + path.format(tag=self.tag), dict(params)
+
+
+class MastodonStreamer:
+    """ Several instances' streams -> dedup by uri -> filter -> monthly logs. """
+
+    def __init__(self, instances, streams=STREAMS, status_filter: StatusFilter | None = None,
+                 out_dir=OUT_DIR, store_root=STORE_ROOT, token=None, engine: CrawlEngine | None = None,
+                 json_arrays=False, batch_size=BATCH_SIZE, interval=INTERVAL):
+        self.sources = [Source(i, s) for i in instances for s in streams]
+        self.filter = status_filter or StatusFilter()
+        self.out_dir = Path(out_dir)
+        self.progress_dir = self.out_dir.parent / ".progress" / self.out_dir.name
+        self.store = ProgressStore(self.progress_dir / "progress.sqlite")
+        self.posts_store = PostStore(store_root)
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.engine = engine or CrawlEngine()
+        self.json_arrays = json_arrays
+        self.batch_size = batch_size
+        self.interval = interval
+        for source in self.sources:
+            source.last_id = self.store.cursor("mastodon", source.key, "live")
+        self._pending: list[tuple[str, dict]] = []     # (month, status) not written yet
+        self._logs: dict[str, object] = {}             # month -> open log
+        self._streaming_base: dict[str, str] = {}
+        self.received = 0
+        self.kept = 0
+
+    # -- writing -------------------------------------------------------------
+
+    def _keep(self, source, status):
+        """ Filter and deduplicate one status; True if it joins the batch. """
+        self.received += 1
+        if status.get("reblog") or not status.get("uri"):
+            metrics.STREAM_EVENTS.inc(platform="mastodon", result="other")
+            return False
+        if source.last_id is None or int(status["id"]) > int(source.last_id):
+            source.last_id = str(status["id"])
+        if not self.filter(status):
+            metrics.STREAM_EVENTS.inc(platform="mastodon", result="filtered")
+            return False
+        if not self.store.add_seen("mastodon", status["uri"]):
+            metrics.STREAM_EVENTS.inc(platform="mastodon", result="duplicate")
+            return False
+        metrics.STREAM_EVENTS.inc(platform="mastodon", result="kept")
+        self._pending.append((status["created_at"][:7], status))
+        self.kept += 1
+        return True
+
+    def flush(self):
+        """ Append the batch to its month logs and make it durable together
+        with the seen uris and every stream's last id. """
+        by_month: dict[str, list[dict]] = {}
+        for month, status in self._pending:
+            by_month.setdefault(month, []).append(status)
+        self._pending = []
+        fh = None
+        for month, statuses in sorted(by_month.items()):
+            fh = self._log(month)
+            for status in statuses:
+                append_post(fh, status)
+            self.store.checkpoint(fh, "mastodon", "stream", month, saved=len(statuses))
+        if fh is None:
+            if not self._logs:
+                return
+            fh = next(iter(self._logs.values()))
+        for source in self.sources:
+            if source.last_id is not None:
+                self.store.checkpoint(fh, "mastodon", source.key, "live", cursor=source.last_id)
+        # a month no status arrived for in a whole batch is over: render it
+        for month in [m for m in self._logs if m not in by_month and by_month]:
+            self._render(month)
+
+    def _log(self, month):
+        if month not in self._logs:
+            self._logs[month] = self.store.open_log(self.progress_dir / f"{month}.jsonl")
+        return self._logs[month]
+
+    def _render(self, month):
+        """ Close a month log and write its PostStore partition (and JSON array). """
+        fh = self._logs.pop(month)
+        fh.close()
+        log_path = self.progress_dir / f"{month}.jsonl"
+        n = self.posts_store.write_log("mastodon", month, log_path)
+        if self.json_arrays:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            write_json_array(log_path, self.out_dir / f"{month}.json")
+        print(f"{month}: {n} statuses in the store")
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+    # -- streaming -------------------------------------------------------------
+
+    async def _base(self, instance):
+        """ Streaming host of an instance (it may differ from the web host). """
+        if instance not in self._streaming_base:
+            base = instance
+            try:
+                resp = await self.engine.get(instance + "/api/v2/instance")
+                if resp.status_code == 200:
+                    url = ((resp.json().get("configuration") or {}).get("urls") or {}).get("streaming")
+                    if url:
+                        base = url.replace("wss://", "https://", 1).replace("ws://", "http://", 1).rstrip("/")
+            except (httpx.HTTPError, ValueError):
+                pass
+            self._streaming_base[instance] = base
+        return self._streaming_base[instance]
+
+    async def _backfill(self, source):
+        """ Statuses published on the source's timeline after its last id,
+        oldest first, fetched while the stream is down. Paging goes on until a
+        short page shows it caught up: the live stream moves the last id past
+        anything left out. A failed page raises, so the reconnect backs off and
+        resumes the backfill from the last id kept. """
+        url, params = source.timeline()
+        min_id = source.last_id
+        while True:
+            resp = await self.engine.get(url, headers=self.headers,
+                                         params=dict(params, min_id=min_id, limit=PAGE_SIZE))
+            resp.raise_for_status()
+            page = resp.json()
+            metrics.WINDOWS.inc(platform="mastodon", result="full" if page else "empty")
+            # min_id pages come newest first, starting just above min_id
+            for status in sorted(page, key=lambda s: int(s["id"])):
+                self._keep(source, status)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+            if len(page) < PAGE_SIZE:
+                return
+            min_id = max(page, key=lambda s: int(s["id"]))["id"]
+
+    async def _follow(self, source):
+        """ Keep one stream open for as long as the run lasts. """
+        while True:
+            wait, reason = None, None
+            try:
+                base = await self._base(source.instance)
+                async with self.engine.stream("GET", source.stream_url(base), headers=self.headers,
+                                              params=source.stream_params(), read_timeout=READ_TIMEOUT) as resp:
+                    if resp.status_code == 429:
+                        wait = float(resp.headers.get("Retry-After") or 0) or None
+                        raise httpx.HTTPStatusError("429", request=resp.request, response=resp)
+                    if 400 <= resp.status_code < 500:
+                        print(f"{source.key}: HTTP {resp.status_code}, giving up on this stream")
+                        return
+                    resp.raise_for_status()
+                    print(f"{source.key}: streaming, last id {source.last_id}")
+                    # the new stream is buffered by the socket while the gap is filled
+                    if source.last_id is not None:
+                        await self._backfill(source)
+                    async for event, data in sse_events(resp.aiter_lines()):
+                        source.failures = 0
+                        if event != "update":
+                            metrics.STREAM_EVENTS.inc(platform="mastodon", result="other")
+                            continue
+                        self._keep(source, json.loads(data))
+                        if len(self._pending) >= self.batch_size:
+                            self.flush()
+                reason = "stream closed by the server"
+            except (httpx.HTTPError, ValueError) as exc:
+                reason = f"{type(exc).__name__}: {exc}"
+            source.failures += 1
+            if wait is None:
+                # full jitter: streams dropped together do not reconnect together
+                wait = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (source.failures - 1)))
+            metrics.RETRIES.inc(platform="mastodon", reason="disconnect")
+            metrics.BACKOFF_SECONDS.inc(wait, reason="reconnect")
+            print(f"{source.key}: {reason}; reconnecting in {wait:.1f} s")
+            await asyncio.sleep(wait)
+
+    async def run(self, seconds=None):
+        """ Follow every source until cancelled (or for `seconds`). """
+        tasks = [asyncio.create_task(self._follow(s)) for s in self.sources]
+        flusher = asyncio.create_task(self._flusher())
+        try:
+            if seconds is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.wait(tasks, timeout=seconds)
+        finally:
+            for task in tasks + [flusher]:
+                task.cancel()
+            await asyncio.gather(*tasks, flusher, return_exceptions=True)
+            self.close()
+
+    def close(self):
+        """ Write what is buffered and render the open months. """
+        self.flush()
+        for month in list(self._logs):
+            self._render(month)
+        self.store.close()
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Follow Mastodon streaming timelines on several instances")
+    parser.add_argument("--instances", nargs="+",
+                        default=os.getenv("MASTODON_INSTANCES", "https://mastodon.social").split(),
+                        help="instance base URLs (env MASTODON_INSTANCES, space separated)")
+    parser.add_argument("--streams", nargs="+", default=STREAMS,
+                        help="hashtag:<tag>, hashtag:local:<tag>, public, public:local, public:remote")
+    parser.add_argument("--lang", default="en", help="declared language to keep ('' keeps all)")
+    parser.add_argument("--tags", help="JSON list of hashtags to keep (e.g. top100_hashtags.json)")
+    parser.add_argument("--out", default=str(OUT_DIR), help="dataset directory; logs go to its .progress/")
+    parser.add_argument("--store", default=str(STORE_ROOT), help="PostStore collection root")
+    parser.add_argument("--json-arrays", action="store_true", help="also render {month}.json arrays")
+    parser.add_argument("--seconds", type=float, help="stop after this many seconds")
+    args = parser.parse_args(argv)
+
+    tags = None
+    if args.tags:
+        with open(args.tags, "r", encoding="utf-8") as fh:
+            tags = json.load(fh)
+    streamer = MastodonStreamer(args.instances, args.streams, StatusFilter(args.lang, tags), args.out,
+                                args.store, token=os.getenv("MASTODON_TOKEN"), json_arrays=args.json_arrays)
+    progress_dir = streamer.progress_dir
+    exporter = metrics.Exporter(progress_dir / "metrics.json", progress_dir / "metrics.prom").start()
+
+    async def go():
+        async with streamer.engine:
+            await streamer.run(args.seconds)
+
+    try:
+        asyncio.run(go())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.stop()
+    print(f"{streamer.received} statuses received, {streamer.kept} kept")
+
+
+if __name__ == "__main__":
+    main()
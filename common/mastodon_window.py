@@ -0,0 +1,70 @@
+"""
+Time-window pagination for Mastodon timelines.
+
+Mastodon status ids are snowflakes: the upper 48 bits are the creation time
+in milliseconds, the lower 16 a sequence. A day [start, end) therefore maps
+to the id range [snowflake(start), snowflake(end)), which `walk_window`
+passes as since_id / max_id and then follows the `Link: rel="next"` header
+(Mastodon.py's fetch_next) 40 statuses at a time until the window edge. One
+day of a hashtag costs ceil(N / 40) requests instead of an unbounded loop of
+random probes.
+
+`map_days` runs one window per day on a thread pool; the requests still go
+through the shared engine session, so the instance's rate budget holds.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+from common import metrics
+
+PAGE_SIZE = 40   # max page size of the timeline endpoints
+WORKERS = 4
+
+
+def snowflake(when: dt.datetime) -> int:
+    """ Lowest status id that can have been created at `when`. """
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=dt.timezone.utc)
+    return int(when.timestamp() * 1000) << 16
+
+
+def snowflake_time(status_id) -> dt.datetime:
+    """ Creation time encoded in a status id. """
+    return dt.datetime.fromtimestamp((int(status_id) >> 16) / 1000, tz=dt.timezone.utc)
+
+
+def day_bounds(day: dt.date):
+    """ [00:00, next 00:00) of a UTC day. """
+    start = dt.datetime.combine(day, dt.time.min, tzinfo=dt.timezone.utc)
+    return start, start + dt.timedelta(days=1)
+
+
+def walk_window(mastodon, fetch, start, end, page_size=PAGE_SIZE, max_pages=None, **params):
+    """ Yield the statuses of `fetch` (e.g. mastodon.timeline_hashtag) created in
+    [start, end), newest first. `params` go to the first call (hashtag=...),
+    later pages follow the Link header. """
+    lo, hi = snowflake(start), snowflake(end)
+    page = fetch(max_id=hi, since_id=lo - 1, limit=page_size, **params)
+    pages = 1
+    metrics.WINDOWS.inc(platform="mastodon", result="full" if page else "empty")
+    while page:
+        for status in page:
+            if int(status.id) < lo:
+                return
+            yield status
+        # a short page means the server ran out of statuses above since_id
+        if len(page) < page_size or (max_pages is not None and pages >= max_pages):
+            return
+        page = mastodon.fetch_next(page)
+        pages += 1
+        metrics.WINDOWS.inc(platform="mastodon", result="full" if page else "empty")
+
+
+def map_days(fn, days, workers=WORKERS):
+    """ Yield (day, fn(day)) in day order, running up to `workers` days at once. """
+    days = list(days)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        yield from zip(days, pool.map(fn, days))
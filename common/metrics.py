@@ -0,0 +1,350 @@
+"""
+Process-wide metrics for the crawlers and the post-processing pipeline.
+
+Counters, gauges and histograms with labels, kept in plain dicts behind
+one lock per metric: an update is a tuple build, a dict lookup and an
+add, cheap enough to stay on during a crawl of several days. The shared
+`registry` renders
+
+- the Prometheus text format, served by `serve()` (scrape endpoint,
+  GET /metrics) or written by `write_prom()` for node_exporter's textfile
+  collector;
+- a JSON snapshot with the derived ratios (dedup hit ratio, empty window
+  ratio) that are awkward to read off raw counters.
+
+`Exporter` writes both every `interval` seconds from a daemon thread, and
+once more on stop(), and starts the scrape endpoint when METRICS_PORT is
+set.
+
+Recorded by the shared code: HTTP responses and latency by endpoint
+(common.engine), rate-limit waits (common.ratelimit), dedup checks and
+bytes / posts appended to the logs (common.checkpoint), result pages per
+search window (common.mastodon_window and the Bluesky scripts), retries
+and server-error backoff (the scripts), the writer queue depth of
+crawl_day, and per-stage time and drops of common.pipeline.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+INTERVAL = 60                 # seconds between snapshots
+PORT = int(os.getenv("METRICS_PORT") or 0)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _label_text(self, key, extra=()) -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key)] + list(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    """ Monotonic count (or sum of seconds, bytes...). """
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(v for _, v in self.items())
+
+    def render(self):
+        for key, value in self.items():
+            yield f"{self.name}{self._label_text(key)} {_number(value)}"
+
+    def snapshot(self):
+        return [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in self.items()]
+
+
+class Gauge(Counter):
+    """ Value that goes up and down (queue depth...). """
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """ Bucketed observations plus their sum and count. """
+
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self):
+        for key, (counts, total, n) in self.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{self._label_text(key, [le])} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(key)} {_number(total)}"
+            yield f"{self.name}_count{self._label_text(key)} {n}"
+
+    def snapshot(self):
+        out = []
+        for key, (counts, total, n) in self.items():
+            out.append({"labels": dict(zip(self.labels, key)), "count": n, "sum": round(total, 6),
+                        "buckets": dict(zip([_number(b) for b in self.buckets] + ["+Inf"], counts))})
+        return out
+
+
+class Registry:
+    """ Named metrics of one process. """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def _get(self, cls, name, doc, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, doc, labels, **kwargs)
+            return metric
+
+    def counter(self, name, doc, labels=()) -> Counter:
+        return self._get(Counter, name, doc, labels)
+
+    def gauge(self, name, doc, labels=()) -> Gauge:
+        return self._get(Gauge, name, doc, labels)
+
+    def histogram(self, name, doc, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, doc, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """ Prometheus text exposition format. """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            "time": time.time(),
+            "uptime": round(time.time() - self.started, 3),
+            "ratios": ratios(self),
+            "metrics": {m.name: {"type": m.kind, "values": m.snapshot()} for m in list(self._metrics.values())},
+        }
+
+    def write_prom(self, path):
+        _atomic_write(path, self.render())
+
+    def write_json(self, path):
+        _atomic_write(path, json.dumps(self.snapshot(), indent=1))
+
+    def serve(self, port, host="127.0.0.1") -> ThreadingHTTPServer:
+        """ GET /metrics on a daemon thread; returns the server (shutdown() to stop). """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                data = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _atomic_write(path, text):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name("." + path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def endpoint(url):
+    """ (host, endpoint) label of a request: the XRPC method, or the first
+    four path segments of a REST call (ids and hashtags cut off). """
+    parts = urlsplit(str(url))
+    if parts.path.startswith("/xrpc/"):
+        return parts.netloc, parts.path[6:]
+    return parts.netloc, "/".join(parts.path.rstrip("/").split("/")[:5 if "/timelines/" in parts.path else 4])
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "crawler_http_requests_total", "HTTP responses by endpoint and status code ('error': no response)",
+    ("host", "endpoint", "status"))
+HTTP_SECONDS = registry.histogram(
+    "crawler_http_request_seconds", "Request latency, without the rate-limit wait before it",
+    ("host", "endpoint"))
+RETRIES = registry.counter(
+    "crawler_retries_total", "Requests sent again, by reason (429, 5xx, network)", ("platform", "reason"))
+BACKOFF_SECONDS = registry.counter(
+    "crawler_backoff_seconds_total", "Seconds slept before sending: rate-limit waits and 5xx backoff",
+    ("reason",))
+DEDUP = registry.counter(
+    "crawler_dedup_checks_total", "Seen-key lookups, hit = already saved", ("platform", "result"))
+WINDOWS = registry.counter(
+    "crawler_windows_total", "Result pages of search / timeline windows, empty or not", ("platform", "result"))
+QUEUE_DEPTH = registry.gauge(
+    "crawler_writer_queue_depth", "Posts waiting for the writer task", ())
+POSTS_WRITTEN = registry.counter(
+    "crawler_posts_written_total", "Posts appended to an output log", ("sink",))
+BYTES_WRITTEN = registry.counter(
+    "crawler_bytes_written_total", "Bytes appended to an output log (before compression)", ("sink",))
+STREAM_EVENTS = registry.counter(
+    "crawler_stream_events_total", "Streaming API messages by outcome (kept, filtered, duplicate, replayed, other)",
+    ("platform", "result"))
+HTTP_CACHE = registry.counter(
+    "crawler_http_cache_total", "Response cache lookups (hit, miss, expired, bypass: no closed window)",
+    ("host", "endpoint", "result"))
+STAGE_SECONDS = registry.counter(
+    "pipeline_stage_seconds_total", "Time spent inside each pipeline stage and sink", ("stage",))
+STAGE_POSTS = registry.counter(
+    "pipeline_posts_total", "Posts through each pipeline stage, kept or dropped", ("stage", "result"))
+
+
+def _ratio(counter: Counter | None, numerator, group="platform"):
+    by: dict[str, dict[str, float]] = {}
+    for key, value in counter.items() if counter is not None else ():
+        labels = dict(zip(counter.labels, key))
+        counts = by.setdefault(labels.get(group, ""), {})
+        counts[labels["result"]] = counts.get(labels["result"], 0) + value
+    return {platform: round(c.get(numerator, 0) / sum(c.values()), 4)
+            for platform, c in by.items() if sum(c.values())}
+
+
+def ratios(reg: Registry) -> dict:
+    """ Dedup hit ratio and empty window ratio per platform, response cache
+    hit ratio per host. """
+    return {"dedup_hit": _ratio(reg._metrics.get("crawler_dedup_checks_total"), "hit"),
+            "empty_window": _ratio(reg._metrics.get("crawler_windows_total"), "empty"),
+            "http_cache_hit": _ratio(reg._metrics.get("crawler_http_cache_total"), "hit", "host")}
+
+
+class Exporter:
+    """ Periodic JSON snapshot + Prometheus textfile, and the scrape endpoint
+    when a port is given (METRICS_PORT by default). """
+
+    def __init__(self, json_path=None, prom_path=None, interval=INTERVAL, port=PORT, reg: Registry = registry):
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self.port = port
+        self.registry = reg
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._server = None
+
+    def write(self):
+        if self.json_path:
+            self.registry.write_json(self.json_path)
+        if self.prom_path:
+            self.registry.write_prom(self.prom_path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        if self.port:
+            self._server = self.registry.serve(self.port)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
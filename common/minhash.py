@@ -0,0 +1,341 @@
+"""
+Near-duplicate detection with MinHash signatures and an LSH index.
+
+Exact dedup (uri / status id) keeps cross-posted content: the same text
+bridged between Mastodon and Bluesky, boosted copies, bot reposts under new
+uris. Comparing every pair of texts is quadratic; here each post costs a
+constant amount of work:
+
+- `normalize_text`: HTML stripped (Mastodon `content`), links and @mentions
+  dropped, NFKC + casefold, punctuation to spaces;
+- `MinHasher`: character 5-gram shingles, hashed with a rolling hash over
+  the code points of a whole batch of texts at once, and `num_perm`
+  multiply-shift hash functions whose minima form the signature (numpy,
+  no Python loop per shingle). Two signatures agree on a position with
+  probability equal to the Jaccard similarity of the shingle sets;
+- `LSHIndex`: the signature is cut into `bands` bands of `rows` values;
+  posts sharing a whole band are candidates, and a candidate is a
+  near-duplicate when the signatures agree on at least `threshold` of
+  their positions. (bands, rows) are picked so that the S-curve
+  1 - (1 - s^rows)^bands turns around `threshold`.
+
+The index keeps one representative per cluster (the first post seen) and
+maps every later near-duplicate to it, so it can be saved after a month
+and extended with the next one, across platforms. `common.pipeline` uses
+it as the `NearDuplicates` stage (`--near-dup`) to collapse clusters
+before hashtag counting.
+
+    python -m common.minhash ./dataset/store/100_posts --index ./.progress/minhash/100_posts.npz
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from common.build import hash_file
+from common.langid import strip_html, strip_links
+
+NUM_PERM = 128
+SHINGLE = 5               # characters per shingle
+THRESHOLD = 0.8           # estimated Jaccard similarity of near-duplicates
+SEED = 1
+CHUNK_SHINGLES = 1 << 16  # shingles hashed at once (num_perm x this uint64 temporary)
+INDEX_DIR = Path("./.progress/minhash")
+
+_PUNCT = re.compile(r"[^\w\s]+")
+_SPACE = re.compile(r"\s+")
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+_BASE = np.uint64(0x100000001B3)
+
+
+def normalize_text(text, is_html=True) -> str:
+    """ Visible words of a post, as compared for near-duplicates. Links and
+    @mentions are dropped from both platforms, tags only from HTML. """
+    if not text:
+        return ""
+    text = strip_html(text) if is_html else strip_links(text)
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _SPACE.sub(" ", _PUNCT.sub(" ", text)).strip()
+
+
+def _mix(h):
+    """ splitmix64 finalizer, in place on a uint64 array. """
+    h ^= h >> np.uint64(30)
+    h *= _MIX1
+    h ^= h >> np.uint64(27)
+    h *= _MIX2
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def pick_bands(num_perm, threshold) -> tuple[int, int]:
+    """ (bands, rows) with bands * rows <= num_perm whose LSH threshold
+    (1 / bands) ** (1 / rows) is closest to `threshold`. """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        err = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or err < best[0]:
+            best = (err, bands, rows)
+    return best[1], best[2]
+
+
+class MinHasher:
+    """ Batched MinHash signatures of normalized texts. """
+
+    def __init__(self, num_perm=NUM_PERM, shingle=SHINGLE, seed=SEED):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+
+    def shingles(self, texts) -> tuple[np.ndarray, np.ndarray]:
+        """ (hashes, counts): the shingle hashes of every text, concatenated,
+        and how many belong to each. A text shorter than a shingle is one
+        shingle; an empty text has none. """
+        k = self.shingle
+        points = [np.frombuffer(t.encode("utf-32-le"), dtype=np.uint32) for t in texts]
+        lengths = np.array([len(p) for p in points], dtype=np.int64)
+        counts = np.where(lengths >= k, lengths - k + 1, np.minimum(lengths, 1))
+        if not counts.sum():
+            return np.zeros(0, dtype=np.uint64), counts
+        # pad short texts to one full shingle, then one rolling hash over the batch
+        padded = [p if len(p) >= k else np.concatenate([p, np.zeros(k - len(p), np.uint32)])
+                  for p, n in zip(points, lengths) if n]
+        flat = np.concatenate(padded).astype(np.uint64)
+        span = len(flat) - k + 1
+        h = np.zeros(span, dtype=np.uint64)
+        for j in range(k):
+            h = h * _BASE + flat[j:j + span]
+        # keep the windows that start and end inside one text
+        owner = np.repeat(np.arange(len(padded)), [len(p) for p in padded])
+        return _mix(h[owner[:span] == owner[k - 1:]]), counts
+
+    def signatures(self, texts) -> tuple[np.ndarray, np.ndarray]:
+        """ (signatures (n, num_perm) uint32, valid (n,) bool); an empty text
+        has no signature (valid False, row of zeros). """
+        hashes, counts = self.shingles(texts)
+        sigs = np.zeros((len(texts), self.num_perm), dtype=np.uint32)
+        valid = counts > 0
+        if not valid.any():
+            return sigs, valid
+        rows = np.flatnonzero(valid)
+        ends = np.cumsum(counts[valid])
+        starts = ends - counts[valid]
+        # groups of texts whose shingles fit one temporary
+        first = 0
+        while first < len(rows):
+            last = first + 1
+            while last < len(rows) and ends[last] - starts[first] <= CHUNK_SHINGLES:
+                last += 1
+            lo, hi = starts[first], ends[last - 1]
+            x = hashes[lo:hi]
+            perm = (self.a[:, None] * x[None, :] + self.b[:, None]) >> np.uint64(32)
+            mins = np.minimum.reduceat(perm, starts[first:last] - lo, axis=1)
+            sigs[rows[first:last]] = mins.T.astype(np.uint32)
+            first = last
+        return sigs, valid
+
+
+class LSHIndex:
+    """ Incremental near-duplicate index: one representative per cluster,
+    banded into hash tables, plus the duplicate -> representative map. """
+
+    def __init__(self, num_perm=NUM_PERM, threshold=THRESHOLD, shingle=SHINGLE, seed=SEED):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle, seed)
+        self.bands, self.rows = pick_bands(num_perm, threshold)
+        self._sigs = np.zeros((1024, num_perm), dtype=np.uint32)
+        self.keys: list[str] = []           # representatives
+        self.platforms: list[str] = []
+        self.tables: list[dict[bytes, list[int]]] = [{} for _ in range(self.bands)]
+        self.duplicates: dict[str, str] = {}    # duplicate key -> representative key
+        self.dup_platforms: dict[str, str] = {}
+        self.parts: dict[str, str | None] = {}  # what was indexed ("bluesky/2025-03") -> its content hash
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def signatures(self) -> np.ndarray:
+        return self._sigs[:len(self.keys)]
+
+    def _band_keys(self, sig) -> list[bytes]:
+        raw, width = sig.tobytes(), self.rows * 4
+        return [raw[i * width:(i + 1) * width] for i in range(self.bands)]
+
+    def query(self, sig) -> int | None:
+        """ Index of the most similar representative at or above the threshold. """
+        candidates = set()
+        for table, band in zip(self.tables, self._band_keys(sig)):
+            hit = table.get(band)
+            if hit is not None:
+                candidates.update(hit)
+        if not candidates:
+            return None
+        idx = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self._sigs[idx] == sig).mean(axis=1)
+        best = int(similarity.argmax())
+        return int(idx[best]) if similarity[best] >= self.threshold else None
+
+    def _insert(self, key, platform, sig):
+        i = len(self.keys)
+        if i == len(self._sigs):
+            self._sigs = np.concatenate([self._sigs, np.zeros_like(self._sigs)])
+        self._sigs[i] = sig
+        self.keys.append(key)
+        self.platforms.append(platform)
+        for table, band in zip(self.tables, self._band_keys(sig)):
+            table.setdefault(band, []).append(i)
+
+    def add(self, key, platform, sig) -> str | None:
+        """ Index one post; returns the representative it duplicates, or None
+        (the post is a new representative). """
+        if key in self.duplicates:
+            return self.duplicates[key]
+        match = self.query(sig)
+        if match is None:
+            self._insert(key, platform, sig)
+            return None
+        rep = self.keys[match]
+        if rep == key:
+            return None
+        self.duplicates[key] = rep
+        self.dup_platforms[key] = platform
+        return rep
+
+    def add_texts(self, keys, platforms, texts) -> list[str | None]:
+        """ add() for a batch of normalized texts; posts without text are never
+        duplicates. """
+        sigs, valid = self.hasher.signatures(texts)
+        return [self.add(k, p, s) if ok else None
+                for k, p, s, ok in zip(keys, platforms, sigs, valid)]
+
+    # -- reporting -------------------------------------------------------------
+
+    def clusters(self) -> dict[str, list[str]]:
+        """ representative -> its near-duplicates, for clusters of two or more. """
+        out: dict[str, list[str]] = {}
+        for dup, rep in self.duplicates.items():
+            out.setdefault(rep, []).append(dup)
+        return out
+
+    def stats(self) -> dict:
+        rep_platform = dict(zip(self.keys, self.platforms))
+        clusters = self.clusters()
+        cross = sum(1 for rep, dups in clusters.items()
+                    if any(self.dup_platforms[d] != rep_platform.get(rep) for d in dups))
+        return {"posts": len(self.keys) + len(self.duplicates), "representatives": len(self.keys),
+                "duplicates": len(self.duplicates), "clusters": len(clusters), "cross_platform": cross,
+                "bands": self.bands, "rows": self.rows}
+
+    # -- persistence -----------------------------------------------------------
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {"threshold": self.threshold, "num_perm": self.hasher.num_perm, "shingle": self.hasher.shingle,
+                "seed": self.hasher.seed, "parts": self.parts}
+        dups = list(self.duplicates)
+        tmp = path.with_name("." + path.name + ".tmp")
+        with tmp.open("wb") as fh:
+            np.savez(fh, signatures=self.signatures,
+                     keys=np.array(self.keys, dtype=object), platforms=np.array(self.platforms, dtype=object),
+                     dup_keys=np.array(dups, dtype=object),
+                     dup_reps=np.array([self.duplicates[d] for d in dups], dtype=object),
+                     dup_platforms=np.array([self.dup_platforms[d] for d in dups], dtype=object),
+                     meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> LSHIndex:
+        with np.load(path, allow_pickle=True) as data:
+            meta = json.loads(str(data["meta"]))
+            index = cls(meta["num_perm"], meta["threshold"], meta["shingle"], meta["seed"])
+            # indexes saved before parts had hashes: every part is checked once
+            parts = meta["parts"]
+            index.parts = dict(parts) if isinstance(parts, dict) else dict.fromkeys(parts)
+            for key, platform, sig in zip(data["keys"], data["platforms"], data["signatures"]):
+                index._insert(str(key), str(platform), sig)
+            for key, rep, platform in zip(data["dup_keys"], data["dup_reps"], data["dup_platforms"]):
+                index.duplicates[str(key)] = str(rep)
+                index.dup_platforms[str(key)] = str(platform)
+        return index
+
+    @classmethod
+    def open(cls, path, threshold=THRESHOLD) -> LSHIndex:
+        """ The index saved at `path`, or a new one. """
+        if path is not None and Path(path).exists():
+            index = cls.load(path)
+            if abs(index.threshold - threshold) > 1e-9:
+                raise ValueError(f"{path} was built with threshold {index.threshold}, not {threshold}")
+            return index
+        return cls(threshold=threshold)
+
+
+def index_store(index, store, platforms=("bluesky", "mastodon")) -> dict[str, dict]:
+    """ Add the PostStore months not indexed yet, or changed since (keyed by
+    the partition's content hash, so posts appended to a month are picked
+    up), months in order, platforms interleaved; returns
+    {"<platform>/<month>": {"posts", "duplicates"}} for the new posts. """
+    todo = []
+    for platform in platforms:
+        for month in store.months(platform):
+            digest = hash_file(store.month_file(platform, month))
+            if index.parts.get(f"{platform}/{month}") != digest:
+                todo.append((month, platform, digest))
+    known = set(index.keys) | set(index.duplicates)
+    report = {}
+    for month, platform, digest in sorted(todo):
+        table = store.read(["uri", "id", "text"], platform=platform, months=[month])
+        keys, texts = [], []
+        for uri, i, text in zip(table.column("uri").to_pylist(), table.column("id").to_pylist(),
+                                table.column("text").to_pylist()):
+            key = uri or f"{platform}:{i}"
+            # a changed month is read again: only its new posts are added
+            if key not in known:
+                keys.append(key)
+                texts.append(normalize_text(text, is_html=platform == "mastodon"))
+        reps = index.add_texts(keys, [platform] * len(keys), texts)
+        known.update(keys)
+        index.parts[f"{platform}/{month}"] = digest
+        report[f"{platform}/{month}"] = {"posts": len(keys), "duplicates": sum(r is not None for r in reps)}
+    return report
+
+
+def main(argv=None):
+    from common.store import PostStore
+
+    parser = argparse.ArgumentParser(description="Near-duplicate clusters across months and platforms")
+    parser.add_argument("root", help="collection root, e.g. ./dataset/store/100_posts")
+    parser.add_argument("--platforms", nargs="+", default=["bluesky", "mastodon"])
+    parser.add_argument("--index", help="index file, extended in place (default: .progress/minhash/<name>.npz)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--clusters", help="write representative -> near-duplicates here (.json)")
+    args = parser.parse_args(argv)
+
+    index_path = Path(args.index or INDEX_DIR / f"{Path(args.root).name}.npz")
+    index = LSHIndex.open(index_path, args.threshold)
+    for part, row in index_store(index, PostStore(args.root), args.platforms).items():
+        print(f"{part}: {row['posts']} posts, {row['duplicates']} near-duplicates")
+    index.save(index_path)
+    st = index.stats()
+    print(f"{st['posts']} posts, {st['duplicates']} near-duplicates in {st['clusters']} clusters "
+          f"({st['cross_platform']} across platforms), {st['bands']} bands x {st['rows']} rows")
+    if args.clusters:
+        with open(args.clusters, "w", encoding="utf-8") as fh:
+            json.dump(index.clusters(), fh, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
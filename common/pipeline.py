@@ -0,0 +1,504 @@
+"""
+Single-pass, constant-memory processing of downloaded posts.
+
+The post-processing notebooks loaded every month file with `json.load`
+once per step (count, dedup, English filter, hashtags, top-100). Here the
+steps are fused into one pass over a stream of posts:
+
+    source -> Dedup -> [NearDuplicates] -> LanguageFilter -> sinks (HashtagCounter, JsonlSink, ...)
+
+Sources read the pretty-printed monthly JSON arrays incrementally
+(`read_json_array`, one post decoded at a time) and the `.jsonl` /
+`.jsonl.gz` files written by the downloaders and `crawl_day` (`read_jsonl`),
+so memory stays at one language-detection batch plus the state of the
+stages (seen keys, hashtag counts). Stages keep their state across files, so dedup is
+global over the whole run. `--near-dup` also collapses clusters of
+near-identical texts (common.minhash) before the hashtags are counted;
+with `--near-dup-index` the clusters carry over from one run to the next. Time spent in each stage and sink, and the posts
+each stage keeps or drops, go to common.metrics (`--metrics` writes them).
+
+    python -m common.pipeline bluesky/dataset/100_posts/1_day/*.jsonl.gz \\
+        --lang en --hashtags bluesky/code/hashtag/1_day/hashtags.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+
+from common import metrics
+from common.hashtags import CountMinSketch, HashtagCounts, SpaceSaving
+from common.langid import LANG_CACHE, WORKERS, LanguageIdentifier
+from common.minhash import THRESHOLD, LSHIndex, normalize_text
+from common.store import BSKY_TAG, detect_platform
+
+CHUNK_SIZE = 1 << 16      # characters read at a time from JSON arrays
+BATCH_SIZE = 2048         # posts buffered by LanguageFilter for one batched detection
+
+
+# -- sources -----------------------------------------------------------------
+
+def read_json_array(path, chunk_size=CHUNK_SIZE, object_hook=None):
+    """ Yield the elements of a top-level JSON array one by one, without
+    loading the whole file. """
+    decoder = json.JSONDecoder(object_hook=object_hook)
+    with open(path, "r", encoding="utf-8") as fh:
+        buf, pos, eof = "", 0, False
+
+        def fill():
+            nonlocal buf, pos, eof
+            more = fh.read(chunk_size)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        skip(" \t\r\n")
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"{path}: not a JSON array")
+        pos += 1
+        while True:
+            skip(" \t\r\n,")
+            if pos >= len(buf):
+                raise ValueError(f"{path}: truncated JSON array")
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # element cut by the chunk boundary: read more and retry
+                fill()
+                continue
+            yield item
+            pos = end
+
+
+def read_jsonl(path):
+    """ One JSON document per line, plain or gzip (crawl_day's writer). """
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_posts(path):
+    """ Dispatch on the file name: `.json` arrays, `.jsonl` / `.jsonl.gz` lines. """
+    name = Path(path).name
+    if name.endswith(".jsonl") or name.endswith(".jsonl.gz"):
+        return read_jsonl(path)
+    return read_json_array(path)
+
+
+# -- post fields (both platforms) --------------------------------------------
+
+def post_key(post):
+    """ Dedup key: the uri, present on Mastodon statuses and Bluesky posts. """
+    return post.get("uri") or post.get("id")
+
+
+def post_language(post):
+    """ Declared language: Mastodon `language`, Bluesky first of `record.langs`. """
+    if detect_platform(post) == "bluesky":
+        langs = (post.get("record") or {}).get("langs") or []
+        return langs[0] if langs else None
+    return post.get("language")
+
+
+def post_text(post):
+    """ Mastodon HTML `content` or Bluesky `record.text`. """
+    if detect_platform(post) == "bluesky":
+        return (post.get("record") or {}).get("text") or ""
+    return post.get("content") or ""
+
+
+def post_month(post):
+    """ "YYYY-MM" of the creation time (Mastodon `created_at`, Bluesky `record.createdAt`). """
+    if detect_platform(post) == "bluesky":
+        created = (post.get("record") or {}).get("createdAt") or post.get("indexedAt")
+    else:
+        created = post.get("created_at")
+    return str(created)[:7] if created else None
+
+
+def post_hashtags(post):
+    """ Hashtags as written: Mastodon `tags[].name`, Bluesky tag facets. """
+    if detect_platform(post) == "bluesky":
+        return [
+            feature["tag"]
+            for facet in (post.get("record") or {}).get("facets") or []
+            for feature in facet.get("features", [])
+            if feature.get("$type") == BSKY_TAG and "tag" in feature
+        ]
+    return [t["name"] for t in post.get("tags") or [] if "name" in t]
+
+
+# -- stages ------------------------------------------------------------------
+
+class Dedup:
+    """ Drop posts whose key was already seen in this run. Only keys are kept;
+    pass a ProgressStore as `store` to keep them on disk instead. """
+
+    name = "duplicates"
+
+    def __init__(self, key=post_key, store=None, platform="posts"):
+        self.key = key
+        self.store = store
+        self.platform = platform
+        self.seen: set = set()
+        self.dropped = 0
+
+    def _new(self, key):
+        if self.store is not None:
+            return self.store.add_seen(self.platform, key)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def __call__(self, posts):
+        for post in posts:
+            if self._new(self.key(post)):
+                yield post
+            else:
+                self.dropped += 1
+
+
+class NearDuplicates:
+    """ Drop posts whose text is a near-duplicate (MinHash/LSH, common.minhash)
+    of a post kept earlier: cross-posts between platforms, boosted copies,
+    bot reposts under new uris. Texts are signed `batch_size` at a time; pass
+    an `LSHIndex` loaded from disk to extend clusters across runs. """
+
+    name = "near_duplicates"
+
+    def __init__(self, index=None, threshold=THRESHOLD, batch_size=BATCH_SIZE):
+        self.index = index if index is not None else LSHIndex(threshold=threshold)
+        self.batch_size = batch_size
+        self.dropped = 0
+
+    def _flush(self, batch):
+        platforms = [detect_platform(p) for p in batch]
+        texts = [normalize_text(post_text(p), is_html=platform == "mastodon")
+                 for p, platform in zip(batch, platforms)]
+        reps = self.index.add_texts([str(post_key(p)) for p in batch], platforms, texts)
+        for post, rep in zip(batch, reps):
+            if rep is None:
+                yield post
+            else:
+                self.dropped += 1
+
+    def __call__(self, posts):
+        batch = []
+        for post in posts:
+            batch.append(post)
+            if len(batch) >= self.batch_size:
+                yield from self._flush(batch)
+                batch = []
+        yield from self._flush(batch)
+
+
+class LanguageFilter:
+    """ Keep posts in `lang`. Posts without a declared language are identified
+    `batch_size` at a time by `identifier` (a common.langid
+    LanguageIdentifier), or dropped when there is none. """
+
+    name = "other_language"
+
+    def __init__(self, lang="en", identifier=None, batch_size=BATCH_SIZE):
+        self.lang = lang
+        self.identifier = identifier
+        self.batch_size = batch_size
+        self.dropped = 0
+
+    def _identify(self, batch):
+        if self.identifier is None:
+            return
+        for platform in ("mastodon", "bluesky"):
+            todo = [item for item in batch if item[1] is None and detect_platform(item[0]) == platform]
+            if todo:
+                # Mastodon content is HTML, Bluesky record.text is plain text
+                langs = self.identifier.detect_many([post_text(p) for p, _ in todo],
+                                                    is_html=platform == "mastodon")
+                for item, lang in zip(todo, langs):
+                    item[1] = lang
+
+    def _flush(self, batch):
+        self._identify(batch)
+        for post, lang in batch:
+            if lang == self.lang:
+                yield post
+            else:
+                self.dropped += 1
+
+    def __call__(self, posts):
+        batch = []
+        for post in posts:
+            batch.append([post, post_language(post)])
+            if len(batch) >= self.batch_size:
+                yield from self._flush(batch)
+                batch = []
+        yield from self._flush(batch)
+
+
+# -- sinks -------------------------------------------------------------------
+
+class HashtagCounter:
+    """ Hashtags of the kept posts counted per month on interned, normalized
+    ids (common.hashtags), optionally streaming every raw tag to a JSON array
+    (as hashtag_raw.json). Pass a SpaceSaving / CountMinSketch as `table`
+    for streams too large for an exact vocabulary. """
+
+    def __init__(self, raw_path=None, table=None):
+        self.table = table if table is not None else HashtagCounts()
+        self.total = 0
+        self._raw = None
+        self._first = True
+        if raw_path is not None:
+            Path(raw_path).parent.mkdir(parents=True, exist_ok=True)
+            self._raw = open(raw_path, "w", encoding="utf-8")
+            self._raw.write("[")
+
+    def add(self, post):
+        tags = post_hashtags(post)
+        if not tags:
+            return
+        self.total += len(tags)
+        self.table.update(tags, post_month(post))
+        if self._raw is not None:
+            for tag in tags:
+                self._raw.write(("\n  " if self._first else ",\n  ") + json.dumps(tag, ensure_ascii=False))
+                self._first = False
+
+    @property
+    def counts(self) -> Counter:
+        """ normalized tag -> count, as hashtag_norm.json """
+        return self.table.counter()
+
+    def top(self, k=100) -> list[str]:
+        return [tag for tag, _ in self.table.top(k)]
+
+    def save(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.counts), f, ensure_ascii=False, indent=2)
+
+    def close(self):
+        if self._raw is not None:
+            self._raw.write("\n]" if not self._first else "]")
+            self._raw.close()
+            self._raw = None
+
+
+class JsonlSink:
+    """ Write the surviving posts as JSONL (gzip for a `.gz` name). """
+
+    def __init__(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        opener = gzip.open if path.suffix == ".gz" else open
+        self.fh = opener(path, "wt", encoding="utf-8")
+        self.written = 0
+
+    def add(self, post):
+        self.fh.write(json.dumps(post, ensure_ascii=False, default=str) + "\n")
+        self.written += 1
+
+    def close(self):
+        self.fh.close()
+
+
+# -- pipeline ----------------------------------------------------------------
+
+def _timed(stream, name, stats):
+    """ Pass `stream` through, adding to stats[name] = [seconds, posts] the
+    time spent producing each post, upstream stages included. """
+    clock, seconds, n = time.perf_counter, 0.0, 0
+    it = iter(stream)
+    try:
+        while True:
+            t0 = clock()
+            try:
+                post = next(it)
+            except StopIteration:
+                return
+            finally:
+                seconds += clock() - t0
+            n += 1
+            yield post
+    finally:
+        entry = stats.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += n
+
+
+class Pipeline:
+    """ Fused source -> stages -> sinks, one pass per input file. """
+
+    def __init__(self, stages=(), sinks=()):
+        self.stages = list(stages)
+        self.sinks = list(sinks)
+        self.seconds: Counter = Counter()   # exclusive seconds per stage / sink, whole run
+
+    def process(self, posts):
+        """ Run one stream through the stages into the sinks, return how many
+        posts were read and kept. """
+        stats: dict[str, list] = {}
+        names = ["read"] + [type(stage).__name__ for stage in self.stages]
+        stream = _timed(posts, "read", stats)
+        for name, stage in zip(names[1:], self.stages):
+            stream = _timed(stage(stream), name, stats)
+        clock = time.perf_counter
+        sink_seconds = [0.0] * len(self.sinks)
+        kept = 0
+        for post in stream:
+            kept += 1
+            for i, sink in enumerate(self.sinks):
+                t0 = clock()
+                sink.add(post)
+                sink_seconds[i] += clock() - t0
+
+        # the timers are nested: a stage's own time is its total minus its upstream's
+        upstream_seconds, upstream_posts = 0.0, None
+        for name in names:
+            seconds, n = stats.get(name, (0.0, 0))
+            self._record(name, seconds - upstream_seconds)
+            metrics.STAGE_POSTS.inc(n, stage=name, result="kept")
+            if upstream_posts is not None:
+                metrics.STAGE_POSTS.inc(upstream_posts - n, stage=name, result="dropped")
+            upstream_seconds, upstream_posts = seconds, n
+        for sink, seconds in zip(self.sinks, sink_seconds):
+            self._record(type(sink).__name__, seconds)
+        return stats.get("read", (0.0, 0))[1], kept
+
+    def _record(self, name, seconds):
+        self.seconds[name] += seconds
+        metrics.STAGE_SECONDS.inc(seconds, stage=name)
+
+    def run(self, paths, source=read_posts):
+        """ Process every file and return one report row per file. """
+        report = []
+        for path in paths:
+            before = {s.name: s.dropped for s in self.stages}
+            t0 = time.perf_counter()
+            read, kept = self.process(source(path))
+            seconds = time.perf_counter() - t0
+            row = {"file": os.path.basename(path), "read": read, "kept": kept,
+                   "posts_per_sec": round(read / seconds, 1) if seconds else 0.0}
+            row.update({s.name: s.dropped - before[s.name] for s in self.stages})
+            report.append(row)
+        return report
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dedup / language filter / hashtag count in one pass")
+    parser.add_argument("files", nargs="+", help=".json arrays or .jsonl(.gz) files")
+    parser.add_argument("--lang", default="en", help="keep this language ('' keeps all)")
+    parser.add_argument("--no-detect", action="store_true",
+                        help="drop undeclared-language posts instead of identifying them")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="language identification processes")
+    parser.add_argument("--lang-cache", default=str(LANG_CACHE),
+                        help="SQLite memo of identified texts ('' keeps it in memory only)")
+    parser.add_argument("--near-dup", type=float, nargs="?", const=THRESHOLD, metavar="THRESHOLD",
+                        help=f"drop near-duplicate texts (estimated Jaccard >= THRESHOLD, default {THRESHOLD})")
+    parser.add_argument("--near-dup-index", help="near-duplicate index (.npz) to extend and save back")
+    parser.add_argument("--hashtags", help="write normalized hashtag counts here (NFKC + casefold, no leading #; hashtag_norm.json)")
+    parser.add_argument("--hashtags-raw", help="write every raw hashtag here (hashtag_raw.json)")
+    parser.add_argument("--counts", help="save the mergeable per-month count table here (.npz)")
+    parser.add_argument("--sketch", choices=["exact", "spacesaving", "countmin"], default="exact",
+                        help="bounded-memory approximate counting for very large streams")
+    parser.add_argument("--top", type=int, default=100, help="size of the --top-out list")
+    parser.add_argument("--top-out", help="write the most frequent hashtags here (top100_hashtags.json)")
+    parser.add_argument("--out", help="write the kept posts here (.jsonl or .jsonl.gz)")
+    parser.add_argument("--metrics", help="write stage timings and counters here (.json, or .prom for Prometheus)")
+    args = parser.parse_args(argv)
+    if args.counts and args.sketch != "exact":
+        parser.error("--counts needs --sketch exact")
+
+    if args.near_dup_index and args.near_dup is None:
+        parser.error("--near-dup-index needs --near-dup")
+
+    stages = [Dedup()]
+    near_dup = None
+    if args.near_dup is not None:
+        near_dup = NearDuplicates(LSHIndex.open(args.near_dup_index, args.near_dup))
+        stages.append(near_dup)
+    identifier = None
+    if args.lang:
+        if not args.no_detect:
+            identifier = LanguageIdentifier(args.workers, cache_path=args.lang_cache or None)
+        stages.append(LanguageFilter(args.lang, identifier))
+    if args.sketch == "spacesaving":
+        table = SpaceSaving(capacity=max(10 * args.top, 1000))
+    elif args.sketch == "countmin":
+        table = CountMinSketch(k=args.top)
+    else:
+        table = HashtagCounts()
+    counter = HashtagCounter(raw_path=args.hashtags_raw, table=table)
+    sinks = [counter]
+    if args.out:
+        sinks.append(JsonlSink(args.out))
+
+    pipeline = Pipeline(stages, sinks)
+    try:
+        for row in pipeline.run(args.files):
+            dropped = ", ".join(f"{s.name} {row[s.name]}" for s in stages)
+            print(f"{row['file']}: {row['kept']} kept out of {row['read']} ({dropped}), "
+                  f"{row['posts_per_sec']} posts/sec")
+    finally:
+        pipeline.close()
+        if identifier is not None:
+            identifier.close()
+
+    if identifier is not None:
+        st = identifier.stats()
+        print(f"Language id: {st['texts']} posts, {st['detected']} detected, "
+              f"{st['cache_hits']} from cache, {st['posts_per_sec']} posts/sec")
+
+    if near_dup is not None:
+        st = near_dup.index.stats()
+        print(f"Near-duplicates: {st['duplicates']} in {st['clusters']} clusters "
+              f"({st['cross_platform']} across platforms)")
+        if args.near_dup_index:
+            near_dup.index.save(args.near_dup_index)
+
+    print("Stage time: " + ", ".join(f"{name} {sec:.2f} s" for name, sec in pipeline.seconds.items()))
+    if args.metrics:
+        if args.metrics.endswith(".prom"):
+            metrics.registry.write_prom(args.metrics)
+        else:
+            metrics.registry.write_json(args.metrics)
+
+    print(f"Total hashtags: {counter.total}")
+    if isinstance(table, HashtagCounts):
+        print(f"Unique hashtags: {len(table.vocab)}")
+    if args.hashtags:
+        counter.save(args.hashtags)
+    if args.counts:
+        table.save(args.counts)
+    if args.top_out:
+        with open(args.top_out, "w", encoding="utf-8") as f:
+            json.dump(counter.top(args.top), f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,593 @@
+"""
+Compact in-memory posts for both platforms.
+
+A Mastodon status from `json.load` is a tree of dicts: the status, its
+`account` with note, emojis and fields, `media_attachments`, `mentions`,
+`tags`, `card`... That costs kilobytes of Python objects per post, so a year
+of the 100_posts crawl does not fit in memory that way. A `PostBatch` keeps
+only the fields the analyses use, as columns:
+
+- created_at as int64 microseconds since the epoch;
+- author, declared language and hashtags as dense int ids; hashtags are
+  normalized into a common.hashtags.TagVocab, so counts and graphs share
+  their ids;
+- hashtags (as written, one id per occurrence) and the interactions of
+  common.interactions (reply, mention, repost, quote, thread) as CSR arrays;
+- keys (uri) and texts as UTF-8 blobs with offsets, decoded only when
+  `key(i)` / `text(i)` asks for one.
+
+Files are decoded straight into these columns. With msgspec installed, each
+line (or array) is decoded into typed Structs that declare only the fields
+read here; the parser skips everything else, so no dict tree is built.
+Without it, json objects are decoded one post at a time and dropped. A
+`PostBuilder` can load many files into one batch, keeping its vocabularies
+across them. `batch[i]` is a slotted `Post` view of one row.
+
+Hashtag counts, co-occurrence graphs and interaction edge lists each take a
+whole batch in one call: `HashtagCounts.add_batch`,
+`CooccurrenceGraph.add_batch` and `EdgeWriter.add_batch`.
+
+    python -m common.posts mastodon/dataset/100_posts/1_day/*.jsonl --top 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import gzip
+import json
+import time
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import scipy.sparse as sp
+
+from common.hashtags import TagVocab
+from common.interactions import BSKY_MENTION, BSKY_REPOST, MENTION, QUOTE, REPLY, REPOST, THREAD, _did
+from common.langid import strip_html
+from common.pipeline import read_json_array
+from common.store import BSKY_TAG, _ts, detect_platform
+
+try:
+    import msgspec
+except ImportError:      # json objects, decoded one post at a time
+    msgspec = None
+
+PLATFORMS = ("bluesky", "mastodon")
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_US = dt.timedelta(microseconds=1)
+
+
+class _Doc(dict):
+    """ json object with attribute access, so the field extraction below reads
+    msgspec Structs and plain json alike (a missing field is None). """
+
+    __getattr__ = dict.get
+
+    @classmethod
+    def hook(cls, obj):
+        doc = cls(obj)
+        if "$type" in doc:
+            doc["type_"] = doc["$type"]
+        return doc
+
+
+# -- typed schemas (msgspec) ---------------------------------------------------
+
+if msgspec is not None:
+    _Id = Union[str, int, None]
+
+    class _Account(msgspec.Struct):
+        id: _Id = None
+        acct: Optional[str] = None
+
+    class _Tag(msgspec.Struct):
+        name: Optional[str] = None
+
+    class _Embedded(msgspec.Struct):             # reblog, quote.quoted_status
+        account: Optional[_Account] = None
+
+    class _Quote(msgspec.Struct):
+        quoted_status: Optional[_Embedded] = None
+
+    class _Status(msgspec.Struct):
+        id: _Id = None
+        uri: Optional[str] = None
+        created_at: Optional[str] = None
+        language: Optional[str] = None
+        content: Optional[str] = None
+        account: Optional[_Account] = None
+        in_reply_to_account_id: _Id = None
+        mentions: Optional[list[_Account]] = None
+        tags: Optional[list[_Tag]] = None
+        reblog: Optional[_Embedded] = None
+        quote: Optional[_Quote] = None
+
+    class _Author(msgspec.Struct):
+        did: Optional[str] = None
+        handle: Optional[str] = None
+
+    class _Feature(msgspec.Struct, rename={"type_": "$type"}):
+        type_: Optional[str] = None
+        tag: Optional[str] = None
+        did: Optional[str] = None
+
+    class _Facet(msgspec.Struct):
+        features: Optional[list[_Feature]] = None
+
+    class _Ref(msgspec.Struct):
+        uri: Optional[str] = None
+
+    class _Reply(msgspec.Struct):
+        parent: Optional[_Ref] = None
+        root: Optional[_Ref] = None
+
+    class _EmbedRecord(msgspec.Struct):
+        uri: Optional[str] = None
+        record: Optional[_Ref] = None
+
+    class _Embed(msgspec.Struct, rename={"type_": "$type"}):
+        type_: Optional[str] = None
+        record: Optional[_EmbedRecord] = None
+
+    class _Record(msgspec.Struct):
+        text: Optional[str] = None
+        createdAt: Optional[str] = None
+        langs: Optional[list[str]] = None
+        facets: Optional[list[_Facet]] = None
+        reply: Optional[_Reply] = None
+        embed: Optional[_Embed] = None
+
+    class _Reason(msgspec.Struct, rename={"type_": "$type"}):
+        type_: Optional[str] = None
+        by: Optional[_Author] = None
+
+    class _PostView(msgspec.Struct):
+        uri: Optional[str] = None
+        indexedAt: Optional[str] = None
+        author: Optional[_Author] = None
+        record: Optional[_Record] = None
+        reason: Optional[_Reason] = None
+
+    _SCHEMAS = {"mastodon": _Status, "bluesky": _PostView}
+    _DECODERS = {p: msgspec.json.Decoder(t) for p, t in _SCHEMAS.items()}
+    _ARRAY_DECODERS = {p: msgspec.json.Decoder(list[t]) for p, t in _SCHEMAS.items()}
+
+
+# -- field extraction (Structs or _Doc) ----------------------------------------
+
+def _mastodon_fields(s):
+    """ (key, created, author, handle, lang, text, tags, edges) of a status;
+    edges are (src, src_handle, dst, dst_handle, kind), keys as in
+    common.interactions ("mastodon:<id>"). """
+    account = s.account
+    author = handle = None
+    edges = []
+    if account is not None and account.id is not None:
+        author, handle = f"mastodon:{account.id}", account.acct
+        if s.in_reply_to_account_id:
+            edges.append((author, handle, f"mastodon:{s.in_reply_to_account_id}", None, REPLY))
+        for mention in s.mentions or ():
+            if mention.id is not None:
+                edges.append((author, handle, f"mastodon:{mention.id}", mention.acct, MENTION))
+        reblogged = s.reblog.account if s.reblog else None
+        if reblogged and reblogged.id is not None:
+            edges.append((author, handle, f"mastodon:{reblogged.id}", reblogged.acct, REPOST))
+        quoted = s.quote.quoted_status if s.quote else None
+        if quoted and quoted.account and quoted.account.id is not None:
+            edges.append((author, handle, f"mastodon:{quoted.account.id}", quoted.account.acct, QUOTE))
+    tags = [t.name for t in s.tags or () if t.name]
+    return s.uri or (str(s.id) if s.id is not None else None), s.created_at, author, handle, \
+        s.language, s.content, tags, edges
+
+
+def _bluesky_fields(p):
+    """ Same as _mastodon_fields for a Bluesky PostView; keys are dids. """
+    record = p.record or _Doc()
+    author = p.author.did if p.author else None
+    handle = p.author.handle if p.author else None
+    tags, edges = [], []
+    for facet in record.facets or ():
+        for feature in facet.features or ():
+            if feature.type_ == BSKY_TAG and feature.tag:
+                tags.append(feature.tag)
+            elif author and feature.type_ == BSKY_MENTION and feature.did:
+                edges.append((author, handle, feature.did, None, MENTION))
+    if author:
+        reply = record.reply
+        parent = _did(reply.parent.uri) if reply and reply.parent else None
+        root = _did(reply.root.uri) if reply and reply.root else None
+        if parent:
+            edges.append((author, handle, parent, None, REPLY))
+        if root and root != parent:
+            edges.append((author, handle, root, None, THREAD))
+        embed, quoted = record.embed, None
+        if embed and embed.record:
+            if embed.type_ == "app.bsky.embed.record":
+                quoted = embed.record.uri
+            elif embed.type_ == "app.bsky.embed.recordWithMedia" and embed.record.record:
+                quoted = embed.record.record.uri
+        if _did(quoted):
+            edges.append((author, handle, _did(quoted), None, QUOTE))
+        reason = p.reason
+        if reason and reason.type_ == BSKY_REPOST and reason.by and reason.by.did:
+            edges.append((reason.by.did, reason.by.handle, author, handle, REPOST))
+    langs = record.langs or ()
+    return p.uri, record.createdAt or p.indexedAt, author, handle, \
+        langs[0] if langs else None, record.text, tags, edges
+
+
+_FIELDS = {"mastodon": _mastodon_fields, "bluesky": _bluesky_fields}
+
+
+def _epoch_us(value) -> int:
+    """ Microseconds since the epoch of an API timestamp, 0 when unknown. """
+    when = _ts(value)
+    return 0 if when is None else (when - _EPOCH) // _US
+
+
+# -- columns -------------------------------------------------------------------
+
+class Interner:
+    """ String <-> dense integer id (accounts, languages). """
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.keys: list[str] = []
+
+    def intern(self, key) -> int:
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return i
+
+    def get(self, key):
+        return self.ids.get(key)
+
+    def __getitem__(self, i) -> str:
+        return self.keys[i]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def _take_ragged(data, offsets, rows):
+    """ (data, offsets) of the rows `rows` of a ragged array. """
+    starts, ends = offsets[rows], offsets[rows + 1]
+    lens = ends - starts
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lens, out=new_offsets[1:])
+    idx = np.repeat(starts - new_offsets[:-1], lens) + np.arange(new_offsets[-1])
+    return data[idx], new_offsets
+
+
+class Post:
+    """ One row of a PostBatch. """
+
+    __slots__ = ("batch", "i")
+
+    def __init__(self, batch, i):
+        self.batch = batch
+        self.i = i
+
+    @property
+    def platform(self) -> str:
+        return PLATFORMS[self.batch.platform[self.i]]
+
+    @property
+    def key(self) -> str:
+        return self.batch.key(self.i)
+
+    @property
+    def created_at(self) -> dt.datetime:
+        return _EPOCH + int(self.batch.created[self.i]) * _US
+
+    @property
+    def author(self):
+        a = self.batch.author[self.i]
+        return None if a < 0 else self.batch.accounts[a]
+
+    @property
+    def language(self):
+        lang = self.batch.lang[self.i]
+        return None if lang < 0 else self.batch.languages[lang]
+
+    @property
+    def tags(self) -> list[str]:
+        return self.batch.tags_of(self.i)
+
+    @property
+    def text(self) -> str:
+        return self.batch.text(self.i)
+
+    def __repr__(self):
+        return f"Post({self.platform}, {self.key!r}, {self.created_at.isoformat()})"
+
+
+class PostBatch:
+    """ Struct-of-arrays posts; build with PostBuilder or load_batch(). """
+
+    def __init__(self, columns, tags, accounts, languages, handles):
+        self.platform = columns["platform"]          # uint8, index into PLATFORMS
+        self.created = columns["created"]            # int64 us since the epoch (0: unknown)
+        self.author = columns["author"]              # int32 into accounts (-1: none)
+        self.lang = columns["lang"]                  # int16 into languages (-1: none)
+        self.tag_ids = columns["tag_ids"]            # int32 into tags, CSR by tag_offsets
+        self.tag_offsets = columns["tag_offsets"]
+        self.edge_post = columns["edge_post"]        # int64 row of the post an edge comes from
+        self.edge_src = columns["edge_src"]          # int32 into accounts
+        self.edge_dst = columns["edge_dst"]
+        self.edge_kind = columns["edge_kind"]        # uint8, common.interactions kinds
+        self.key_blob = columns["key_blob"]
+        self.key_offsets = columns["key_offsets"]
+        self.text_blob = columns["text_blob"]
+        self.text_offsets = columns["text_offsets"]
+        self.tags: TagVocab = tags
+        self.accounts: Interner = accounts
+        self.languages: Interner = languages
+        self.handles: dict[int, str] = handles
+
+    def _columns(self) -> dict:
+        return {name: getattr(self, name) for name in (
+            "platform", "created", "author", "lang", "tag_ids", "tag_offsets", "edge_post", "edge_src",
+            "edge_dst", "edge_kind", "key_blob", "key_offsets", "text_blob", "text_offsets")}
+
+    def __len__(self):
+        return len(self.created)
+
+    def __getitem__(self, i) -> Post:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return Post(self, i % len(self))
+
+    def __iter__(self):
+        return (Post(self, i) for i in range(len(self)))
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory held by the columns (vocabularies not included). """
+        return sum(col.nbytes for col in self._columns().values())
+
+    # -- rows ----------------------------------------------------------------
+
+    def key(self, i) -> str:
+        return self.key_blob[self.key_offsets[i]:self.key_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def text(self, i, plain=False) -> str:
+        """ Text as stored (Mastodon: HTML); `plain` strips the markup. """
+        text = self.text_blob[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode("utf-8")
+        return strip_html(text) if plain and self.platform[i] == PLATFORMS.index("mastodon") else text
+
+    def texts(self, rows=None, plain=False):
+        """ Texts of `rows` (all by default), decoded one at a time. """
+        for i in range(len(self)) if rows is None else rows:
+            yield self.text(int(i), plain)
+
+    def tags_of(self, i) -> list[str]:
+        return [self.tags[t] for t in self.tag_ids[self.tag_offsets[i]:self.tag_offsets[i + 1]]]
+
+    # -- columns -------------------------------------------------------------
+
+    def tag_posts(self) -> np.ndarray:
+        """ Row of every entry of tag_ids. """
+        return np.repeat(np.arange(len(self)), np.diff(self.tag_offsets))
+
+    def months(self) -> np.ndarray:
+        """ "YYYY-MM" (UTC) of every post. """
+        return np.datetime_as_string(self.created.astype("datetime64[us]").astype("datetime64[M]"))
+
+    def hashtag_counts(self) -> np.ndarray:
+        """ Occurrences per tag id. """
+        return np.bincount(self.tag_ids, minlength=len(self.tags))
+
+    def language_counts(self) -> Counter:
+        """ Declared language -> posts (None: undeclared). """
+        counts = np.bincount(self.lang + 1, minlength=len(self.languages) + 1)
+        out = Counter({self.languages[i]: int(n) for i, n in enumerate(counts[1:]) if n})
+        if counts[0]:
+            out[None] = int(counts[0])
+        return out
+
+    def language_mask(self, lang) -> np.ndarray:
+        i = self.languages.get(lang)
+        return np.zeros(len(self), dtype=bool) if i is None else self.lang == i
+
+    def incidence(self) -> sp.csr_matrix:
+        """ Binary posts x tags matrix (a tag repeated within a post counts once). """
+        b = sp.csr_matrix((np.ones(len(self.tag_ids), dtype=np.int64), self.tag_ids, self.tag_offsets),
+                          shape=(len(self), len(self.tags)))
+        b.sum_duplicates()
+        b.data[:] = 1
+        return b
+
+    def select(self, rows) -> PostBatch:
+        """ The posts `rows` (indices or a boolean mask), same vocabularies. """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = rows.astype(np.int64)
+        cols = {name: getattr(self, name)[rows] for name in ("platform", "created", "author", "lang")}
+        cols["tag_ids"], cols["tag_offsets"] = _take_ragged(self.tag_ids, self.tag_offsets, rows)
+        cols["key_blob"], cols["key_offsets"] = _take_ragged(self.key_blob, self.key_offsets, rows)
+        cols["text_blob"], cols["text_offsets"] = _take_ragged(self.text_blob, self.text_offsets, rows)
+        new_row = np.full(len(self), -1, dtype=np.int64)
+        new_row[rows] = np.arange(len(rows))
+        # edges of the kept posts (of the first copy, if a row is taken twice)
+        keep = np.flatnonzero(new_row[self.edge_post] >= 0)
+        cols["edge_post"] = new_row[self.edge_post[keep]]
+        for name in ("edge_src", "edge_dst", "edge_kind"):
+            cols[name] = getattr(self, name)[keep]
+        return PostBatch(cols, self.tags, self.accounts, self.languages, self.handles)
+
+
+class PostBuilder:
+    """ Growable columns that decoded posts are appended to; build() freezes
+    them into a PostBatch. The vocabularies are kept across build() calls,
+    so batches of one builder share their ids. """
+
+    def __init__(self, tags: TagVocab | None = None, text=True):
+        self.tags = tags or TagVocab()
+        self.accounts = Interner()
+        self.languages = Interner()
+        self.handles: dict[int, str] = {}
+        self.keep_text = text
+        self._reset()
+
+    def _reset(self):
+        self._platform = array("B")
+        self._created = array("q")
+        self._author = array("i")
+        self._lang = array("h")
+        self._tag_ids = array("i")
+        self._tag_ends = array("q", [0])
+        self._edges = {"post": array("q"), "src": array("i"), "dst": array("i"), "kind": array("B")}
+        self._keys = bytearray()
+        self._key_ends = array("q", [0])
+        self._texts = bytearray()
+        self._text_ends = array("q", [0])
+
+    def __len__(self):
+        return len(self._created)
+
+    def _account(self, key, handle) -> int:
+        i = self.accounts.intern(key)
+        if handle and i not in self.handles:
+            self.handles[i] = handle
+        return i
+
+    def add(self, platform, fields):
+        """ Append one post given as (key, created, author, handle, lang, text, tags, edges). """
+        key, created, author, handle, lang, text, tags, edges = fields
+        row = len(self._created)
+        self._platform.append(PLATFORMS.index(platform))
+        self._created.append(_epoch_us(created))
+        self._author.append(self._account(author, handle) if author else -1)
+        self._lang.append(self.languages.intern(lang) if lang else -1)
+        self._tag_ids.extend(self.tags.intern(t) for t in tags)
+        self._tag_ends.append(len(self._tag_ids))
+        for src, src_handle, dst, dst_handle, kind in edges:
+            self._edges["post"].append(row)
+            self._edges["src"].append(self._account(src, src_handle))
+            self._edges["dst"].append(self._account(dst, dst_handle))
+            self._edges["kind"].append(kind)
+        self._keys += (key or "").encode("utf-8")
+        self._key_ends.append(len(self._keys))
+        if self.keep_text and text:
+            self._texts += text.encode("utf-8")
+        self._text_ends.append(len(self._texts))
+
+    def add_doc(self, platform, doc):
+        """ Append a decoded status / PostView (msgspec Struct or _Doc). """
+        self.add(platform, _FIELDS[platform](doc))
+
+    def add_file(self, path, platform=None) -> int:
+        """ Append the posts of a `.json` array or `.jsonl` / `.jsonl.gz` file.
+        Returns the number of posts added. """
+        path = Path(path)
+        platform = platform or sniff_platform(path)
+        before = len(self)
+        if path.name.endswith(".jsonl") or path.name.endswith(".jsonl.gz"):
+            opener = gzip.open if path.suffix == ".gz" else open
+            with opener(path, "rb") as fh:
+                for line in fh:
+                    if line.strip():
+                        self.add_doc(platform, _decode(platform, line))
+            return len(self) - before
+        if msgspec is not None:
+            try:
+                docs = _ARRAY_DECODERS[platform].decode(path.read_bytes())
+            except msgspec.ValidationError:
+                docs = None      # a field of an unexpected type: json objects instead
+            if docs is not None:
+                for doc in docs:
+                    self.add_doc(platform, doc)
+                return len(self) - before
+        for doc in read_json_array(path, object_hook=_Doc.hook):
+            self.add_doc(platform, doc)
+        return len(self) - before
+
+    def build(self) -> PostBatch:
+        """ The posts appended since the last build(), as a PostBatch. """
+        cols = {
+            "platform": np.frombuffer(self._platform, dtype=np.uint8).copy(),
+            "created": np.frombuffer(self._created, dtype=np.int64).copy(),
+            "author": np.frombuffer(self._author, dtype=np.int32).copy(),
+            "lang": np.frombuffer(self._lang, dtype=np.int16).copy(),
+            "tag_ids": np.frombuffer(self._tag_ids, dtype=np.int32).copy(),
+            "tag_offsets": np.frombuffer(self._tag_ends, dtype=np.int64).copy(),
+            "edge_post": np.frombuffer(self._edges["post"], dtype=np.int64).copy(),
+            "edge_src": np.frombuffer(self._edges["src"], dtype=np.int32).copy(),
+            "edge_dst": np.frombuffer(self._edges["dst"], dtype=np.int32).copy(),
+            "edge_kind": np.frombuffer(self._edges["kind"], dtype=np.uint8).copy(),
+            "key_blob": np.frombuffer(bytes(self._keys), dtype=np.uint8),
+            "key_offsets": np.frombuffer(self._key_ends, dtype=np.int64).copy(),
+            "text_blob": np.frombuffer(bytes(self._texts), dtype=np.uint8),
+            "text_offsets": np.frombuffer(self._text_ends, dtype=np.int64).copy(),
+        }
+        self._reset()
+        return PostBatch(cols, self.tags, self.accounts, self.languages, self.handles)
+
+
+def _decode(platform, data):
+    """ One JSON document as a Struct, or a _Doc without msgspec (or when a
+    field has an unexpected type). """
+    if msgspec is not None:
+        try:
+            return _DECODERS[platform].decode(data)
+        except msgspec.ValidationError:
+            pass
+    return json.loads(data, object_hook=_Doc.hook)
+
+
+def sniff_platform(path) -> str:
+    """ Platform of a file: from its path (bluesky/... or mastodon/...), else
+    from its first post. """
+    path = Path(path)
+    for platform in PLATFORMS:
+        if platform in path.parts:
+            return platform
+    if path.name.endswith(".jsonl") or path.name.endswith(".jsonl.gz"):
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8") as fh:
+            first = next((line for line in fh if line.strip()), None)
+        return detect_platform(json.loads(first)) if first else "mastodon"
+    first = next(iter(read_json_array(path)), None)
+    return detect_platform(first) if first is not None else "mastodon"
+
+
+def load_batch(paths, platform=None, tags: TagVocab | None = None, text=True) -> PostBatch:
+    """ All posts of `paths` as one PostBatch. """
+    builder = PostBuilder(tags, text=text)
+    for path in paths:
+        builder.add_file(path, platform)
+    return builder.build()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load downloaded posts into a compact PostBatch")
+    parser.add_argument("paths", nargs="+", help=".json arrays or .jsonl / .jsonl.gz logs")
+    parser.add_argument("--platform", choices=PLATFORMS, help="default: from the path or the first post")
+    parser.add_argument("--no-text", action="store_true", help="do not keep the texts")
+    parser.add_argument("--top", type=int, default=20, help="hashtags to print")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    batch = load_batch(args.paths, args.platform, text=not args.no_text)
+    seconds = time.perf_counter() - t0
+    print(f"{len(batch)} posts in {seconds:.2f}s ({len(batch) / max(seconds, 1e-9):.0f}/s, "
+          f"{'msgspec' if msgspec is not None else 'json'}), "
+          f"{batch.nbytes / max(len(batch), 1):.0f} bytes/post in columns")
+    print(f"{len(batch.accounts)} accounts, {len(batch.tags)} hashtags, {len(batch.edge_post)} interactions")
+    print("languages:", ", ".join(f"{lang}={n}" for lang, n in batch.language_counts().most_common(10)))
+    counts = batch.hashtag_counts()
+    for i in np.argsort(-counts, kind="stable")[:args.top]:
+        if counts[i]:
+            print(f"{int(counts[i]):8d}  {batch.tags[int(i)]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Proactive, header-driven rate limiting shared by every worker of a process.
+
+Both platforms advertise their quota on every response:
+
+- Bluesky:  ratelimit-limit / ratelimit-remaining / ratelimit-reset (unix
+            seconds) / ratelimit-policy ("3000;w=300")
+- Mastodon: X-RateLimit-Limit / X-RateLimit-Remaining / X-RateLimit-Reset
+            (ISO 8601)
+
+Each (host, endpoint) gets a token bucket synced from those headers: the
+bucket holds what the server says is left, minus our own requests still in
+flight, and is refilled to the advertised limit at the advertised reset.
+Workers take a token *before* sending, so a crawl runs right at the quota
+instead of finding out through 429s. State is plain memory guarded by a
+threading lock, so threads and asyncio tasks of the same process share it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import email.utils
+import threading
+import time
+from urllib.parse import urlsplit
+
+from common import metrics
+
+DEFAULT_WAIT = 5       # seconds, when a 429 carries no usable header
+UNKNOWN_RESET = 1      # seconds between retries when empty and the reset is unknown
+
+
+def _header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def _parse_reset(value):
+    """ Unix seconds (Bluesky) or ISO 8601 (Mastodon) to unix seconds. """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return dt.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _parse_retry_after(value, now):
+    """ Retry-After is either delta seconds or an HTTP date. """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return now + int(value)
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_window(policy):
+    """ "3000;w=300" -> 300.0 """
+    if not policy:
+        return None
+    for part in policy.split(";")[1:]:
+        key, _, val = part.strip().partition("=")
+        if key == "w":
+            try:
+                return float(val)
+            except ValueError:
+                return None
+    return None
+
+
+def bucket_key(url):
+    """ XRPC endpoints are limited per method, Mastodon applies one per-account
+    quota to the whole REST API, so it gets a single bucket per host. """
+    parts = urlsplit(str(url))
+    path = parts.path
+    if path.startswith("/xrpc/"):
+        return parts.netloc, path
+    return parts.netloc, "/".join(path.split("/")[:3])   # "/api/v1"
+
+
+class TokenBucket:
+    """ One server-side quota as seen from this process. """
+
+    def __init__(self):
+        self.limit: int | None = None
+        self.tokens: float | None = None     # None: no headers seen yet, don't wait
+        self.reset_at: float | None = None
+        self.window: float | None = None
+        self.in_flight = 0
+        self.waited = 0.0                    # cumulative seconds spent waiting
+        self._lock = threading.Lock()
+
+    def _roll(self, now):
+        if self.reset_at is not None and now >= self.reset_at:
+            self.tokens = self.limit
+            self.reset_at = self.reset_at + self.window if self.window else None
+
+    def try_take(self, now=None):
+        """ Take a token and return 0, or return how long to wait before trying again. """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._roll(now)
+            if self.tokens is None or self.tokens >= 1:
+                if self.tokens is not None:
+                    self.tokens -= 1
+                self.in_flight += 1
+                return 0.0
+            if self.reset_at is None:
+                return UNKNOWN_RESET
+            return max(self.reset_at - now, 0.01)
+
+    def update(self, headers, status=200, now=None):
+        """ Sync the bucket with a response (one of ours, now answered). """
+        now = time.time() if now is None else now
+        limit = _header(headers, "ratelimit-limit", "x-ratelimit-limit")
+        remaining = _header(headers, "ratelimit-remaining", "x-ratelimit-remaining")
+        reset = _parse_reset(_header(headers, "ratelimit-reset", "x-ratelimit-reset"))
+        window = _parse_window(headers.get("ratelimit-policy"))
+
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if limit is not None and limit.isdigit():
+                self.limit = int(limit)
+            if window:
+                self.window = window
+
+            if status == 429:
+                retry = _parse_retry_after(headers.get("Retry-After"), now)
+                self.tokens = 0
+                self.reset_at = retry or reset or now + DEFAULT_WAIT
+                return
+
+            if remaining is None or not remaining.isdigit():
+                return
+            left = int(remaining) - self.in_flight
+            if reset is None:
+                self.tokens = left if self.tokens is None else min(self.tokens, left)
+            elif self.reset_at is None or reset > self.reset_at + 1:
+                # first response or a new window
+                self.tokens, self.reset_at = left, reset
+            elif reset >= self.reset_at - 1:
+                # same window: responses arrive out of order, keep the lowest count
+                self.tokens = left if self.tokens is None else min(self.tokens, left)
+            # else: late response from an earlier window, nothing to learn
+
+    def release(self):
+        """ A request that never got a response (network error). """
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+
+class RateLimiter:
+    """ Registry of buckets by (host, endpoint). """
+
+    def __init__(self):
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url) -> TokenBucket:
+        key = bucket_key(url)
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket()
+            return self._buckets[key]
+
+    def acquire(self, url):
+        """ Blocking wait for a token (threads / sync scripts). """
+        bucket = self.bucket(url)
+        while True:
+            wait = bucket.try_take()
+            if wait <= 0:
+                return
+            bucket.waited += wait
+            metrics.BACKOFF_SECONDS.inc(wait, reason="ratelimit")
+            time.sleep(wait)
+
+    async def aacquire(self, url):
+        """ Same as acquire() for asyncio tasks. """
+        bucket = self.bucket(url)
+        while True:
+            wait = bucket.try_take()
+            if wait <= 0:
+                return
+            bucket.waited += wait
+            metrics.BACKOFF_SECONDS.inc(wait, reason="ratelimit")
+            await asyncio.sleep(wait)
+
+    def update(self, url, headers, status=200):
+        self.bucket(url).update(headers, status)
+
+    def release(self, url):
+        self.bucket(url).release()
+
+    def snapshot(self):
+        """ {"host endpoint": {...}} for logging. """
+        return {
+            f"{host} {endpoint}": {"limit": b.limit, "tokens": b.tokens, "reset_at": b.reset_at,
+                                   "in_flight": b.in_flight, "waited": round(b.waited, 3)}
+            for (host, endpoint), b in self._buckets.items()
+        }
+
+
+# process-wide limiter: every engine, session and thread goes through it
+limiter = RateLimiter()
@@ -0,0 +1,84 @@
+"""
+Seeded reservoir sampling for the downloaders.
+
+Instead of spending one rate-limited request per saved post (limit=1 on
+random time probes), the downloaders pull full pages for a time window and
+keep a uniform random sample of k posts with `Reservoir`. The sampler is
+Vitter/Li's Algorithm L: O(k) memory, one pass, and it only draws random
+numbers for the items it keeps, so the page size does not matter. Seeds
+come from `window_seed`, so the same (seed, platform, query, day) always
+yields the same sample regardless of the order days are crawled in.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import random
+from pathlib import Path
+
+
+def window_seed(seed, *parts) -> int:
+    """ Stable 64-bit seed for one sampling window, e.g. (42, "bluesky", "climatechange", day). """
+    text = "\x1f".join(str(p) for p in (seed, *parts))
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+class Reservoir:
+    """ Uniform sample of k items from a stream of unknown length (Algorithm L). """
+
+    def __init__(self, k, seed=None):
+        self.k = k
+        self.rng = random.Random(seed)
+        self.count = 0                          # items offered so far
+        self._sample: list[tuple[int, object]] = []
+        self._w = 1.0
+        self._next = 0
+
+    def _u(self):
+        """ Uniform draw in (0, 1), log-safe. """
+        u = self.rng.random()
+        while u == 0.0:
+            u = self.rng.random()
+        return u
+
+    def _skip(self):
+        self._w *= math.exp(math.log(self._u()) / self.k)
+        self._next += math.floor(math.log(self._u()) / math.log1p(-self._w)) + 1
+
+    def offer(self, item):
+        index = self.count
+        self.count += 1
+        if self.k <= 0:
+            return
+        if len(self._sample) < self.k:
+            self._sample.append((index, item))
+            if len(self._sample) == self.k:
+                self._next = index
+                self._skip()
+            return
+        if index == self._next:
+            self._sample[self.rng.randrange(self.k)] = (index, item)
+            self._skip()
+
+    def extend(self, items):
+        for item in items:
+            self.offer(item)
+        return self
+
+    def result(self) -> list:
+        """ The sample, in stream order. """
+        return [item for _, item in sorted(self._sample, key=lambda p: p[0])]
+
+    def __len__(self):
+        return len(self._sample)
+
+
+def sample_lines(path, k, seed=None) -> list[str]:
+    """ Reservoir over the non-empty lines of a (JSONL) file, constant memory in k. """
+    reservoir = Reservoir(k, seed)
+    with Path(path).open("r", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                reservoir.offer(line)
+    return reservoir.result()
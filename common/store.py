@@ -0,0 +1,323 @@
+"""
+Columnar post store shared by both platforms.
+
+The monthly JSON arrays repeat the whole author object (Mastodon `account`
+with its HTML note, emojis and fields; Bluesky `author`) in every post and
+have to be `json.load`-ed in full for every notebook pass. `PostStore`
+keeps one collection (e.g. "100_posts", "random") as Parquet instead:
+
+    <root>/posts/platform=<p>/month=<YYYY-MM>/part-0.parquet
+    <root>/accounts/platform=<p>/part-0.parquet
+
+Posts are normalized into one typed schema (`POST_SCHEMA`) with the author
+reduced to `author_id`; authors go to the accounts table, one row per
+(platform, id). Reads go through pyarrow.dataset, so `columns=` only
+decodes the requested columns and `filters=` (pyarrow DNF tuples, e.g.
+[("language", "=", "en")], or a pyarrow.dataset expression) prunes whole
+platform/month directories and row groups before anything is loaded.
+
+    python -m common.store import mastodon ./dataset/store/random mastodon/dataset/random/*.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from common.sampling import sample_lines
+
+STORE_ROOT = Path("./dataset/store")
+COMPRESSION = "zstd"
+ROW_GROUP_SIZE = 64_000
+
+BSKY_TAG = "app.bsky.richtext.facet#tag"
+
+_TS = pa.timestamp("us", tz="UTC")
+
+POST_SCHEMA = pa.schema([
+    ("id", pa.string()),                 # Mastodon status id, Bluesky at:// uri
+    ("uri", pa.string()),
+    ("url", pa.string()),
+    ("created_at", _TS),
+    ("author_id", pa.string()),          # Mastodon account id, Bluesky did
+    ("language", pa.string()),           # declared language (Bluesky: first of langs)
+    ("langs", pa.list_(pa.string())),
+    ("text", pa.string()),               # Mastodon: HTML content, Bluesky: plain text
+    ("tags", pa.list_(pa.string())),     # hashtags as written, not normalized
+    ("reply_to", pa.string()),
+    ("reply_count", pa.int64()),
+    ("repost_count", pa.int64()),
+    ("like_count", pa.int64()),
+    ("quote_count", pa.int64()),
+])
+
+ACCOUNT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("handle", pa.string()),             # Mastodon acct, Bluesky handle
+    ("display_name", pa.string()),
+    ("created_at", _TS),
+    ("followers_count", pa.int64()),
+    ("following_count", pa.int64()),
+    ("statuses_count", pa.int64()),
+    ("bot", pa.bool_()),
+    ("note", pa.string()),
+])
+
+
+def _ts(value):
+    """ API timestamps ("...Z", "+00:00", or str(datetime) from the logs) to aware datetimes. """
+    if value is None or isinstance(value, dt.datetime):
+        return value
+    try:
+        when = dt.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return when if when.tzinfo else when.replace(tzinfo=dt.timezone.utc)
+
+
+def _int(value):
+    return int(value) if value is not None else None
+
+
+def detect_platform(post) -> str:
+    return "bluesky" if "record" in post else "mastodon"
+
+
+def normalize_mastodon(status):
+    """ (post row, account row) of a Mastodon status dict. """
+    account = status.get("account") or {}
+    langs = [status["language"]] if status.get("language") else []
+    post = {
+        "id": str(status.get("id")),
+        "uri": status.get("uri"),
+        "url": status.get("url"),
+        "created_at": _ts(status.get("created_at")),
+        "author_id": str(account["id"]) if account.get("id") is not None else None,
+        "language": status.get("language"),
+        "langs": langs,
+        "text": status.get("content"),
+        "tags": [t["name"] for t in status.get("tags") or [] if "name" in t],
+        "reply_to": str(status["in_reply_to_id"]) if status.get("in_reply_to_id") else None,
+        "reply_count": _int(status.get("replies_count")),
+        "repost_count": _int(status.get("reblogs_count")),
+        "like_count": _int(status.get("favourites_count")),
+        "quote_count": None,
+    }
+    author = None
+    if account.get("id") is not None:
+        author = {
+            "id": str(account["id"]),
+            "handle": account.get("acct"),
+            "display_name": account.get("display_name"),
+            "created_at": _ts(account.get("created_at")),
+            "followers_count": _int(account.get("followers_count")),
+            "following_count": _int(account.get("following_count")),
+            "statuses_count": _int(account.get("statuses_count")),
+            "bot": account.get("bot"),
+            "note": account.get("note"),
+        }
+    return post, author
+
+
+def normalize_bluesky(item):
+    """ (post row, account row) of a Bluesky PostView dict (searchPosts). """
+    record = item.get("record") or {}
+    author = item.get("author") or {}
+    langs = record.get("langs") or []
+    tags = [
+        feature["tag"]
+        for facet in record.get("facets") or []
+        for feature in facet.get("features", [])
+        if feature.get("$type") == BSKY_TAG
+    ]
+    parent = (record.get("reply") or {}).get("parent") or {}
+    post = {
+        "id": item.get("uri"),
+        "uri": item.get("uri"),
+        "url": None,
+        "created_at": _ts(record.get("createdAt") or item.get("indexedAt")),
+        "author_id": author.get("did"),
+        "language": langs[0] if langs else None,
+        "langs": langs,
+        "text": record.get("text"),
+        "tags": tags,
+        "reply_to": parent.get("uri"),
+        "reply_count": _int(item.get("replyCount")),
+        "repost_count": _int(item.get("repostCount")),
+        "like_count": _int(item.get("likeCount")),
+        "quote_count": _int(item.get("quoteCount")),
+    }
+    account = None
+    if author.get("did"):
+        account = {
+            "id": author["did"],
+            "handle": author.get("handle"),
+            "display_name": author.get("displayName"),
+            "created_at": _ts(author.get("createdAt")),
+            "followers_count": _int(author.get("followersCount")),
+            "following_count": _int(author.get("followsCount")),
+            "statuses_count": _int(author.get("postsCount")),
+            "bot": None,
+            "note": author.get("description"),
+        }
+    return post, account
+
+
+def normalize(post, platform=None):
+    platform = platform or detect_platform(post)
+    if platform == "bluesky":
+        return normalize_bluesky(post)
+    return normalize_mastodon(post)
+
+
+def _write_table(table, path):
+    """ Parquet write to a temporary file + rename, like write_json_array. """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # dot-prefixed: dataset discovery skips a temporary file left by a crash
+    tmp = path.with_name("." + path.name + ".tmp")
+    pq.write_table(table, tmp, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp, path)
+
+
+class PostStore:
+    """ One collection of posts, partitioned by platform and month. """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def month_file(self, platform, month):
+        """ Parquet file of one month partition (what a build cache hashes). """
+        return self.root / "posts" / f"platform={platform}" / f"month={month}" / "part-0.parquet"
+
+    def _accounts_file(self, platform):
+        return self.root / "accounts" / f"platform={platform}" / "part-0.parquet"
+
+    # -- writing -----------------------------------------------------------
+
+    def write_month(self, platform, month, posts):
+        """ Normalize and write one month, replacing what the partition held.
+        Returns the number of posts written. """
+        rows, accounts, ids = [], {}, set()
+        for raw in posts:
+            post, account = normalize(raw, platform)
+            if post["id"] is None or post["id"] in ids:
+                continue
+            ids.add(post["id"])
+            rows.append(post)
+            if account is not None:
+                accounts[account["id"]] = account
+        _write_table(pa.Table.from_pylist(rows, schema=POST_SCHEMA), self.month_file(platform, month))
+        self._merge_accounts(platform, accounts)
+        return len(rows)
+
+    def write_log(self, platform, month, log_path, k=None, seed=None):
+        """ Render a downloader JSONL log as one month partition, optionally as
+        a seeded sample of k posts (same draw as write_json_array). """
+        if k is None:
+            with open(log_path, "r", encoding="utf-8") as fh:
+                return self.write_month(platform, month, (json.loads(l) for l in fh if l.strip()))
+        return self.write_month(platform, month, (json.loads(l) for l in sample_lines(log_path, k, seed)))
+
+    def _merge_accounts(self, platform, accounts):
+        """ Upsert into the per-platform accounts table, newest row wins. """
+        if not accounts:
+            return
+        path = self._accounts_file(platform)
+        if path.exists():
+            old = pq.read_table(path)
+            keep = [i for i, acc_id in enumerate(old.column("id").to_pylist()) if acc_id not in accounts]
+            table = pa.concat_tables([
+                old.take(pa.array(keep, pa.int64())).cast(ACCOUNT_SCHEMA),
+                pa.Table.from_pylist(list(accounts.values()), schema=ACCOUNT_SCHEMA),
+            ])
+        else:
+            table = pa.Table.from_pylist(list(accounts.values()), schema=ACCOUNT_SCHEMA)
+        _write_table(table, path)
+
+    # -- reading -----------------------------------------------------------
+
+    def _dataset(self, table):
+        path = self.root / table
+        if not path.exists():
+            return None
+        return ds.dataset(path, format="parquet", partitioning="hive")
+
+    def read(self, columns=None, filters=None, platform=None, months=None) -> pa.Table:
+        """ Posts as an Arrow table, with only `columns` decoded. `filters` are
+        pyarrow DNF tuples or an expression; `platform` / `months` filter on the
+        partition keys and skip whole directories. """
+        return self._read("posts", POST_SCHEMA, columns, filters, platform, months)
+
+    def accounts(self, columns=None, filters=None, platform=None) -> pa.Table:
+        return self._read("accounts", ACCOUNT_SCHEMA, columns, filters, platform, None)
+
+    def _read(self, table, schema, columns, filters, platform, months):
+        dataset = self._dataset(table)
+        if dataset is None:
+            empty = schema.empty_table()
+            return empty.select(columns) if columns else empty
+        expr = _filter_expression(filters, platform, months)
+        return dataset.to_table(columns=columns, filter=expr)
+
+    def scan(self, columns=None, filters=None, platform=None, months=None):
+        """ Same as read(), as a stream of record batches. """
+        dataset = self._dataset("posts")
+        if dataset is None:
+            return iter(())
+        expr = _filter_expression(filters, platform, months)
+        return dataset.to_batches(columns=columns, filter=expr)
+
+    def months(self, platform) -> list[str]:
+        base = self.root / "posts" / f"platform={platform}"
+        if not base.exists():
+            return []
+        return sorted(p.name.split("=", 1)[1] for p in base.iterdir() if p.name.startswith("month="))
+
+
+def _filter_expression(filters, platform, months):
+    if isinstance(filters, ds.Expression):
+        expr = filters
+    else:
+        expr = pq.filters_to_expression(filters) if filters else None
+    if platform is not None:
+        e = ds.field("platform") == platform
+        expr = e if expr is None else expr & e
+    if months is not None:
+        e = ds.field("month").isin(list(months))
+        expr = e if expr is None else expr & e
+    return expr
+
+
+def import_json(store, platform, path, month=None):
+    """ Convert one monthly JSON array (`*_YYYY-MM.json`) into the store. """
+    path = Path(path)
+    month = month or path.stem[-7:]
+    with path.open("r", encoding="utf-8") as fh:
+        posts = json.load(fh)
+    return store.write_month(platform, month, posts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar post store")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="convert monthly JSON arrays")
+    imp.add_argument("platform", choices=["bluesky", "mastodon"])
+    imp.add_argument("root", help="collection root, e.g. ./dataset/store/random")
+    imp.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+
+    store = PostStore(args.root)
+    for f in args.files:
+        n = import_json(store, args.platform, f)
+        print(f"{f}: {n} posts -> {store.root}")
+
+
+if __name__ == "__main__":
+    main()
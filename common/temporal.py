@@ -0,0 +1,479 @@
+"""
+Temporal hashtag analytics on a dense tag x day matrix.
+
+The notebooks look at time through a single random day
+(`random_day_between`) and draw their log-log rank plots from
+`sorted(count.values())`. Here a collection becomes a `DailyCounts`: one
+int32 matrix of tags (a common.hashtags.TagVocab) by consecutive UTC days.
+Every statistic is a NumPy expression over the whole matrix (or over its
+`top` most frequent rows):
+
+- rolling(window): trailing-window sums; share(window): each tag's fraction
+  of the hashtags of the window;
+- zscore(): each day against the mean and deviation of the `window` days
+  before it; zscore_bursts() returns the runs of days above `threshold`;
+- kleinberg_bursts(): Kleinberg's two-state automaton for batched counts
+  ("Bursty and hierarchical structure in streams", 2002). The Viterbi pass
+  runs over all tags at once, one vector step per day;
+- rank_stability(): per period, the Jaccard overlap of the top-k with the
+  previous period and the correlation of the ranks over their union
+  (Fagin-style, a tag missing from a list ranks k + 1);
+  compare() does the same between two corpora (climate change vs random);
+- zipf_fit(): per period, the least-squares Zipf exponent of the
+  rank/frequency curve with its R^2, plus the discrete power-law MLE
+  exponent (Clauset et al. approximation) with its KS distance.
+
+Counting is cached per month through common.build.BuildCache. Each month
+partition gets one partial (a vocabulary and a tags x days-of-month block),
+rebuilt only when the partition changed. Adding a day recounts one month;
+the matrix is then reassembled from the cached blocks.
+
+    python -m common.temporal ./dataset/store/100_posts ./dataset/store/random --platforms bluesky mastodon
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from scipy.stats import rankdata
+
+from common.build import BUILD_CACHE, BuildCache
+from common.hashtags import TagVocab
+
+DAY_US = 86_400_000_000
+WINDOW = 7                # rolling window (days)
+BURST_WINDOW = 28         # history a z-score is computed on (days)
+Z_THRESHOLD = 3.0
+MIN_COUNT = 5             # a burst day needs at least this many uses
+BURST_SCALE = 2.0         # Kleinberg s: burst rate / base rate
+BURST_GAMMA = 1.0         # Kleinberg gamma: entering a burst costs gamma * ln(days)
+TOP_K = 100
+TOP_ROWS = 2000           # tags the burst detectors look at by default
+VERSION = 1               # bump when count_month changes its output
+
+
+# -- counting ------------------------------------------------------------------
+
+def month_days(month) -> np.ndarray:
+    """ datetime64[D] days of "YYYY-MM". """
+    first = np.datetime64(month, "M")
+    return np.arange(first.astype("datetime64[D]"), (first + 1).astype("datetime64[D]"))
+
+
+def count_month(store, platform, month, filters=None) -> tuple[TagVocab, np.ndarray]:
+    """ (vocabulary, tags x days-of-month counts) of one month partition. """
+    days = month_days(month)
+    vocab = TagVocab()
+    table = store.read(["created_at", "tags"], filters=filters, platform=platform, months=[month])
+    if not table.num_rows:
+        return vocab, np.zeros((0, len(days)), dtype=np.int32)
+    tags = table.column("tags").combine_chunks()
+    flat = pc.list_flatten(tags)
+    parents = pc.list_parent_indices(tags).to_numpy()
+    created = pc.fill_null(table.column("created_at").combine_chunks().cast(pa.int64()), -1).to_numpy()
+    day = created[parents] // DAY_US - days[0].astype(np.int64)
+    keep = (created[parents] >= 0) & (day >= 0) & (day < len(days)) & flat.is_valid().to_numpy(zero_copy_only=False)
+    if not keep.any():
+        return vocab, np.zeros((0, len(days)), dtype=np.int32)
+    encoded = pc.dictionary_encode(flat.filter(pa.array(keep)))
+    # distinct raw spellings can normalize to the same tag
+    ids = np.array([vocab.intern(t) for t in encoded.dictionary.to_pylist()], dtype=np.int64)
+    tag_ids = ids[encoded.indices.to_numpy()]
+    flat_index = tag_ids * len(days) + day[keep]
+    counts = np.bincount(flat_index, minlength=len(vocab) * len(days)).astype(np.int32)
+    return vocab, counts.reshape(len(vocab), len(days))
+
+
+def _save_partial(path, month, vocab, counts):
+    tmp = Path(path).with_name("." + Path(path).name)
+    with open(tmp, "wb") as fh:
+        np.savez_compressed(fh, tags=json.dumps(vocab.tags), month=month, counts=counts)
+    tmp.replace(path)
+
+
+def _load_partial(path) -> tuple[str, TagVocab, np.ndarray]:
+    with np.load(path) as data:
+        return str(data["month"]), TagVocab(json.loads(str(data["tags"]))), data["counts"]
+
+
+def daily_counts(cache, store, platform, filters=None, params=None, min_total=1) -> DailyCounts:
+    """ DailyCounts of one platform of a collection, from per-month partials
+    rebuilt only for the months whose partition changed. `params` must
+    describe `filters`, as for common.build.month_partials. """
+    params = {"filters": filters if params is None else params, "platform": platform, "version": VERSION}
+    collection = Path(store.root).name
+    partials = []
+    for month in store.months(platform):
+
+        def build(path, month=month):
+            _save_partial(path, month, *count_month(store, platform, month, filters))
+
+        partials.append(cache.artifact(
+            f"{collection}/{platform}/daily/{month}", cache.root / collection / platform / "daily" / f"{month}.npz",
+            build, inputs=[store.month_file(platform, month)], params=params,
+        ))
+    return DailyCounts.from_partials(partials, min_total=min_total)
+
+
+# -- matrix ----------------------------------------------------------------------
+
+def _trailing_sum(x, window) -> np.ndarray:
+    """ Sum of the `window` columns ending at each column (fewer at the start). """
+    c = np.cumsum(x, axis=1, dtype=np.float64)
+    out = c.copy()
+    out[:, window:] -= c[:, :-window]
+    return out
+
+
+def _runs(mask) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ (row, first column, last column) of every run of True in a 2-d mask. """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends - 1
+
+
+def _overlap(a, b, k) -> tuple[np.ndarray, np.ndarray]:
+    """ Column by column: Jaccard of the top-k of a and b, and the correlation
+    of their ranks over the union of the two top-k lists (ties share their
+    average rank; a tag missing from a list ranks k + 1 there, as in Fagin
+    et al.'s comparison of top-k lists). """
+    ta = (rankdata(-a, axis=0, method="ordinal") <= k) & (a > 0)
+    tb = (rankdata(-b, axis=0, method="ordinal") <= k) & (b > 0)
+    ra = np.where(ta, rankdata(-a, axis=0, method="average"), k + 1)
+    rb = np.where(tb, rankdata(-b, axis=0, method="average"), k + 1)
+    union = ta | tb
+    n_union = union.sum(axis=0)
+    jaccard = np.divide((ta & tb).sum(axis=0), n_union, out=np.full(a.shape[1], np.nan), where=n_union > 0)
+    n = np.maximum(n_union, 1)
+    ma, mb = (ra * union).sum(axis=0) / n, (rb * union).sum(axis=0) / n
+    da, db = (ra - ma) * union, (rb - mb) * union
+    cov = (da * db).sum(axis=0)
+    norm = np.sqrt((da * da).sum(axis=0) * (db * db).sum(axis=0))
+    rho = np.divide(cov, norm, out=np.full(a.shape[1], np.nan), where=norm > 0)
+    return jaccard, rho
+
+
+class DailyCounts:
+    """ Hashtag uses per tag (row, TagVocab id) and UTC day (column). """
+
+    def __init__(self, vocab: TagVocab, start, counts: np.ndarray):
+        self.vocab = vocab
+        self.start = np.datetime64(start, "D")
+        self.counts = counts
+
+    @classmethod
+    def from_partials(cls, paths, min_total=1) -> DailyCounts:
+        """ Assemble month partials (any order, gaps allowed) on one day axis;
+        tags used fewer than `min_total` times over the whole range are dropped. """
+        parts = [_load_partial(p) for p in paths]
+        if not parts:
+            return cls(TagVocab(), np.datetime64("1970-01-01"), np.zeros((0, 0), dtype=np.int32))
+        vocab = TagVocab()
+        mappings = [vocab.remap(pv) for _, pv, _ in parts]
+        totals = np.zeros(len(vocab), dtype=np.int64)
+        for mapping, (_, _, counts) in zip(mappings, parts):
+            np.add.at(totals, mapping, counts.sum(axis=1))
+        keep = np.flatnonzero(totals >= min_total)
+        row = np.full(len(vocab), -1, dtype=np.int64)
+        row[keep] = np.arange(len(keep))
+        first = min(month_days(m)[0] for m, _, _ in parts)
+        last = max(month_days(m)[-1] for m, _, _ in parts)
+        matrix = np.zeros((len(keep), (last - first).astype(int) + 1), dtype=np.int32)
+        for mapping, (month, _, counts) in zip(mappings, parts):
+            col = (month_days(month)[0] - first).astype(int)
+            rows = row[mapping]
+            sel = rows >= 0
+            matrix[rows[sel], col:col + counts.shape[1]] = counts[sel]
+        return cls(TagVocab(vocab.tags[i] for i in keep), first, matrix)
+
+    @property
+    def days(self) -> np.ndarray:
+        return self.start + np.arange(self.counts.shape[1])
+
+    def totals(self) -> np.ndarray:
+        """ Hashtag uses per day. """
+        return self.counts.sum(axis=0, dtype=np.int64)
+
+    def top_rows(self, top=None) -> np.ndarray:
+        """ Rows of the `top` most used tags (all rows when None). """
+        totals = self.counts.sum(axis=1, dtype=np.int64)
+        if top is None or top >= len(totals):
+            return np.arange(len(totals))
+        return np.sort(np.argpartition(-totals, top - 1)[:top])
+
+    def series(self, tag) -> np.ndarray:
+        i = self.vocab.get(tag)
+        return np.zeros(self.counts.shape[1], dtype=np.int32) if i is None else self.counts[i]
+
+    def save(self, path):
+        np.savez_compressed(path, tags=json.dumps(self.vocab.tags), start=str(self.start), counts=self.counts)
+
+    @classmethod
+    def load(cls, path) -> DailyCounts:
+        with np.load(path) as data:
+            return cls(TagVocab(json.loads(str(data["tags"]))), np.datetime64(str(data["start"])),
+                       data["counts"].copy())
+
+    # -- series ------------------------------------------------------------------
+
+    def rolling(self, window=WINDOW) -> np.ndarray:
+        """ Uses in the `window` days ending at each day. """
+        return _trailing_sum(self.counts, window)
+
+    def share(self, window=WINDOW) -> np.ndarray:
+        """ Each tag's fraction of all hashtag uses over the trailing window. """
+        total = _trailing_sum(self.totals()[None, :], window)[0]
+        return np.divide(self.rolling(window), total, out=np.zeros(self.counts.shape, dtype=np.float64),
+                         where=total > 0)
+
+    # -- bursts ------------------------------------------------------------------
+
+    def zscore(self, window=BURST_WINDOW, rows=None) -> np.ndarray:
+        """ (x_t - mean) / std of the `window` days before t, on the share of
+        the day's hashtags (so that crawl volume changes are not bursts);
+        nan until a full window of history exists. """
+        rows = self.top_rows() if rows is None else rows
+        total = self.totals().astype(np.float64)
+        x = np.divide(self.counts[rows], total, out=np.zeros((len(rows), len(total))), where=total > 0)
+        s1 = _trailing_sum(x, window)
+        s2 = _trailing_sum(x * x, window)
+        z = np.full(x.shape, np.nan)
+        if x.shape[1] <= window:
+            return z
+        mean = s1[:, window - 1:-1] / window
+        var = np.maximum(s2[:, window - 1:-1] / window - mean * mean, 0)
+        # a flat history still has a floor: one use more than the mean is not infinitely surprising
+        floor = 1 / np.maximum(total[window:], 1)
+        z[:, window:] = (x[:, window:] - mean) / np.maximum(np.sqrt(var), floor)
+        return z
+
+    def zscore_bursts(self, window=BURST_WINDOW, threshold=Z_THRESHOLD, min_count=MIN_COUNT, top=TOP_ROWS):
+        """ [(tag, first day, last day, peak z)] of the runs of days over the
+        threshold, strongest first. """
+        rows = self.top_rows(top)
+        z = self.zscore(window, rows)
+        mask = (np.nan_to_num(z) > threshold) & (self.counts[rows] >= min_count)
+        return self._intervals(rows, mask, np.nan_to_num(z))
+
+    def kleinberg_states(self, s=BURST_SCALE, gamma=BURST_GAMMA, rows=None) -> np.ndarray:
+        """ Burst (True) / base state of every (tag, day): the minimum-cost
+        state sequence of the two-state automaton, where a day with r of d
+        hashtag uses costs -ln(p^r (1 - p)^(d - r)) at rate p0 (the tag's
+        overall share) or p1 = s * p0, and entering the burst state costs
+        gamma * ln(days). """
+        rows = self.top_rows() if rows is None else rows
+        r = self.counts[rows].astype(np.float64)
+        d = self.totals().astype(np.float64)
+        n_days = r.shape[1]
+        if not n_days or not len(rows):
+            return np.zeros(r.shape, dtype=bool)
+        p0 = np.clip(r.sum(axis=1) / max(d.sum(), 1), 1e-12, 1 - 1e-12)[:, None]
+        p1 = np.minimum(s * p0, 1 - 1e-12)
+        cost0 = -(r * np.log(p0) + (d - r) * np.log1p(-p0))
+        cost1 = -(r * np.log(p1) + (d - r) * np.log1p(-p1))
+        enter = gamma * np.log(n_days)
+        c0, c1 = cost0[:, 0].copy(), enter + cost1[:, 0]
+        from1_to0 = np.zeros(r.shape, dtype=bool)      # best predecessor of state 0 was 1
+        from1_to1 = np.zeros(r.shape, dtype=bool)      # best predecessor of state 1 was 1
+        for t in range(1, n_days):
+            from1_to0[:, t] = c1 < c0
+            from1_to1[:, t] = c1 <= c0 + enter
+            c0, c1 = np.minimum(c0, c1) + cost0[:, t], np.minimum(c0 + enter, c1) + cost1[:, t]
+        states = np.zeros(r.shape, dtype=bool)
+        state = c1 < c0
+        for t in range(n_days - 1, -1, -1):
+            states[:, t] = state
+            state = np.where(state, from1_to1[:, t], from1_to0[:, t])
+        return states
+
+    def kleinberg_bursts(self, s=BURST_SCALE, gamma=BURST_GAMMA, min_count=MIN_COUNT, top=TOP_ROWS):
+        """ [(tag, first day, last day, uses)] of the burst intervals with at
+        least `min_count` uses, most used first. """
+        rows = self.top_rows(top)
+        states = self.kleinberg_states(s, gamma, rows)
+        out = []
+        uses = np.cumsum(self.counts[rows], axis=1, dtype=np.int64)
+        for row, first, last in zip(*_runs(states)):
+            n = int(uses[row, last] - (uses[row, first - 1] if first else 0))
+            if n >= min_count:
+                out.append((self.vocab[int(rows[row])], self.days[first], self.days[last], n))
+        return sorted(out, key=lambda b: -b[3])
+
+    def _intervals(self, rows, mask, score):
+        out = []
+        for row, first, last in zip(*_runs(mask)):
+            peak = float(score[row, first:last + 1].max())
+            out.append((self.vocab[int(rows[row])], self.days[first], self.days[last], peak))
+        return sorted(out, key=lambda b: -b[3])
+
+    # -- periods -----------------------------------------------------------------
+
+    def periods(self, period="month") -> tuple[list[str], np.ndarray]:
+        """ (labels, first column) of the months / ISO weeks / days of the range. """
+        days = self.days
+        if period == "day":
+            starts = np.arange(len(days))
+        elif period == "week":
+            # 1970-01-01 was a Thursday
+            starts = np.flatnonzero(((days.astype(np.int64) + 3) % 7 == 0) | (np.arange(len(days)) == 0))
+        elif period == "month":
+            starts = np.flatnonzero((days.astype("datetime64[M]").astype("datetime64[D]") == days)
+                                    | (np.arange(len(days)) == 0))
+        else:
+            raise ValueError(f"unknown period {period!r}")
+        fmt = {"day": "D", "week": "D", "month": "M"}[period]
+        return [str(d) for d in days[starts].astype(f"datetime64[{fmt}]")], starts
+
+    def by_period(self, period="month") -> tuple[list[str], np.ndarray]:
+        """ (labels, tags x periods counts). """
+        labels, starts = self.periods(period)
+        if not len(starts):
+            return labels, np.zeros((len(self.vocab), 0), dtype=np.int64)
+        return labels, np.add.reduceat(self.counts, starts, axis=1, dtype=np.int64)
+
+    def rank_stability(self, period="month", k=TOP_K) -> dict:
+        """ Per period after the first: Jaccard of its top-k with the previous
+        period's and the correlation of the ranks over their union. """
+        labels, m = self.by_period(period)
+        if m.shape[1] < 2:
+            return {"periods": [], "jaccard": np.zeros(0), "rho": np.zeros(0)}
+        jaccard, rho = _overlap(m[:, :-1], m[:, 1:], k)
+        return {"periods": labels[1:], "jaccard": jaccard, "rho": rho}
+
+    def compare(self, other: DailyCounts, period="month", k=TOP_K) -> dict:
+        """ Per common period: Jaccard of the two corpora's top-k and the rank
+        correlation over their union (tags matched by normalized name). """
+        la, a = self.by_period(period)
+        lb, b = other.by_period(period)
+        common = sorted(set(la) & set(lb))
+        if not common:
+            return {"periods": [], "jaccard": np.zeros(0), "rho": np.zeros(0)}
+        vocab = TagVocab(self.vocab.tags)
+        mapping = vocab.remap(other.vocab)
+        ca = np.zeros((len(vocab), len(common)), dtype=np.int64)
+        cb = np.zeros((len(vocab), len(common)), dtype=np.int64)
+        ca[:len(self.vocab)] = a[:, [la.index(p) for p in common]]
+        cb[mapping] = b[:, [lb.index(p) for p in common]]
+        jaccard, rho = _overlap(ca, cb, k)
+        return {"periods": common, "jaccard": jaccard, "rho": rho}
+
+    def zipf_fit(self, period="month", xmin=1, ranks=None) -> dict:
+        """ Per period (and "all" for the whole range), fitted on the tags used
+        at least `xmin` times:
+
+        - zipf, r2: least-squares slope of log(frequency) on log(rank), over
+          the first `ranks` ranks (all when None), as a positive exponent;
+        - alpha, ks: discrete power-law MLE of the frequencies,
+          alpha = 1 + n / sum(ln(x / (xmin - 1/2))), and the KS distance
+          between the empirical and fitted tail distributions. """
+        labels, m = self.by_period(period)
+        m = np.concatenate([m, m.sum(axis=1, keepdims=True)], axis=1)
+        labels = labels + ["all"]
+        x = -np.sort(-m, axis=0).astype(np.float64)           # each column descending
+        used = x >= xmin
+        n = used.sum(axis=0)
+        rank = np.arange(1, len(x) + 1, dtype=np.float64)[:, None]
+
+        fit = used & (rank <= ranks) if ranks else used
+        nf = np.maximum(fit.sum(axis=0), 1)
+        lx = np.log(np.where(fit, rank, 1.0))
+        ly = np.log(np.where(fit, x, 1.0))
+        mx, my = lx.sum(axis=0) / nf, ly.sum(axis=0) / nf
+        dx, dy = (lx - mx) * fit, (ly - my) * fit
+        sxx, syy, sxy = (dx * dx).sum(axis=0), (dy * dy).sum(axis=0), (dx * dy).sum(axis=0)
+        ok = (sxx > 0) & (nf > 1)
+        slope = np.divide(sxy, sxx, out=np.full(len(n), np.nan), where=ok)
+        r2 = np.divide(sxy * sxy, sxx * syy, out=np.full(len(n), np.nan), where=ok & (syy > 0))
+
+        logs = np.log(np.where(used, x, xmin) / (xmin - 0.5)) * used
+        alpha = 1 + np.divide(n, logs.sum(axis=0), out=np.full(len(n), np.nan), where=logs.sum(axis=0) > 0)
+        # P(X >= x): empirical from the descending order (ties share the last
+        # position of their group), fitted with the continuous approximation
+        boundary = np.ones(x.shape, dtype=bool)
+        boundary[:-1] = x[:-1] != x[1:]
+        ends = np.where(boundary, np.arange(len(x))[:, None], len(x))
+        last = np.minimum.accumulate(ends[::-1], axis=0)[::-1]
+        empirical = (last + 1) / np.maximum(n, 1)
+        fitted = ((np.where(used, x, xmin) - 0.5) / (xmin - 0.5)) ** (1 - alpha)
+        ks = np.where(used, np.abs(empirical - fitted), 0).max(axis=0, initial=0)
+        ks = np.where(n > 0, ks, np.nan)
+        return {"periods": labels, "n": n, "zipf": -slope, "r2": r2, "alpha": alpha, "ks": ks}
+
+
+def main(argv=None):
+    from common.store import PostStore
+
+    parser = argparse.ArgumentParser(description="Temporal hashtag analytics of post store collections")
+    parser.add_argument("roots", nargs="+", help="collection roots, e.g. ./dataset/store/100_posts ./dataset/store/random")
+    parser.add_argument("--platforms", nargs="+", default=["bluesky", "mastodon"])
+    parser.add_argument("--lang", default="en", help="declared language to keep ('' keeps all)")
+    parser.add_argument("--period", default="month", choices=["day", "week", "month"])
+    parser.add_argument("--top", type=int, default=10, help="bursts to print")
+    parser.add_argument("--k", type=int, default=TOP_K, help="top-k for rank stability")
+    parser.add_argument("--min-total", type=int, default=1, help="drop tags used fewer times overall")
+    parser.add_argument("--cache", default=str(BUILD_CACHE))
+    parser.add_argument("--save", help="directory for one <collection>_<platform>.npz matrix each")
+    args = parser.parse_args(argv)
+
+    cache = BuildCache(args.cache)
+    filters = [("language", "=", args.lang)] if args.lang else None
+    matrices: dict[tuple[str, str], DailyCounts] = {}
+    for root in args.roots:
+        store = PostStore(root)
+        for platform in args.platforms:
+            if not store.months(platform):
+                continue
+            t0 = time.perf_counter()
+            built = len(cache.built)
+            daily = daily_counts(cache, store, platform, filters, min_total=args.min_total)
+            name = f"{Path(root).name}/{platform}"
+            matrices[(Path(root).name, platform)] = daily
+            days = daily.days
+            print(f"\n== {name}: {len(daily.vocab)} tags x {len(days)} days ({days[0]} .. {days[-1]}), "
+                  f"{int(daily.totals().sum())} uses; {len(cache.built) - built} months counted "
+                  f"({time.perf_counter() - t0:.2f}s)")
+            if args.save:
+                Path(args.save).mkdir(parents=True, exist_ok=True)
+                daily.save(Path(args.save) / f"{Path(root).name}_{platform}.npz")
+
+            t0 = time.perf_counter()
+            bursts = daily.kleinberg_bursts()
+            zbursts = daily.zscore_bursts()
+            zipf = daily.zipf_fit(args.period)
+            stability = daily.rank_stability(args.period, args.k)
+            print(f"analytics in {(time.perf_counter() - t0) * 1000:.0f} ms: "
+                  f"{len(bursts)} Kleinberg bursts, {len(zbursts)} z-score bursts")
+            for tag, first, last, uses in bursts[:args.top]:
+                print(f"  burst {tag:30s} {first} .. {last}  {uses} uses")
+            print(f"  {'period':10s} {'tags':>6s} {'zipf':>6s} {'R2':>5s} {'alpha':>6s} {'KS':>6s} "
+                  f"{'J@k':>5s} {'rho':>6s}")
+            stab = dict(zip(stability["periods"], zip(stability["jaccard"], stability["rho"])))
+            for i, label in enumerate(zipf["periods"]):
+                j, rho = stab.get(label, (np.nan, np.nan))
+                print(f"  {label:10s} {int(zipf['n'][i]):6d} {zipf['zipf'][i]:6.2f} {zipf['r2'][i]:5.2f} "
+                      f"{zipf['alpha'][i]:6.2f} {zipf['ks'][i]:6.3f} {j:5.2f} {rho:6.2f}")
+
+    names = sorted(matrices)
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            if a[1] != b[1]:
+                continue
+            cmp = matrices[a].compare(matrices[b], args.period, args.k)
+            if not cmp["periods"]:
+                continue
+            print(f"\n== {a[0]} vs {b[0]} ({a[1]}): top-{args.k} overlap per {args.period}")
+            for label, j, rho in zip(cmp["periods"], cmp["jaccard"], cmp["rho"]):
+                print(f"  {label:10s} jaccard {j:5.2f}  rho {rho:6.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Batched gzip JSONL writer task shared by the asyncio crawlers.
+
+Producers `await put(post)` into a bounded queue: when the disk falls
+behind, put() blocks and the producer stops reading from the network
+instead of buffering without limit. The writer task serializes
+`batch_size` posts (or whatever arrived within `interval` seconds) and
+appends them as one complete gzip member, so every flush leaves a valid
+.jsonl.gz behind (gzip readers concatenate members) and the file can be
+cut back to the last flushed offset after a crash.
+
+Producers can attach a `mark` (e.g. a stream cursor) to a post, or send a
+mark alone with `mark()`. `on_flush(mark, offsets)` is called once
+everything put before that mark is on disk, with the new end offset of
+each file written since the last call: what a resumable consumer persists
+and passes back as `offsets` on restart. A file that is not in `offsets`
+is reported with its size before the first write to it (mark None), so a
+crash right after that write still cuts it back.
+
+Flushes (compression, write, fsync) run in a worker thread, so the producers
+keep reading the network while a batch goes to disk.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import os
+from pathlib import Path
+
+from common import metrics
+
+BATCH_SIZE = 1000         # posts per gzip member
+INTERVAL = 5.0            # seconds before a partial batch is flushed anyway
+QUEUE_SIZE = 10_000       # posts buffered before put() blocks
+LEVEL = 6                 # gzip compression level
+
+_STOP = object()
+
+
+class GzipJsonlWriter:
+    """ Bounded queue -> batched, crash-safe gzip JSONL appends. `path` is a
+    file or a function post -> file (e.g. one file per day). """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, interval=INTERVAL, maxsize=QUEUE_SIZE,
+                 offsets=None, on_flush=None, level=LEVEL, sink="gzip"):
+        self.path_for = path if callable(path) else (lambda post, path=Path(path): path)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        # files cut back to these offsets when first opened (0: start over)
+        self.offsets: dict[str, int] = {str(k): v for k, v in (offsets or {}).items()}
+        self.on_flush = on_flush
+        self.level = level
+        self.sink = sink
+        self.written = 0
+        self._files: dict[str, object] = {}
+        self._started: dict[str, int] = {}       # files opened fresh -> size before the first write
+        self._task: asyncio.Task | None = None
+
+    # -- producer side -----------------------------------------------------
+
+    async def put(self, post, mark=None):
+        await self.queue.put((post, mark))
+        metrics.QUEUE_DEPTH.set(self.queue.qsize())
+
+    async def mark(self, mark):
+        """ Report `mark` through on_flush once everything before it is written. """
+        await self.queue.put((None, mark))
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    async def close(self):
+        """ Flush what is queued and close the files. """
+        await self.queue.put((_STOP, None))
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # -- writer task -------------------------------------------------------
+
+    def _open(self, path):
+        key = str(path)
+        fh = self._files.get(key)
+        if fh is None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            fh = self._files[key] = open(path, "ab")
+            known = key in self.offsets
+            if known:
+                fh.truncate(self.offsets.pop(key))
+            fh.seek(0, os.SEEK_END)
+            if not known and self.on_flush is not None:
+                self._started[key] = fh.tell()
+        return fh
+
+    def _flush(self, lines, mark):
+        """ Append one gzip member per file. Runs in a worker thread: only the
+        writer task touches the files, one flush at a time. """
+        handles = {path: self._open(path) for path in lines}
+        if self.on_flush is not None and self._started:
+            # persisted before the data, see the module docstring
+            self.on_flush(None, self._started)
+            self._started = {}
+        offsets = {}
+        for path, rows in lines.items():
+            data = ("\n".join(rows) + "\n").encode("utf-8")
+            fh = handles[path]
+            fh.write(gzip.compress(data, self.level))
+            fh.flush()
+            if self.on_flush is not None:
+                os.fsync(fh.fileno())
+            offsets[path] = fh.tell()
+            metrics.POSTS_WRITTEN.inc(len(rows), sink=self.sink)
+            metrics.BYTES_WRITTEN.inc(len(data), sink=self.sink)
+            self.written += len(rows)
+        # a file that got nothing for a whole interval (yesterday's, in a
+        # daily layout) is closed; it is reopened in append mode if needed
+        for key in [k for k in self._files if k not in lines]:
+            self._files.pop(key).close()
+        if self.on_flush is not None and (lines or mark is not None):
+            self.on_flush(mark, offsets)
+
+    async def _next(self, timeout):
+        """ Next (post, mark) from the queue, None after `timeout` seconds. """
+        try:
+            # no timer while the queue is busy: wait_for costs a task per call
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        try:
+            return await asyncio.wait_for(self.queue.get(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            return None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        lines: dict[str, list[str]] = {}
+        pending, mark, stop = 0, None, False
+        deadline = loop.time() + self.interval
+        flush = None
+        try:
+            while not stop:
+                item = await self._next(deadline - loop.time())
+                if item is not None:
+                    metrics.QUEUE_DEPTH.set(self.queue.qsize())
+                    post, item_mark = item
+                    if post is _STOP:
+                        stop = True
+                    elif post is not None:
+                        lines.setdefault(str(self.path_for(post)), []).append(
+                            json.dumps(post, ensure_ascii=False, default=str))
+                        pending += 1
+                    if item_mark is not None:
+                        mark = item_mark
+                    if not stop and pending < self.batch_size and loop.time() < deadline:
+                        continue
+                # shielded: a cancelled writer task still lets the thread finish
+                flush = asyncio.ensure_future(asyncio.to_thread(self._flush, lines, mark))
+                await asyncio.shield(flush)
+                lines, pending, mark = {}, 0, None
+                deadline = loop.time() + self.interval
+        finally:
+            if flush is not None and not flush.done():
+                await asyncio.wait([flush])
+            for fh in self._files.values():
+                fh.close()
+            self._files.clear()
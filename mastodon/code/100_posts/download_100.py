@@ -1,53 +1,120 @@
-import json
 import os
+import sys
+from pathlib import Path
 from mastodon import Mastodon
 from datetime import datetime, timedelta, timezone
-import time
 import random
 from dotenv import load_dotenv
 
+# repository root, for the shared `common` package
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from common import metrics
+from common.checkpoint import ProgressStore, append_post, write_json_array
+from common.engine import CrawlEngine
+from common.mastodon_window import map_days, walk_window
+from common.sampling import Reservoir, window_seed
+from common.store import PostStore
+
 ### CONFIG 
 load_dotenv()
-out_dir  = '/home/damn/Documents/PROJECTS/THESIS/Social-graph-miner-multi-platform-data-analysis/mastodon/dataset/100_posts'
+out_dir  = os.getenv('MASTODON_OUT_DIR', '/home/damn/Documents/PROJECTS/THESIS/Social-graph-miner-multi-platform-data-analysis/mastodon/dataset/100_posts')
+store_root = os.getenv('POST_STORE', str(Path(__file__).resolve().parents[3] / 'dataset' / 'store' / '100_posts'))
+json_arrays = False  # also render the old pretty-printed {month}.json files
 
-instance= 'https://mastodon.social'
+# MASTODON_INSTANCE / CRAWL_* / the paths above: short runs against the bench/ stand-in server
+instance= os.getenv('MASTODON_INSTANCE', 'https://mastodon.social')
 hashtag = 'climatechange'
-start= datetime(2024, 2, 6, tzinfo=timezone.utc)
-end= datetime(2025, 6, 30, tzinfo=timezone.utc)
+start= datetime.fromisoformat(os.getenv('CRAWL_START', '2024-02-06')).replace(tzinfo=timezone.utc)
+end= datetime.fromisoformat(os.getenv('CRAWL_END', '2025-06-30')).replace(tzinfo=timezone.utc)   # exclusive
 access_token = os.getenv('MASTODON_TOKEN')
+posts_per_day = 5
+sampling = 'batch'   # 'batch': page the whole day (40 per call) + reservoir; 'probe': limit=1 at random times
+workers = 4          # batch mode: days fetched concurrently
+seed = 42            # batch samples are reproducible per (seed, hashtag, day)
 
 
 ### DIRECTORY 
 os.makedirs(out_dir, exist_ok=True)
-mastodon = Mastodon(access_token=access_token, api_base_url=instance)
-seen_ids = set()
+engine = CrawlEngine()  # pooled keep-alive session reused by every API call
+mastodon = Mastodon(access_token=access_token, api_base_url=instance, session=engine.session)
+
+# progress + seen ids on disk: a restart skips finished days and never re-appends
+progress_dir = os.path.join(os.path.dirname(out_dir), ".progress", os.path.basename(out_dir))
+store = ProgressStore(os.path.join(progress_dir, "progress.sqlite"))
+# metrics.json / metrics.prom next to the progress store, see common/metrics.py
+exporter = metrics.Exporter(os.path.join(progress_dir, "metrics.json"), os.path.join(progress_dir, "metrics.prom")).start()
+posts_store = PostStore(store_root)
+
+def sample_day(current_day):
+    """ Walk the day's snowflake id window and return a seeded uniform
+    sample of posts_per_day statuses not saved before. The walk goes newest
+    first, so it is not capped: a cut-off day would only sample its end. """
+    day = current_day.date()
+    reservoir = Reservoir(posts_per_day, seed=window_seed(seed, "mastodon", hashtag, day))
+    for s in walk_window(mastodon, mastodon.timeline_hashtag, current_day, current_day + timedelta(days=1),
+                         hashtag=hashtag):
+        if not store.has_seen("mastodon", s.id):
+            reservoir.offer(s)
+    return reservoir.result()
+
 
 ### EXTRACTION  
+days = []
 current_day = start
 while current_day < end:
-    posts_saved = 0
-    month_file_path = os.path.join(out_dir, f"{current_day.year}-{current_day.month:02d}.json")
-
-    with open(month_file_path, 'a', encoding='utf-8') as fout:
-        while posts_saved < 5:
-            rand_hour = random.randint(0, 23)
-            rand_minute = random.randint(0, 59)
-            rand_second = random.randint(0, 59)
-            random_dt = current_day.replace(hour=rand_hour, minute=rand_minute, second=rand_second)
-            
-            posts = mastodon.timeline_hashtag(
-                hashtag=hashtag,
-                max_id=random_dt,
-                limit=1
-            )
-            time.sleep(2)  
-            if posts:
-                s = posts[0]
-                if current_day <= s.created_at < (current_day + timedelta(days=1)) and s.id not in seen_ids:
-                    
-                    fout.write(json.dumps(posts, ensure_ascii=False, default=str) + "\n")
-                    seen_ids.add(s.id)
-                    posts_saved += 1
+    days.append(current_day)
     current_day += timedelta(days=1)
 
+# batch mode: days are fetched on a thread pool and written here in order
+pending = [d for d in days if not store.is_done("mastodon", hashtag, d.date())]
+samples = map_days(sample_day, pending, workers) if sampling == 'batch' else iter(())
+
+for current_day in days:
+    day = current_day.date()
+    month = f"{current_day.year}-{current_day.month:02d}"
+    log_path = os.path.join(progress_dir, f"{month}.jsonl")
+
+    if not store.is_done("mastodon", hashtag, day):
+        with store.open_log(log_path) as fout:
+            if sampling == 'batch':
+                _, sample = next(samples)
+                posts_saved = 0
+                for s in sample:
+                    if store.add_seen("mastodon", s.id):
+                        append_post(fout, s)
+                        posts_saved += 1
+                store.checkpoint(fout, "mastodon", hashtag, day, done=True, saved=posts_saved)
+            else:
+                posts_saved = int(store.cursor("mastodon", hashtag, day) or 0)
+                while posts_saved < posts_per_day:
+                    rand_hour = random.randint(0, 23)
+                    rand_minute = random.randint(0, 59)
+                    rand_second = random.randint(0, 59)
+                    random_dt = current_day.replace(hour=rand_hour, minute=rand_minute, second=rand_second)
+
+                    posts = mastodon.timeline_hashtag(
+                        hashtag=hashtag,
+                        max_id=random_dt,
+                        limit=1
+                    )
+                    # no fixed sleep: the engine session takes a token from the
+                    # X-RateLimit-* driven limiter before every call
+                    if posts:
+                        s = posts[0]
+                        if current_day <= s.created_at < (current_day + timedelta(days=1)) and store.add_seen("mastodon", s.id):
+                            append_post(fout, s)
+                            posts_saved += 1
+                            store.checkpoint(fout, "mastodon", hashtag, day, cursor=str(posts_saved), saved=1)
+                store.checkpoint(fout, "mastodon", hashtag, day, done=True)
+
+    # last day of the month (or of the range): render the month file
+    next_day = current_day + timedelta(days=1)
+    if (next_day.month != current_day.month or next_day >= end) and os.path.exists(log_path):
+        posts_store.write_log("mastodon", month, log_path)
+        if json_arrays:
+            write_json_array(log_path, os.path.join(out_dir, f"{month}.json"))
+
+store.close()
+engine.close()
+exporter.stop()
 print(f"Salvato tutto")
@@ -1,5 +1,7 @@
 import json
 import os
+import sys
+from pathlib import Path
 from mastodon import Mastodon
 from datetime import datetime, timedelta, timezone
 import time
@@ -8,51 +10,107 @@ from bs4 import BeautifulSoup
 from langdetect import detect
 from dotenv import load_dotenv
 
+# repository root, for the shared `common` package
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from common import metrics
+from common.checkpoint import ProgressStore, append_post, write_json_array
+from common.engine import CrawlEngine
+from common.mastodon_window import walk_window
+from common.sampling import Reservoir, window_seed
+from common.store import PostStore
+
 ### CONFIG 
-out_dir  = '/home/damn/Documents/PROJECTS/THESIS/Social-graph-miner-multi-platform-data-analysis/mastodon/dataset/random'
+out_dir  = os.getenv('MASTODON_OUT_DIR', '/home/damn/Documents/PROJECTS/THESIS/Social-graph-miner-multi-platform-data-analysis/mastodon/dataset/random')
 load_dotenv()
-instance = 'https://mastodon.social'
-start = datetime(2024, 2, 6, tzinfo=timezone.utc)
-end = datetime(2025, 7, 6, tzinfo=timezone.utc)
+store_root = os.getenv('POST_STORE', str(Path(__file__).resolve().parents[3] / 'dataset' / 'store' / 'random'))
+json_arrays = False  # also render the old pretty-printed {month}.json files
+# MASTODON_INSTANCE / CRAWL_* / the paths above: short runs against the bench/ stand-in server
+instance = os.getenv('MASTODON_INSTANCE', 'https://mastodon.social')
+start = datetime.fromisoformat(os.getenv('CRAWL_START', '2024-02-06')).replace(tzinfo=timezone.utc)
+end = datetime.fromisoformat(os.getenv('CRAWL_END', '2025-07-06')).replace(tzinfo=timezone.utc)   # exclusive
 access_token = os.getenv('MASTODON_TOKEN')
+posts_per_day = 5
+sampling = 'batch'   # 'batch': a few full pages (40) per day + reservoir; 'probe': one status per call
+pages_per_day = 3
+month_sample = 100   # statuses kept per month file (was random.sample in the notebook)
+seed = 42
  
 ### DIRECTORY 
 os.makedirs(out_dir, exist_ok=True)
-mastodon = Mastodon(access_token="access_token", api_base_url=instance)
-seen_ids = set()
+engine = CrawlEngine()  # pooled session, paced by the shared X-RateLimit-* limiter
+mastodon = Mastodon(access_token=access_token, api_base_url=instance, session=engine.session)
+
+# progress + seen ids on disk: a restart skips finished days and never re-appends
+progress_dir = os.path.join(os.path.dirname(out_dir), ".progress", os.path.basename(out_dir))
+store = ProgressStore(os.path.join(progress_dir, "progress.sqlite"))
+# metrics.json / metrics.prom next to the progress store, see common/metrics.py
+exporter = metrics.Exporter(os.path.join(progress_dir, "metrics.json"), os.path.join(progress_dir, "metrics.prom")).start()
+posts_store = PostStore(store_root)
 
-all_posts = []
 ### EXTRACTION  
 current_day = start
 while current_day < end:
-    posts_saved = 0
-    attempts = 0
-    MAX_ATTEMPTS = 10   # Only 10 attempts per day
-    month_file_path = os.path.join(out_dir, f"{current_day.year}-{current_day.month:02d}.json")
-
-    with open(month_file_path, 'a', encoding='utf-8') as fout:
-        while posts_saved < 5 and attempts < MAX_ATTEMPTS:
-            rand_hour = random.randint(0, 23)
-            rand_minute = random.randint(0, 59)
-            rand_second = random.randint(0, 59)
-            random_dt = current_day.replace(hour=rand_hour, minute=rand_minute, second=rand_second)
-            
-            posts = mastodon.timeline_public(
-                max_id=random_dt,
-                limit=3
-            )
-            #time.sleep(1)  
-            attempts += 1
-            if posts:
-                s = posts[0]
-                api_lang = getattr(s, "language", None)
-                save_post = (api_lang == "en")
-                if save_post and current_day <= s.created_at < (current_day + timedelta(days=1)) and s.id not in seen_ids:
-                    all_posts.append(s)
-                    seen_ids.add(s.id)
-                    posts_saved += 1
-
-    
-    current_day += timedelta(days=1)
+    day = current_day.date()
+    month = f"{current_day.year}-{current_day.month:02d}"
+    log_path = os.path.join(progress_dir, f"{month}.jsonl")
+
+    if not store.is_done("mastodon", "public", day):
+        with store.open_log(log_path) as fout:
+            if sampling == 'batch':
+                # one full page ending at each seeded random time; the id window
+                # [day start, random time) keeps every status inside the day
+                rng = random.Random(window_seed(seed, "mastodon", "public", day))
+                reservoir = Reservoir(posts_per_day, seed=rng.getrandbits(64))
+                day_ids = set()   # pages at nearby times overlap
+                for _ in range(pages_per_day):
+                    random_dt = current_day.replace(hour=rng.randint(0, 23), minute=rng.randint(0, 59), second=rng.randint(0, 59))
+                    for s in walk_window(mastodon, mastodon.timeline_public, current_day, random_dt, max_pages=1):
+                        if getattr(s, "language", None) == "en" and s.id not in day_ids \
+                                and not store.has_seen("mastodon", s.id):
+                            day_ids.add(s.id)
+                            reservoir.offer(s)
+
+                posts_saved = 0
+                for s in reservoir.result():
+                    if store.add_seen("mastodon", s.id):
+                        append_post(fout, s)
+                        posts_saved += 1
+                store.checkpoint(fout, "mastodon", "public", day, done=True, saved=posts_saved)
+            else:
+                posts_saved = int(store.cursor("mastodon", "public", day) or 0)
+                attempts = 0
+                MAX_ATTEMPTS = 10   # Only 10 attempts per day
+                while posts_saved < posts_per_day and attempts < MAX_ATTEMPTS:
+                    rand_hour = random.randint(0, 23)
+                    rand_minute = random.randint(0, 59)
+                    rand_second = random.randint(0, 59)
+                    random_dt = current_day.replace(hour=rand_hour, minute=rand_minute, second=rand_second)
+
+                    posts = mastodon.timeline_public(
+                        max_id=random_dt,
+                        limit=3
+                    )
+                    attempts += 1
+                    if posts:
+                        s = posts[0]
+                        api_lang = getattr(s, "language", None)
+                        save_post = (api_lang == "en")
+                        if save_post and current_day <= s.created_at < (current_day + timedelta(days=1)) and store.add_seen("mastodon", s.id):
+                            append_post(fout, s)
+                            posts_saved += 1
+                            store.checkpoint(fout, "mastodon", "public", day, cursor=str(posts_saved), saved=1)
+                store.checkpoint(fout, "mastodon", "public", day, done=True)
+
+    # last day of the month (or of the range): render the month file
+    next_day = current_day + timedelta(days=1)
+    if (next_day.month != current_day.month or next_day >= end) and os.path.exists(log_path):
+        month_seed = window_seed(seed, "mastodon", "public", month)
+        posts_store.write_log("mastodon", month, log_path, k=month_sample, seed=month_seed)
+        if json_arrays:
+            write_json_array(log_path, os.path.join(out_dir, f"{month}.json"), k=month_sample, seed=month_seed)
+    current_day = next_day
 
+store.close()
+engine.close()
+exporter.stop()
 print(f"Salvato tutto")